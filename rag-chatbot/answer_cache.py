@@ -0,0 +1,138 @@
+"""
+Semantic answer cache
+---------------------
+Users ask the same questions over and over ("what can you tell me about this
+material" and its variants). This cache sits in front of the QA chain:
+
+1. exact match on the normalized question text
+2. otherwise nearest neighbour on the question embedding, accepted above a
+   cosine similarity threshold
+
+Every entry records the index version it was answered against; entries from
+older versions are dropped, so re-ingestion invalidates the cache. Eviction is
+LRU with a maximum size, plus a TTL.
+"""
+
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+import numpy as np
+
+DEFAULT_THRESHOLD = 0.92
+DEFAULT_MAX_ENTRIES = 256
+DEFAULT_TTL_SECONDS = 3600
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace."""
+    question = re.sub(r"[^\w\s]", " ", question.lower())
+    return " ".join(question.split())
+
+
+class SemanticAnswerCache:
+    """LRU/TTL cache of answers keyed by normalized question and embedding."""
+
+    def __init__(
+        self,
+        embeddings,
+        threshold: float = DEFAULT_THRESHOLD,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+    ):
+        self.embeddings = embeddings
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+
+    def _embed(self, question: str) -> np.ndarray:
+        vector = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self, index_version: int):
+        now = time.time()
+        stale = [
+            key for key, entry in self._entries.items()
+            if entry["index_version"] != index_version or now - entry["created"] > self.ttl_seconds
+        ]
+        for key in stale:
+            del self._entries[key]
+
+    def lookup(self, question: str, index_version: int) -> Tuple[Optional[Dict], Optional[np.ndarray]]:
+        """Return the cached result for `question` (None on a miss) and the question vector.
+
+        The result has `answer`, `citations`, `matched_question` and `match`
+        ("exact" or "semantic") plus the cosine `similarity`. The vector is
+        None if the question was not embedded (exact match or empty cache);
+        pass it to `store` so a miss costs one embedding, not two.
+        """
+        key = normalize_question(question)
+        with self._lock:
+            self._expire(index_version)
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return {**entry["result"], "matched_question": entry["question"], "match": "exact", "similarity": 1.0}, None
+            if not self._entries:
+                self.misses += 1
+                return None, None
+            keys = list(self._entries)
+            matrix = np.stack([self._entries[k]["vector"] for k in keys])
+
+        # Embedding happens outside the lock; it may be a network call
+        vector = self._embed(question)
+        scores = matrix @ vector
+        best = int(np.argmax(scores))
+        with self._lock:
+            entry = self._entries.get(keys[best])
+            if entry is None or scores[best] < self.threshold:
+                self.misses += 1
+                return None, vector
+            self._entries.move_to_end(keys[best])
+            self.semantic_hits += 1
+            return {
+                **entry["result"],
+                "matched_question": entry["question"],
+                "match": "semantic",
+                "similarity": float(scores[best]),
+            }, vector
+
+    def store(self, question: str, answer: str, citations: str, index_version: int, vector: Optional[np.ndarray] = None):
+        """Cache an answer and its formatted citations (`vector` is the one `lookup` returned, if any)."""
+        key = normalize_question(question)
+        if vector is None:
+            vector = self._embed(question)
+        with self._lock:
+            self._entries[key] = {
+                "question": question,
+                "vector": vector,
+                "result": {"answer": answer, "citations": citations},
+                "index_version": index_version,
+                "created": time.time(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        """Drop every entry (e.g. after a file was added to the live index)."""
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "exact_hits": self.exact_hits,
+                "semantic_hits": self.semantic_hits,
+                "misses": self.misses,
+            }
@@ -0,0 +1,337 @@
+"""
+Headless HTTP query API
+-----------------------
+Serves the same RAG pipeline as the Streamlit UI (`create_vector_store()`,
+`create_qa_chain()` and the shared resources registry from app.py) to
+programmatic clients such as the React front end:
+
+    POST /query     {"question": "...", "stream": false}
+                    -> {"answer", "citations", "sources", "latency_s"}
+                    with "stream": true the answer is sent as server-sent
+                    events: {"token": "..."} ... then {"done": true, ...}
+                    optional "scope": {"files": [...], "first_page": 10,
+                    "last_page": 40} searches only those files/pages
+    GET  /healthz   200 once the index and QA chain are ready, 503 before
+    GET  /metrics   Prometheus text format: requests, latency, in-flight,
+                    query embedding batches
+
+Requests are handled on a thread per connection, with at most
+API_MAX_CONCURRENCY questions in flight (more get 503 so a load balancer can
+retry elsewhere). Query embeddings from concurrent requests are coalesced
+into one encoder call by `MicroBatchingEmbeddings`.
+
+Run with:  python api_server.py --port 8000
+"""
+
+import argparse
+import json
+import logging
+import os
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+import app
+from embeddings import MicroBatchingEmbeddings
+from scoped_search import SearchScope, search_scope
+from shared_resources import get_shared_resources
+from tracing import percentile
+
+logger = logging.getLogger(__name__)
+
+API_HOST = os.getenv("API_HOST", "127.0.0.1")
+API_PORT = int(os.getenv("API_PORT", "8000"))
+API_MAX_CONCURRENCY = int(os.getenv("API_MAX_CONCURRENCY", "8"))
+# Concurrent questions embedded together: batch size cap and how long a question waits for company
+QUERY_BATCH_SIZE = int(os.getenv("QUERY_BATCH_SIZE", "32"))
+QUERY_BATCH_WAIT_MS = float(os.getenv("QUERY_BATCH_WAIT_MS", "5"))
+MAX_BODY_BYTES = 64 * 1024
+LATENCY_WINDOW = 1000
+
+
+class ApiMetrics:
+    """Request counters and a rolling window of /query latencies."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests: Counter = Counter()
+        self.latencies: deque = deque(maxlen=LATENCY_WINDOW)
+        self.in_flight = 0
+        self.started = time.time()
+
+    def record(self, path: str, status: int, latency: float = None):
+        with self._lock:
+            self.requests[(path, status)] += 1
+            if latency is not None:
+                self.latencies.append(latency)
+
+    def track(self, delta: int):
+        with self._lock:
+            self.in_flight += delta
+
+    def render(self) -> str:
+        """Return the metrics in Prometheus text exposition format."""
+        with self._lock:
+            requests = dict(self.requests)
+            latencies = list(self.latencies)
+            in_flight = self.in_flight
+        lines = [
+            "# TYPE rag_requests_total counter",
+            *(
+                f'rag_requests_total{{path="{path}",status="{status}"}} {count}'
+                for (path, status), count in sorted(requests.items())
+            ),
+            "# TYPE rag_query_latency_seconds summary",
+            *(
+                f'rag_query_latency_seconds{{quantile="{q / 100}"}} {percentile(latencies, q):.4f}'
+                for q in (50, 95, 99)
+            ),
+            f"rag_query_latency_seconds_count {len(latencies)}",
+            "# TYPE rag_in_flight_requests gauge",
+            f"rag_in_flight_requests {in_flight}",
+            "# TYPE rag_uptime_seconds gauge",
+            f"rag_uptime_seconds {time.time() - self.started:.0f}",
+            "# TYPE rag_index_version gauge",
+            f"rag_index_version {get_shared_resources().version}",
+        ]
+        vector_store = get_shared_resources().peek("vector_store")
+        embedder = getattr(vector_store, "embeddings", None)
+        embed_stats = embedder.stats() if hasattr(embedder, "stats") else {}
+        if "query_batches" in embed_stats:
+            lines += [
+                "# TYPE rag_query_embedding_batches_total counter",
+                f"rag_query_embedding_batches_total {embed_stats['query_batches']}",
+                "# TYPE rag_query_embeddings_total counter",
+                f"rag_query_embeddings_total {embed_stats['queries_batched']}",
+            ]
+        return "\n".join(lines) + "\n"
+
+
+metrics = ApiMetrics()
+_slots = threading.BoundedSemaphore(API_MAX_CONCURRENCY)
+_warm_up_lock = threading.Lock()
+_warm_up_thread = None
+
+
+def load_vector_store():
+    """Open and sync the index like the UI does, with micro-batched query embedding."""
+    if app.INGEST_MODE == "streaming":
+        pdf_files = sorted(app.DATA_DIR.glob("*.pdf")) if app.DATA_DIR.exists() else []
+        vector_store = app.stream_vector_store(pdf_files)
+    else:
+        vector_store = app.create_vector_store(app.load_documents())
+    if vector_store is not None:
+        vector_store._embedding_function = MicroBatchingEmbeddings(
+            vector_store._embedding_function, QUERY_BATCH_SIZE, QUERY_BATCH_WAIT_MS
+        )
+    return vector_store
+
+
+def get_qa_chain() -> Tuple[object, int]:
+    """Return the shared QA chain and the index version it was built for."""
+    resources = get_shared_resources()
+    version = resources.version
+    vector_store = resources.get("vector_store", load_vector_store)
+    llm = resources.get("llm", app.choose_llm)
+    if vector_store is None or llm is None:
+        return None, version
+    return resources.get("qa_chain", lambda: app.create_qa_chain(llm, vector_store)), version
+
+
+def warm_up():
+    """Build the index and QA chain in the background if no build is running.
+
+    Called at startup and whenever /healthz finds the chain missing (e.g.
+    after a new index version went live), so readiness recovers on its own.
+    """
+    global _warm_up_thread
+    with _warm_up_lock:
+        if _warm_up_thread is None or not _warm_up_thread.is_alive():
+            _warm_up_thread = threading.Thread(target=get_qa_chain, name="warm-up", daemon=True)
+            _warm_up_thread.start()
+
+
+def parse_scope(body) -> Optional[SearchScope]:
+    """Turn the optional "scope" field of a /query body into a SearchScope."""
+    if not body:
+        return None
+    if not isinstance(body, dict):
+        raise TypeError("scope must be an object")
+    files = body.get("files") or []
+    if isinstance(files, str) or not isinstance(files, list):
+        raise TypeError("files must be a list")
+    first_page, last_page = body.get("first_page"), body.get("last_page")
+    return SearchScope(
+        tuple(str(name) for name in files),
+        int(first_page) if first_page is not None else None,
+        int(last_page) if last_page is not None else None,
+    ) or None
+
+
+def source_list(source_docs) -> List[Dict[str, object]]:
+    """Unique (file, page) pairs in rank order, including duplicates of a chunk."""
+    return [
+        {"source_file": source_file, "page_number": page_number}
+        for source_file, page_number in app.citation_sources(source_docs)
+    ]
+
+
+class SSETokenWriter(BaseCallbackHandler):
+    """Forward LLM tokens to the client as server-sent events."""
+
+    def __init__(self, handler: "QueryHandler"):
+        self.handler = handler
+
+    def on_llm_new_token(self, token: str, **kwargs) -> None:
+        self.handler.send_event({"token": token})
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    server_version = "RAGChatbotAPI/1.0"
+
+    def log_message(self, format, *args):
+        logger.info("%s - %s", self.address_string(), format % args)
+
+    def send_json(self, status: int, body: dict, latency: float = None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+        metrics.record(self.path, status, latency)
+
+    def send_event(self, body: dict):
+        self.wfile.write(f"data: {json.dumps(body)}\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/healthz":
+            chain = get_shared_resources().peek("qa_chain")
+            status = 200 if chain is not None else 503
+            if chain is None:
+                warm_up()
+            self.send_json(status, {"status": "ok" if chain else "starting", "index_version": get_shared_resources().version})
+        elif self.path == "/metrics":
+            data = metrics.render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+            metrics.record(self.path, 200)
+        else:
+            self.send_json(404, {"error": "not found"})
+
+    def do_POST(self):
+        if self.path != "/query":
+            self.send_json(404, {"error": "not found"})
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > MAX_BODY_BYTES:
+            self.send_json(413, {"error": "request body too large"})
+            return
+        try:
+            body = json.loads(self.rfile.read(length) or b"{}")
+            question = str(body["question"]).strip()
+        except (ValueError, KeyError, TypeError):
+            self.send_json(400, {"error": 'expected a JSON body with a "question" field'})
+            return
+        try:
+            scope = parse_scope(body.get("scope"))
+        except (ValueError, TypeError):
+            self.send_json(400, {"error": '"scope" must be {"files": [...], "first_page": int, "last_page": int}'})
+            return
+        if not question:
+            self.send_json(400, {"error": "question is empty"})
+            return
+        if not _slots.acquire(blocking=False):
+            self.send_json(503, {"error": "server busy, retry later"})
+            return
+        metrics.track(1)
+        try:
+            self.answer(question, bool(body.get("stream")), scope)
+        finally:
+            metrics.track(-1)
+            _slots.release()
+
+    def answer(self, question: str, stream: bool, scope: Optional[SearchScope] = None):
+        started = time.perf_counter()
+        resources = get_shared_resources()
+        callbacks = []
+        if stream:
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Cache-Control", "no-cache")
+            self.end_headers()
+            callbacks.append(SSETokenWriter(self))
+        try:
+            # Retry once if a new index version goes live between fetching the chain and running it
+            for _ in range(2):
+                chain, version = get_qa_chain()
+                if chain is None:
+                    raise RuntimeError("QA chain unavailable: check the LLM backend and the data folder")
+                with resources.reading(), search_scope(scope):
+                    if version != resources.version:
+                        continue
+                    result = chain({"query": question}, callbacks=callbacks)
+                    break
+            else:
+                raise RuntimeError("the index was just updated, please retry")
+        except (BrokenPipeError, ConnectionResetError):
+            metrics.record(self.path, 499)
+            return
+        except Exception as e:
+            logger.exception("query failed")
+            if stream:
+                self.send_event({"error": str(e)})
+                metrics.record(self.path, 500)
+            else:
+                self.send_json(500, {"error": str(e)})
+            return
+
+        source_docs = result.get("source_documents", [])
+        response = {
+            "answer": result["result"],
+            "citations": app.format_citations(source_docs),
+            "sources": source_list(source_docs),
+            "latency_s": round(time.perf_counter() - started, 3),
+        }
+        if stream:
+            try:
+                self.send_event({"done": True, **response})
+            except (BrokenPipeError, ConnectionResetError):
+                metrics.record(self.path, 499)
+                return
+            metrics.record(self.path, 200, time.perf_counter() - started)
+        else:
+            self.send_json(200, response, time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless HTTP API for the AEC research chatbot")
+    parser.add_argument("--host", default=API_HOST)
+    parser.add_argument("--port", type=int, default=API_PORT)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    app.load_api_keys()
+    # Build the index and chain in the background; /healthz answers 503 until they are ready
+    warm_up()
+    server = ThreadingHTTPServer((args.host, args.port), QueryHandler)
+    server.daemon_threads = True
+    logger.info("listening on http://%s:%d", args.host, args.port)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
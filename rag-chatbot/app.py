@@ -11,35 +11,69 @@ Features
 - Pluggable LLM: IBM watsonx **or** OpenAI (auto-detects from env vars)
 """
 
+import logging
 import os
 import uuid
 from pathlib import Path
-from typing import List, Tuple
+from typing import TYPE_CHECKING, List, Tuple
 
 import streamlit as st
 from dotenv import load_dotenv
 import time
 
-# LangChain core
-from langchain.prompts import ChatPromptTemplate
-from langchain.schema import HumanMessage, SystemMessage
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+# LangChain, Chroma, numpy and the embedding backends are imported lazily, where
+# they are first used, so the UI paints before that import graph is loaded
+# (see warm_up() and check_import_time.py)
+if TYPE_CHECKING:
+    from langchain.chains import RetrievalQA
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from langchain_community.vectorstores import Chroma
 
-# Loaders & Vector store
-from langchain_community.vectorstores import Chroma
-from langchain_community.document_loaders import PyPDFLoader, TextLoader
-# from langchain_community.embeddings import HuggingFaceEmbeddings
+from history_store import get_history_store, safe_session_id
+from index_versions import get_index_builder
+from index_manifest import IndexManifest, embedding_id, sync_documents
+from ingest import DEFAULT_WORKERS, parse_pdf, stream_ingest
+from parse_cache import get_page_cache
+from shared_resources import get_shared_resources
+import tracing
 
-# Chains
-from langchain.chains import RetrievalQA
-
-# Optional LLM backends (we import lazily in choose_llm())
+logger = logging.getLogger(__name__)
 
 APP_TITLE = "AEC Research Chatbot (RAG)"
 # Use desktop data folder
 DATA_DIR = Path.home() / "Desktop" / "data:"
+# Root of the versioned indexes; the live version is `.chroma/versions/<CURRENT>` (see index_versions.py)
 PERSIST_DIR = ".chroma"
-DEFAULT_EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+PARSE_CACHE_DIR = ".parse_cache"
+# "batch" loads every page before indexing; "streaming" uses the process-pool pipeline in ingest.py
+INGEST_MODE = os.getenv("INGEST_MODE", "batch")
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", DEFAULT_WORKERS))
+# Uploaded PDFs are indexed by a durable job queue and a pool of workers (see ingest_queue.py)
+INGEST_QUEUE_PATH = ".ingest_queue.sqlite"
+INGEST_QUEUE_WORKERS = int(os.getenv("INGEST_QUEUE_WORKERS", "2"))
+UPLOAD_EMBED_BATCH = 64
+# Chat history: one append-only JSONL log per session, rendered a page at a time
+HISTORY_DIR = "chat_history"
+LEGACY_HISTORY_FILE = "chat_history.json"
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+# "chroma" (HNSW over float32 vectors) or "quantized" (memory-mapped int8 codes with exact re-ranking, see quantized_store.py)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+# Store one chunk per group of (near-)duplicates, citing every copy (see dedup.py)
+DEDUP_CHUNKS = os.getenv("DEDUP_CHUNKS", "1") != "0"
+DEDUP_THRESHOLD = float(os.getenv("DEDUP_THRESHOLD", "0.9"))
+# "hybrid" (BM25 + vector, fused with reciprocal rank fusion) or "similarity" (vector only)
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")
+RETRIEVAL_K = int(os.getenv("RETRIEVAL_K", "4"))
+# "flat" ranks every chunk; "hierarchical" picks the closest documents, then pages, then their chunks (see hierarchical_index.py)
+RETRIEVAL_SEARCH = os.getenv("RETRIEVAL_SEARCH", "flat")
+# Token budget for retrieved context in the prompt (0 disables packing)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1200"))
+# Semantic answer cache: minimum cosine similarity for a near-duplicate hit, size and TTL
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.92"))
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", "256"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))
+# With both OpenAI and watsonx configured, route between them with hedging and circuit breakers (see llm_router.py)
+LLM_ROUTER = os.getenv("LLM_ROUTER", "1") != "0"
 
 def load_api_keys():
     """Load API keys from desktop data folder."""
@@ -51,99 +85,55 @@ def load_api_keys():
         st.warning("⚠️ No api_keys.env file found in desktop data folder")
         st.info("Create ~/Desktop/data:/api_keys.env with your API keys")
 
-# Page config
-st.set_page_config(
-    page_title=APP_TITLE,
-    page_icon="🏗️",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
-
 def choose_llm():
-    """Choose LLM backend based on available environment variables."""
+    """Choose LLM backend based on available environment variables.
+
+    When both backends are configured (and LLM_ROUTER is on) they are wrapped
+    in an LLMRouter, OpenAI first; otherwise the single backend is returned.
+    """
+    backends = {}
     if os.getenv("OPENAI_API_KEY"):
         try:
             from langchain_openai import ChatOpenAI
-            return ChatOpenAI(
+            backends["openai"] = ChatOpenAI(
                 model="gpt-3.5-turbo",
                 temperature=0.1,
                 streaming=True
             )
         except ImportError:
             st.error("OpenAI backend requested but `langchain-openai` not installed. Run: pip install langchain-openai")
-            return None
-    elif all(os.getenv(k) for k in ["WATSONX_API_KEY", "WATSONX_URL", "WATSONX_PROJECT_ID", "WATSONX_MODEL_ID"]):
+    watsonx_configured = all(os.getenv(k) for k in ["WATSONX_API_KEY", "WATSONX_URL", "WATSONX_PROJECT_ID", "WATSONX_MODEL_ID"])
+    if watsonx_configured:
         try:
-            # Simple HTTP-based IBM watsonx integration
-            import requests
-            import json
-            
-            from langchain_core.language_models.llms import LLM
-            from langchain_core.outputs import LLMResult
-            from typing import Any, List, Optional
-            from pydantic import Field
-            
-            class WatsonxLLMWrapper(LLM):
-                api_key: str = Field(default_factory=lambda: os.getenv("WATSONX_API_KEY", ""))
-                url: str = Field(default_factory=lambda: os.getenv("WATSONX_URL", ""))
-                project_id: str = Field(default_factory=lambda: os.getenv("WATSONX_PROJECT_ID", ""))
-                model_id: str = Field(default_factory=lambda: os.getenv("WATSONX_MODEL_ID", ""))
-                
-                @property
-                def _llm_type(self) -> str:
-                    return "watsonx"
-                
-                def _call(self, prompt: str, stop: Optional[List[str]] = None, **kwargs: Any) -> str:
-                    # IBM watsonx API call with correct authentication
-                    headers = {
-                        "Authorization": f"Bearer {self.api_key}",
-                        "Content-Type": "application/json"
-                    }
-                    
-                    payload = {
-                        "model_id": self.model_id,
-                        "input": prompt,
-                        "parameters": {
-                            "temperature": 0.1,
-                            "max_new_tokens": 1024
-                        },
-                        "project_id": self.project_id
-                    }
-                    
-                    try:
-                        # Try the correct IBM watsonx endpoint
-                        response = requests.post(
-                            f"{self.url}/ml/v1/text/generation?version=2024-11-20",
-                            headers=headers,
-                            json=payload,
-                            timeout=30
-                        )
-                        
-                        if response.status_code == 200:
-                            result = response.json()
-                            return result.get("results", [{}])[0].get("generated_text", "No response generated")
-                        else:
-                            return f"Error: {response.status_code} - {response.text}"
-                    
-                    except Exception as e:
-                        return f"Connection error: {str(e)}"
+            # Simple HTTP-based IBM watsonx integration (streams tokens over SSE)
+            from watsonx_llm import WatsonxLLMWrapper
             
-            return WatsonxLLMWrapper()
+            backends["watsonx"] = WatsonxLLMWrapper()
         except ImportError:
             st.error("IBM watsonx backend requested but `requests` not available")
-            return None
-    else:
-        st.error("No LLM backend configured. Set OPENAI_API_KEY or WATSONX_* environment variables.")
+    if not backends:
+        if not os.getenv("OPENAI_API_KEY") and not watsonx_configured:
+            st.error("No LLM backend configured. Set OPENAI_API_KEY or WATSONX_* environment variables.")
         return None
+    if len(backends) == 1 or not LLM_ROUTER:
+        return next(iter(backends.values()))
+    from llm_router import LLMRouter
+    return LLMRouter(backends=backends)
 
+@tracing.traced("load_documents")
 def load_documents() -> List:
-    """Load all PDFs from the data directory with progress tracking."""
+    """Load all PDFs from the data directory with progress tracking.
+
+    Pages are served from the on-disk parse cache; only new or changed
+    files are run through PyPDFLoader.
+    """
     if not DATA_DIR.exists():
         DATA_DIR.mkdir(exist_ok=True)
         return []
     
     documents = []
     pdf_files = list(DATA_DIR.glob("*.pdf"))
+    page_cache = get_page_cache(PARSE_CACHE_DIR)
     
     if not pdf_files:
         return documents
@@ -159,13 +149,7 @@ def load_documents() -> List:
             progress_bar.progress(progress)
             status_text.text(f"📄 Processing {file_path.name}... ({i+1}/{len(pdf_files)})")
             
-            loader = PyPDFLoader(str(file_path))
-            docs = loader.load()
-            # Add metadata for citations
-            for doc in docs:
-                doc.metadata["source_file"] = file_path.name
-                if "page" in doc.metadata:
-                    doc.metadata["page_number"] = doc.metadata["page"] + 1
+            docs = page_cache.get_or_parse(file_path, parse_pdf)
             documents.extend(docs)
         except Exception as e:
             st.error(f"Error loading {file_path.name}: {e}")
@@ -174,71 +158,407 @@ def load_documents() -> List:
     progress_bar.empty()
     status_text.empty()
     
+    # Forget deleted files so the cache's file count matches the data folder
+    page_cache.prune()
+    cache_stats = page_cache.stats()
+    tracing.set_attrs(
+        files=len(pdf_files), pages=len(documents), parse_cache_misses=cache_stats["misses"],
+        bytes_read=sum(f.stat().st_size for f in pdf_files if f.exists())
+    )
     return documents
 
-def create_vector_store(documents: List, force_rebuild: bool = False) -> Chroma:
-    """Create or load Chroma vector store."""
-    persist_path = Path(PERSIST_DIR)
+def make_text_splitter(chunk_size: int = 1000, chunk_overlap: int = 200) -> "RecursiveCharacterTextSplitter":
+    """Return the splitter used to chunk pages for the vector store."""
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
     
-    # Use a simple embedding function that doesn't require HuggingFace
-    from langchain_community.embeddings import OpenAIEmbeddings
-    import openai
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap,
+        length_function=len,
+        separators=["\n\n", "\n", " ", ""]
+    )
+
+def live_index_dir() -> Path:
+    """Return the directory of the live index version."""
+    return get_index_builder(PERSIST_DIR).versions.current_dir()
+
+def new_vector_store(persist_path: Path, embeddings) -> "Chroma":
+    """Open the VECTOR_BACKEND store in `persist_path`."""
+    if VECTOR_BACKEND == "quantized":
+        from quantized_store import QuantizedVectorStore
+        return QuantizedVectorStore(persist_directory=str(persist_path), embedding_function=embeddings)
+    from langchain_community.vectorstores import Chroma
+    return Chroma(persist_directory=str(persist_path), embedding_function=embeddings)
+
+def vector_count(vector_store) -> int:
+    """Number of chunks in the store, for either backend."""
+    if hasattr(vector_store, "count"):
+        return vector_store.count()
+    return vector_store._collection.count()
+
+def get_deduper(persist_dir: str):
+    """Duplicate-chunk groups of an index directory, or None if DEDUP_CHUNKS is off."""
+    if not DEDUP_CHUNKS:
+        return None
+    from dedup import get_chunk_deduplicator
+    return get_chunk_deduplicator(persist_dir, DEDUP_THRESHOLD)
+
+def get_summaries(persist_dir: str):
+    """Page/document summaries of an index directory, or None unless RETRIEVAL_SEARCH is hierarchical."""
+    if RETRIEVAL_SEARCH != "hierarchical":
+        return None
+    from hierarchical_index import get_summary_index
+    return get_summary_index(persist_dir)
+
+def open_vector_store(force_rebuild: bool = False) -> Tuple["Chroma", IndexManifest]:
+    """Open the live vector store and its manifest of indexed files.
+
+    A store without a manifest predates incremental ingestion; its chunk IDs
+    are unknown, so it is cleared once and re-indexed. Vectors from another
+    embedding model, backend or dedup setting can't be mixed in, so that also
+    forces a full rebuild.
+    """
+    from langchain_community.embeddings import FakeEmbeddings
+    from bm25_index import get_keyword_index
+    from embeddings import get_embeddings
+    from hierarchical_index import remove_summary_index
     
-    # Try to use OpenAI embeddings if API key is available
-    if os.getenv("OPENAI_API_KEY"):
-        embeddings = OpenAIEmbeddings()
-    else:
-        # Fallback to a simple TF-IDF based embedding
-        from langchain_community.embeddings import FakeEmbeddings
-        st.info("Using simple text embeddings (no OpenAI key required)")
-        embeddings = FakeEmbeddings(size=1536)
-    
-    if persist_path.exists() and not force_rebuild and len(documents) > 0:
-        # Load existing vector store
-        with st.spinner("Loading existing vector store..."):
-            vector_store = Chroma(
-                persist_directory=str(persist_path),
-                embedding_function=embeddings
-            )
-        st.success(f"✅ Loaded existing vector store with {vector_store._collection.count()} documents")
-        return vector_store
+    persist_path = live_index_dir()
+    
+    embeddings = get_embeddings()
+    if isinstance(embeddings, FakeEmbeddings):
+        st.info("Using random placeholder embeddings: set OPENAI_API_KEY or install sentence-transformers for real retrieval")
     
+    with st.spinner("Loading existing vector store..."):
+        vector_store = new_vector_store(persist_path, embeddings)
+    manifest = IndexManifest(str(persist_path))
+    
+    stale = not manifest.exists() and vector_count(vector_store) > 0
+    stale = stale or (manifest.exists() and manifest.embedding != embedding_id(embeddings))
+    stale = stale or (manifest.exists() and manifest.backend != VECTOR_BACKEND)
+    stale = stale or (manifest.exists() and manifest.dedup != DEDUP_CHUNKS)
+    if force_rebuild or stale:
+        vector_store.delete_collection()
+        vector_store = new_vector_store(persist_path, embeddings)
+        manifest.files = {}
+        get_keyword_index(str(persist_path)).clear()
+        deduper = get_deduper(str(persist_path))
+        if deduper is not None:
+            deduper.clear()
+        summary_index = get_summaries(str(persist_path))
+        if summary_index is not None:
+            summary_index.clear()
+    manifest.embedding = embedding_id(embeddings)
+    manifest.backend = VECTOR_BACKEND
+    manifest.dedup = DEDUP_CHUNKS
+    
+    # The BM25 keyword index mirrors the collection; rebuild it if it is missing or out of step
+    keyword_index = get_keyword_index(str(persist_path))
+    if RETRIEVAL_MODE == "hybrid" and len(keyword_index) != vector_count(vector_store):
+        with st.spinner("Building keyword index..."):
+            keyword_index.rebuild_from_chroma(vector_store)
+    summary_index = get_summaries(str(persist_path))
+    if summary_index is None:
+        # Not kept up to date during flat search: drop it so it is rebuilt, not reused stale
+        remove_summary_index(str(persist_path))
+    elif len(summary_index) != vector_count(vector_store):
+        with st.spinner("Building page and document summaries..."):
+            summary_index.rebuild_from_store(vector_store)
+    return vector_store, manifest
+
+def report_index_changes(vector_store: "Chroma", manifest: IndexManifest, changes: dict):
+    """Show the outcome of an index sync."""
+    if changes["added"] or changes["changed"] or changes["removed"]:
+        st.success(
+            f"✅ Index updated: {len(changes['added'])} added, {len(changes['changed'])} changed, "
+            f"{len(changes['removed'])} removed ({manifest.chunk_count()} chunks total)"
+        )
+    else:
+        st.success(f"✅ Loaded existing vector store with {vector_count(vector_store)} documents")
+
+@tracing.traced("create_vector_store")
+def create_vector_store(documents: List, force_rebuild: bool = False) -> "Chroma":
+    """Create or load the Chroma vector store and sync it with `documents`.
+
+    Only files that were added, changed or removed since the last sync are
+    embedded or deleted (see index_manifest.py). `force_rebuild` re-indexes
+    everything from scratch.
+    """
     if not documents:
         st.warning("No documents found. Please upload PDFs to the data directory or use the file uploader.")
         return None
     
-    # Create new vector store
-    st.info("🔨 Building vector store... This may take a few minutes.")
+    from bm25_index import get_keyword_index
     
-    # Split documents
-    with st.spinner("📝 Splitting documents into chunks..."):
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
-            separators=["\n\n", "\n", " ", ""]
-        )
-        
-        splits = text_splitter.split_documents(documents)
-        st.info(f"📊 Split documents into {len(splits)} chunks")
-    
-    # Create embeddings and vector store
-    with st.spinner("🧠 Creating embeddings and vector store..."):
-        vector_store = Chroma.from_documents(
-            documents=splits,
-            embedding=embeddings,
-            persist_directory=str(persist_path)
-        )
+    vector_store, manifest = open_vector_store(force_rebuild)
+    
+    # Sync only the files that were added, changed or removed
+    progress_bar = st.progress(0)
+    status_text = st.empty()
+    
+    def report(fraction: float, message: str):
+        progress_bar.progress(min(fraction, 1.0))
+        status_text.text(message)
+    
+    changes = sync_documents(
+        vector_store, manifest, documents, make_text_splitter(),
+        progress=report, keyword_index=get_keyword_index(vector_store._persist_directory),
+        deduper=get_deduper(vector_store._persist_directory),
+        summary_index=get_summaries(vector_store._persist_directory),
+        # Removals follow the data folder, so a PDF that failed to parse keeps its chunks
+        present=[file_path.name for file_path in DATA_DIR.glob("*.pdf")]
+    )
+    
+    progress_bar.empty()
+    status_text.empty()
     
-    st.success(f"✅ Created vector store with {len(splits)} document chunks")
+    report_index_changes(vector_store, manifest, changes)
+    tracing.set_attrs(
+        files_embedded=len(changes["added"]) + len(changes["changed"]),
+        files_removed=len(changes["removed"]), chunks=manifest.chunk_count()
+    )
     return vector_store
 
-def create_qa_chain(llm, vector_store: Chroma) -> RetrievalQA:
-    """Create the RAG QA chain."""
-    retriever = vector_store.as_retriever(
-        search_type="similarity",
-        search_kwargs={"k": 4}
+@tracing.traced("stream_vector_store")
+def stream_vector_store(pdf_files: List[Path], force_rebuild: bool = False) -> "Chroma":
+    """Sync the vector store with `pdf_files` through the streaming pipeline.
+
+    Pages are extracted in a process pool and streamed through chunking and
+    embedding with bounded queues (see ingest.py), so the corpus is never held
+    in memory at once. The progress bar reports pages/sec and chunks/sec.
+    """
+    if not pdf_files:
+        st.warning("No documents found. Please upload PDFs to the data directory or use the file uploader.")
+        return None
+    
+    from bm25_index import get_keyword_index
+    
+    vector_store, manifest = open_vector_store(force_rebuild)
+    
+    progress_bar = st.progress(0)
+    status_text = st.empty()
+    
+    def report(fraction: float, message: str):
+        progress_bar.progress(min(fraction, 1.0))
+        status_text.text(message)
+    
+    def report_error(file_path: Path, error: Exception):
+        st.error(f"Error loading {file_path.name}: {error}")
+    
+    result = stream_ingest(
+        vector_store,
+        manifest,
+        pdf_files,
+        make_text_splitter(),
+        page_cache=get_page_cache(PARSE_CACHE_DIR),
+        workers=INGEST_WORKERS,
+        progress=report,
+        on_error=report_error,
+        keyword_index=get_keyword_index(vector_store._persist_directory),
+        deduper=get_deduper(vector_store._persist_directory),
+        summary_index=get_summaries(vector_store._persist_directory),
+    )
+    
+    progress_bar.empty()
+    status_text.empty()
+    
+    report_index_changes(vector_store, manifest, result["changes"])
+    stats = result["stats"]
+    tracing.set_attrs(pages=stats["pages"], chunks_embedded=stats["chunks"] - stats["duplicates"])
+    st.caption(
+        f"Ingested {stats['pages']} pages / {stats['chunks']} chunks ({stats['duplicates']} duplicates) in {stats['elapsed_s']}s "
+        f"({stats['pages_per_sec']} pages/s, {stats['chunks_per_sec']} chunks/s)"
+    )
+    return vector_store
+
+def build_index_version(version_dir: Path, progress):
+    """Index every PDF in the data folder into a fresh version directory.
+
+    Runs in the background builder thread (see index_versions.py), so it
+    reports through `progress` instead of Streamlit widgets.
+    """
+    from bm25_index import get_keyword_index
+    from embeddings import get_embeddings
+    
+    pdf_files = sorted(DATA_DIR.glob("*.pdf")) if DATA_DIR.exists() else []
+    if not pdf_files:
+        raise RuntimeError(f"No PDFs found in {DATA_DIR}")
+    embeddings = get_embeddings()
+    vector_store = new_vector_store(version_dir, embeddings)
+    manifest = IndexManifest(str(version_dir))
+    manifest.embedding = embedding_id(embeddings)
+    manifest.backend = VECTOR_BACKEND
+    manifest.dedup = DEDUP_CHUNKS
+    
+    def report_error(file_path: Path, error: Exception):
+        logger.warning("index build: skipping %s: %s", file_path.name, error)
+    
+    stream_ingest(
+        vector_store,
+        manifest,
+        pdf_files,
+        make_text_splitter(),
+        page_cache=get_page_cache(PARSE_CACHE_DIR),
+        workers=INGEST_WORKERS,
+        progress=progress,
+        on_error=report_error,
+        keyword_index=get_keyword_index(str(version_dir)),
+        deduper=get_deduper(str(version_dir)),
+        summary_index=get_summaries(str(version_dir)),
+    )
+    manifest.save()
+
+def switch_index_version(old_dir: Path, new_dir: Path):
+    """Point every session at the new index once in-flight queries finish."""
+    from bm25_index import forget_keyword_index
+    from dedup import forget_chunk_deduplicator
+    from hierarchical_index import forget_summary_index
+    from scoped_search import forget_scope_partitions
+    
+    get_shared_resources().invalidate("vector_store", "qa_chain")
+    forget_keyword_index(str(old_dir))
+    forget_chunk_deduplicator(str(old_dir))
+    forget_summary_index(str(old_dir))
+    forget_scope_partitions(str(old_dir))
+    try:
+        # Release the old version's Chroma client before its files are deleted
+        from chromadb.api.shared_system_client import SharedSystemClient
+        system = SharedSystemClient._identifier_to_system.pop(str(old_dir), None)
+        if system is not None:
+            system.stop()
+    except Exception as e:
+        logger.debug("could not release Chroma client for %s: %s", old_dir, e)
+    logger.info("index switched from %s to %s", old_dir.name, new_dir.name)
+
+def start_index_rebuild() -> bool:
+    """Build a new index version in the background; False if one is already building."""
+    return get_index_builder(PERSIST_DIR).start(build_index_version, on_switch=switch_index_version)
+
+def ingest_upload(job: dict, progress) -> dict:
+    """Parse, chunk and embed one uploaded PDF and add it to the live index.
+
+    Runs in an ingest queue worker while chat keeps answering from the same
+    index. Pages are extracted in this worker thread; chunks are embedded
+    outside the index write lock, warming the embedding cache so that storing
+    them under the lock is quick.
+    """
+    from bm25_index import get_keyword_index
+    from index_manifest import index_file
+    from ingest import iter_file_pages
+    from ingest_queue import index_write_lock
+    
+    resources = get_shared_resources()
+    vector_store = resources.peek("vector_store")
+    if vector_store is None:
+        raise RuntimeError("the index is not loaded")
+    file_path = Path(job["path"])
+    
+    progress(0.05, "📄 Extracting pages...")
+    errors = []
+    extracted = next(iter_file_pages(
+        [file_path], get_page_cache(PARSE_CACHE_DIR), workers=1, on_error=lambda path, e: errors.append(e)
+    ), None)
+    if extracted is None:
+        raise errors[0] if errors else RuntimeError(f"could not read {file_path.name}")
+    docs = extracted[1]
+    
+    splitter = make_text_splitter()
+    embeddings = vector_store.embeddings
+    if hasattr(embeddings, "underlying"):
+        # Cached embeddings: embed here, in parallel with other jobs
+        texts = [split.page_content for split in splitter.split_documents(docs)]
+        for start in range(0, len(texts), UPLOAD_EMBED_BATCH):
+            embeddings.embed_documents(texts[start:start + UPLOAD_EMBED_BATCH])
+            done = min(start + UPLOAD_EMBED_BATCH, len(texts))
+            progress(0.2 + 0.6 * done / max(len(texts), 1), f"🧠 Embedding {done}/{len(texts)} chunks...")
+    
+    progress(0.8, "🗂️ Adding to the index...")
+    persist_dir = vector_store._persist_directory
+    with index_write_lock:
+        chunks = index_file(
+            vector_store, IndexManifest(persist_dir), file_path.name, docs, splitter,
+            progress=lambda fraction: progress(0.8 + 0.2 * fraction, "🗂️ Adding to the index..."),
+            keyword_index=get_keyword_index(persist_dir),
+            deduper=get_deduper(persist_dir),
+            summary_index=get_summaries(persist_dir)
+        )
+    if chunks is None:
+        return {"chunks": 0, "message": f"Already indexed ({len(docs)} pages)"}
+    # Cached answers may be missing the new file
+    answer_cache = resources.peek("answer_cache")
+    if answer_cache:
+        answer_cache.clear()
+    logger.info("indexed upload %s: %d pages, %d chunks", file_path.name, len(docs), chunks)
+    return {"chunks": chunks, "message": f"Indexed {len(docs)} pages, {chunks} chunks"}
+
+def get_upload_queue():
+    """Return the process-wide upload queue; its workers wait for the live index and for rebuilds to finish."""
+    from ingest_queue import get_ingest_queue
+    
+    builder = get_index_builder(PERSIST_DIR)
+    return get_ingest_queue(
+        INGEST_QUEUE_PATH,
+        ingest_upload,
+        workers=INGEST_QUEUE_WORKERS,
+        ready=lambda: get_shared_resources().peek("vector_store") is not None and not builder.is_building()
     )
+
+def format_eta(seconds) -> str:
+    if seconds is None:
+        return ""
+    if seconds < 60:
+        return f" · ETA {max(1, round(seconds))}s"
+    return f" · ETA {seconds / 60:.1f} min"
+
+def create_retriever(vector_store: "Chroma"):
+    """Return the retriever for the QA chain.
+
+    "hybrid" fuses BM25 keyword search with vector search (see bm25_index.py);
+    "similarity" is plain dense search. With RETRIEVAL_SEARCH=hierarchical the
+    dense search goes through the document/page summaries first. A search
+    scope set by the caller (see scoped_search.py) restricts the search to
+    the chunks of the selected files and pages. Results are deduped, merged
+    per page and packed into CONTEXT_TOKEN_BUDGET tokens (see
+    context_packing.py).
+    """
+    from bm25_index import HybridRetriever, get_keyword_index
+    from context_packing import ContextPackingRetriever
+    from hierarchical_index import HierarchicalRetriever
+    from scoped_search import ScopedRetriever, get_scope_partitions
+    
+    summary_index = get_summaries(vector_store._persist_directory)
+    if RETRIEVAL_MODE == "hybrid":
+        retriever = HybridRetriever(
+            vector_store=vector_store,
+            keyword_index=get_keyword_index(vector_store._persist_directory),
+            summary_index=summary_index,
+            k=RETRIEVAL_K
+        )
+    elif summary_index is not None:
+        retriever = HierarchicalRetriever(vector_store=vector_store, summary_index=summary_index, k=RETRIEVAL_K)
+    else:
+        retriever = vector_store.as_retriever(
+            search_type="similarity",
+            search_kwargs={"k": RETRIEVAL_K}
+        )
+    retriever = ScopedRetriever(
+        base_retriever=retriever,
+        vector_store=vector_store,
+        partitions=get_scope_partitions(vector_store._persist_directory),
+        keyword_index=get_keyword_index(vector_store._persist_directory) if RETRIEVAL_MODE == "hybrid" else None,
+        deduper=get_deduper(vector_store._persist_directory),
+        k=RETRIEVAL_K
+    )
+    if CONTEXT_TOKEN_BUDGET > 0:
+        retriever = ContextPackingRetriever(base_retriever=retriever, token_budget=CONTEXT_TOKEN_BUDGET)
+    return retriever
+
+def create_qa_chain(llm, vector_store: "Chroma") -> "RetrievalQA":
+    """Create the RAG QA chain."""
+    from langchain.chains import RetrievalQA
+    from langchain.prompts import ChatPromptTemplate
+    
+    retriever = create_retriever(vector_store)
     
     prompt_template = """You are an expert architecture and engineering research assistant. 
     Use the following context to answer questions about AEC (Architecture, Engineering, Construction) topics.
@@ -264,21 +584,207 @@ def create_qa_chain(llm, vector_store: Chroma) -> RetrievalQA:
     
     return chain
 
+def citation_sources(source_docs) -> List[Tuple[str, object]]:
+    """Unique (file, page) pairs of the source documents, in rank order.
+
+    A chunk that stands for a group of duplicates cites every file and page
+    the passage appears on (see dedup.py).
+    """
+    deduper = get_deduper(str(live_index_dir()))
+    sources = []
+    for doc in source_docs:
+        if deduper is not None:
+            doc_sources = deduper.citations(doc)
+        else:
+            doc_sources = [(doc.metadata.get("source_file", "Unknown"), doc.metadata.get("page_number", "Unknown"))]
+        for source in doc_sources:
+            if source not in sources:
+                sources.append(source)
+    return sources
+
 def format_citations(source_docs) -> str:
     """Format source documents as citations."""
     citations = []
-    for doc in source_docs:
-        source_file = doc.metadata.get("source_file", "Unknown")
-        page_num = doc.metadata.get("page_number", "Unknown")
+    for source_file, page_num in citation_sources(source_docs):
         citations.append(f"📄 {source_file}, p.{page_num}")
     
     if citations:
         return "\n\n**Sources:**\n" + "\n".join(citations)
     return ""
 
+def get_chat_session_id() -> str:
+    """Return this browser's chat session ID, kept in the URL so it survives reloads."""
+    if "chat_session_id" not in st.session_state:
+        if hasattr(st, "query_params"):
+            session_id = st.query_params.get("sid")
+        else:  # Streamlit < 1.30
+            session_id = st.experimental_get_query_params().get("sid", [None])[0]
+        if not session_id:
+            session_id = uuid.uuid4().hex[:12]
+            if hasattr(st, "query_params"):
+                st.query_params["sid"] = session_id
+            else:
+                st.experimental_set_query_params(sid=session_id)
+        st.session_state.chat_session_id = safe_session_id(session_id)
+    return st.session_state.chat_session_id
+
+def add_message(message: dict):
+    """Show a message in this session and append it to the session's history log."""
+    st.session_state.messages.append(message)
+    with tracing.span("history_append") as attrs:
+        attrs["bytes_written"] = get_history_store(HISTORY_DIR).append(get_chat_session_id(), message)
+    # Keep only a bounded window in memory; older messages stay on disk.
+    # The window grows with every older page the user loads, so those stay visible
+    overflow = len(st.session_state.messages) - st.session_state.history_window
+    if overflow > 0:
+        del st.session_state.messages[:overflow]
+        st.session_state.history_start += overflow
+
+def answer_question(prompt: str, resources):
+    """Answer one chat question: cache lookup, QA chain, rendering and history."""
+    from answer_cache import SemanticAnswerCache
+    from callback_handlers import StreamlitTokenHandler, TracingCallbackHandler
+    from context_packing import last_packing_report
+    from scoped_search import search_scope
+    
+    scope = st.session_state.get("search_scope")
+    # Add user message to chat history
+    add_message({"role": "user", "content": prompt})
+    
+    # Display user message
+    with st.chat_message("user"):
+        st.markdown(prompt)
+    
+    # Generate response
+    if st.session_state.qa_chain:
+        with st.chat_message("assistant"):
+            # Tokens are rendered into this placeholder as the LLM streams them
+            placeholder = st.empty()
+            placeholder.markdown("_Thinking..._")
+            token_handler = StreamlitTokenHandler(placeholder)
+            answer_cache = resources.get(
+                "answer_cache",
+                lambda: SemanticAnswerCache(
+                    st.session_state.vector_store.embeddings,
+                    threshold=ANSWER_CACHE_THRESHOLD,
+                    max_entries=ANSWER_CACHE_SIZE,
+                    ttl_seconds=ANSWER_CACHE_TTL
+                )
+            )
+            try:
+                # Repeated and near-duplicate questions are answered from the cache (unscoped answers only)
+                with tracing.span("answer_cache_lookup") as attrs:
+                    cached, question_vector = answer_cache.lookup(prompt, resources.version) if not scope else (None, None)
+                    attrs["hit"] = cached["match"] if cached else None
+                if cached:
+                    response = cached["answer"]
+                    citations = cached["citations"]
+                    placeholder.markdown(response)
+                    if citations:
+                        st.markdown(citations)
+                    st.caption(
+                        f"⚡ Answered from cache ({cached['match']} match, similarity {cached['similarity']:.2f}) "
+                        f"in {time.perf_counter() - token_handler.started:.3f}s"
+                    )
+                else:
+                    with resources.reading(), search_scope(scope):
+                        if st.session_state.index_version != resources.version:
+                            # A new index version went live since this run started; the old one may be gone
+                            raise RuntimeError("the index was just updated, please ask again")
+                        result = st.session_state.qa_chain(
+                            {"query": prompt}, callbacks=[token_handler, TracingCallbackHandler()]
+                        )
+                    
+                    response = result["result"]
+                    source_docs = result.get("source_documents", [])
+                    citations = format_citations(source_docs)
+                    
+                    placeholder.markdown(response)
+                    if citations:
+                        st.markdown(citations)
+                    
+                    ttft = token_handler.time_to_first_token
+                    total = time.perf_counter() - token_handler.started
+                    packing = last_packing_report() if CONTEXT_TOKEN_BUDGET > 0 else None
+                    logger.info(
+                        "answer ttft=%s total=%.3fs context_tokens=%s saved=%s query=%r",
+                        f"{ttft:.3f}s" if ttft is not None else "n/a", total,
+                        packing["tokens_out"] if packing else "n/a",
+                        packing["tokens_saved"] if packing else "n/a", prompt
+                    )
+                    if scope:
+                        st.caption(f"🔎 Searched only {scope.label()}")
+                    if ttft is not None:
+                        st.caption(f"⏱️ First token after {ttft:.2f}s · full answer after {total:.2f}s")
+                    if packing:
+                        st.caption(
+                            f"🧮 Context: {packing['tokens_out']} tokens from {packing['chunks_out']} passages "
+                            f"({packing['tokens_saved']} tokens saved)"
+                        )
+                    
+                    if not scope:
+                        answer_cache.store(prompt, response, citations, resources.version, question_vector)
+                
+                # Add assistant response to chat history
+                add_message({
+                    "role": "assistant", 
+                    "content": response,
+                    "sources": citations
+                })
+                
+            except Exception as e:
+                error_msg = f"Error generating response: {e}"
+                st.error(error_msg)
+                add_message({
+                    "role": "assistant", 
+                    "content": error_msg
+                })
+    else:
+        error_msg = "No QA chain available. Please configure your LLM backend and ensure documents are loaded."
+        st.error(error_msg)
+        add_message({
+            "role": "assistant", 
+            "content": error_msg
+        })
+
+def warm_up():
+    """Load the heavy modules, the embedding model and the LLM client once per process.
+
+    Started in a background thread by main(), so the first page paints while
+    this runs and the first question finds everything already loaded.
+    """
+    started = time.perf_counter()
+    try:
+        import langchain.chains  # noqa: F401
+        import langchain_community.vectorstores  # noqa: F401
+        import callback_handlers  # noqa: F401
+        from bm25_index import get_keyword_index
+        from embeddings import get_embeddings
+        
+        get_embeddings()
+        get_keyword_index(str(live_index_dir()))
+        if os.getenv("OPENAI_API_KEY") or all(os.getenv(k) for k in ["WATSONX_API_KEY", "WATSONX_URL", "WATSONX_PROJECT_ID", "WATSONX_MODEL_ID"]):
+            get_shared_resources().get("llm", choose_llm)
+    except Exception:
+        logger.exception("warm-up failed")
+    logger.info("warm-up finished in %.2fs", time.perf_counter() - started)
+
 def main():
+    # Page config (set here rather than at import so api_server.py can reuse this module)
+    st.set_page_config(
+        page_title=APP_TITLE,
+        page_icon="🏗️",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
+    
     # Load API keys from desktop data folder first
     load_api_keys()
+    # Import LangChain/Chroma and load the embedding model and LLM client off the UI thread
+    get_shared_resources().run_in_background("warm-up", warm_up)
+    if Path(INGEST_QUEUE_PATH).exists():
+        # Resume upload jobs queued or interrupted before a restart
+        get_upload_queue()
     
     st.title(f"🏗️ {APP_TITLE}")
     st.markdown("Chat with your AEC documents using AI-powered search and generation")
@@ -300,48 +806,111 @@ def main():
             help="Upload your AEC documents, specs, codes, or research papers"
         )
         
-        # Save uploaded files
+        # Queue uploaded files for background indexing (once per upload; same content is never re-queued)
         if uploaded_files:
+            upload_queue = get_upload_queue()
+            upload_jobs = st.session_state.setdefault("upload_jobs", {})
             for uploaded_file in uploaded_files:
-                file_path = DATA_DIR / uploaded_file.name
-                with open(file_path, "wb") as f:
-                    f.write(uploaded_file.getbuffer())
-            st.success(f"Saved {len(uploaded_files)} files to data directory")
+                key = getattr(uploaded_file, "file_id", None) or (uploaded_file.name, uploaded_file.size)
+                if key not in upload_jobs:
+                    job = upload_queue.enqueue(uploaded_file.name, uploaded_file.getvalue(), DATA_DIR)
+                    upload_jobs[key] = (uploaded_file.name, job["id"])
+            
+            jobs = {job["id"]: job for job in upload_queue.jobs([job_id for _, job_id in upload_jobs.values()])}
+            active = False
+            for name, job_id in upload_jobs.values():
+                job = jobs.get(job_id)
+                if job is None:
+                    continue
+                if job["name"] != name:
+                    st.caption(f"♻️ {name}: same content as {job['name']}")
+                elif job["state"] == "queued":
+                    active = True
+                    st.caption(f"⏳ {name}: {job['message']}{format_eta(job['eta_s'])}")
+                elif job["state"] == "running":
+                    active = True
+                    st.progress(job["fraction"])
+                    st.caption(f"⚙️ {name}: {job['message']}{format_eta(job['eta_s'])}")
+                elif job["state"] == "done":
+                    st.caption(f"✅ {name}: {job['message']}")
+                else:
+                    st.error(f"❌ {name}: {job['error']}")
+            if active:
+                # Clicking reruns the script, which redraws the status
+                st.button("↻ Refresh upload status")
+        
+        # Ingestion mode
+        streaming = st.checkbox(
+            "⚡ Streaming ingestion",
+            value=INGEST_MODE == "streaming",
+            help="Extract PDFs in parallel and stream pages → chunks → embeddings without loading the whole corpus into memory"
+        )
         
         # Rebuild index button
-        if st.button("🔄 Rebuild Index", help="Rebuild the vector database"):
-            # Clear existing vector store
-            persist_path = Path(PERSIST_DIR)
-            if persist_path.exists():
-                import shutil
-                shutil.rmtree(persist_path)
-            st.experimental_rerun()
+        builder = get_index_builder(PERSIST_DIR)
+        if st.button("🔄 Rebuild Index", help="Re-index the data folder in the background; chat keeps using the current index until the new one is ready", disabled=builder.is_building()):
+            start_index_rebuild()
+            st.rerun()
+        
+        # Background rebuild progress
+        build = builder.status()
+        if build["state"] == "building":
+            st.progress(build["fraction"])
+            st.caption(f"🏗️ Building index {build['version']} ({build['elapsed_s']}s): {build['message']}")
+            if st.button("↻ Refresh status"):
+                st.rerun()
+        elif build["state"] == "done":
+            st.caption(f"✅ Index {build['version']} is live")
+        elif build["state"] == "failed":
+            st.error(f"❌ Index rebuild failed: {build['error']} (still serving the previous index)")
+        
+        # Search scope: one file (optionally a page range) or several files instead of the whole collection
+        st.subheader("Search scope")
+        from scoped_search import SearchScope, get_scope_partitions
+        
+        partitions = get_scope_partitions(str(live_index_dir()))
+        partitions.refresh()
+        selected = st.multiselect(
+            "Search only in",
+            sorted(partitions.files),
+            help="Leave empty to search every indexed document"
+        )
+        first_page = last_page = None
+        if len(selected) == 1:
+            low, high = partitions.page_range(selected[0])
+            if high > low:
+                first_page, last_page = st.slider("Pages", low, high, (low, high))
+                if (first_page, last_page) == (low, high):
+                    first_page = last_page = None
+        st.session_state.search_scope = SearchScope(tuple(selected), first_page, last_page) if selected else None
         
         # Clear chat history button
         if st.button("🗑️ Clear Chat History", help="Clear all chat messages"):
             st.session_state.messages = []
-            chat_history_file = Path("chat_history.json")
-            if chat_history_file.exists():
-                chat_history_file.unlink()
-            st.experimental_rerun()
+            st.session_state.history_start = 0
+            st.session_state.history_window = 2 * HISTORY_PAGE_SIZE
+            get_history_store(HISTORY_DIR).clear(get_chat_session_id())
+            st.rerun()
         
         # Force refresh button
         if st.button("🔄 Force Refresh", help="Force refresh the app and reinitialize everything"):
-            # Clear all session state
+            # Clear all session state and shared resources and rebuild the index in the background;
+            # the current index keeps serving until the new version is switched in
             for key in list(st.session_state.keys()):
                 del st.session_state[key]
-            # Clear vector store directory
-            persist_path = Path(PERSIST_DIR)
-            if persist_path.exists():
-                import shutil
-                shutil.rmtree(persist_path)
-            st.experimental_rerun()
+            get_shared_resources().invalidate()
+            start_index_rebuild()
+            st.rerun()
         
         # Environment status
         st.subheader("LLM Backend Status")
-        if os.getenv("OPENAI_API_KEY"):
+        openai_configured = bool(os.getenv("OPENAI_API_KEY"))
+        watsonx_configured = all(os.getenv(k) for k in ["WATSONX_API_KEY", "WATSONX_URL", "WATSONX_PROJECT_ID", "WATSONX_MODEL_ID"])
+        if openai_configured and watsonx_configured and LLM_ROUTER:
+            st.success("✅ OpenAI and IBM watsonx configured (routed with hedging and failover)")
+        elif openai_configured:
             st.success("✅ OpenAI configured")
-        elif all(os.getenv(k) for k in ["WATSONX_API_KEY", "WATSONX_URL", "WATSONX_PROJECT_ID", "WATSONX_MODEL_ID"]):
+        elif watsonx_configured:
             st.success("✅ IBM watsonx configured")
         else:
             st.error("❌ No LLM backend configured")
@@ -356,40 +925,30 @@ def main():
     if "qa_chain" not in st.session_state:
         st.session_state.qa_chain = None
     
-    # Load chat history from file if it exists
-    chat_history_file = Path("chat_history.json")
-    if chat_history_file.exists() and not st.session_state.messages:
-        try:
-            import json
-            with open(chat_history_file, 'r') as f:
-                st.session_state.messages = json.load(f)
-        except:
-            st.session_state.messages = []
+    # The vector store, LLM and QA chain are shared by all sessions in the process;
+    # session_state only holds references. Drop them if the index was invalidated.
+    resources = get_shared_resources()
+    if st.session_state.get("index_version") != resources.version:
+        st.session_state.vector_store = None
+        st.session_state.qa_chain = None
+        st.session_state.index_version = resources.version
     
-    # Load documents and create vector store (with caching)
-    with st.spinner("Loading documents..."):
-        documents = load_documents()
-    
-    # Create vector store if we have documents and no vector store
-    if documents and not st.session_state.get('vector_store'):
-        with st.spinner("Creating vector store..."):
-            vector_store = create_vector_store(documents)
-        if vector_store:
-            st.session_state.vector_store = vector_store
-    
-    # Initialize QA chain if we have vector store but no QA chain
-    if st.session_state.get('vector_store') and not st.session_state.get('qa_chain'):
-        with st.spinner("Initializing QA chain..."):
-            llm = choose_llm()
-            if llm:
-                st.session_state.qa_chain = create_qa_chain(llm, st.session_state.vector_store)
-                st.success("✅ QA chain initialized successfully!")
-            else:
-                st.error("❌ Failed to initialize LLM backend")
+    # Load the most recent page of this session's chat history; older pages load on demand
+    history = get_history_store(HISTORY_DIR)
+    chat_session_id = get_chat_session_id()
+    if "history_start" not in st.session_state:
+        # The first session opened after upgrading gets the old whole-file history
+        history.import_legacy(Path(LEGACY_HISTORY_FILE), chat_session_id)
+        st.session_state.history_start, st.session_state.messages = history.tail(chat_session_id, HISTORY_PAGE_SIZE)
+        st.session_state.history_window = 2 * HISTORY_PAGE_SIZE
     
     # Chat interface
     st.header("💬 Chat with Your Documents")
     
+    # Filled once the index and QA chain are ready, but placed above the chat
+    status_area = st.container()
+    debug_area = st.container()
+    
     # Show welcome message if no chat history
     if not st.session_state.messages:
         st.markdown("👋 Welcome! I'm your AEC Research Assistant. Ask me anything about your documents!")
@@ -398,20 +957,16 @@ def main():
         st.markdown("- 'Summarize the key concepts'")
         st.markdown("- 'Explain machine learning algorithms'")
     
-    # Show status message if no documents are loaded
-    if not documents:
-        st.warning("📁 **No documents found!** Please ensure PDF files are in the desktop data folder or upload them using the sidebar.")
-    else:
-        st.success(f"📚 **{len(documents)} documents loaded** from your desktop data folder")
-    
-    # Debug information
-    with st.expander("🔧 Debug Information"):
-        st.write(f"**Documents loaded:** {len(documents) if documents else 0}")
-        st.write(f"**Vector store:** {'✅ Available' if st.session_state.get('vector_store') else '❌ Not available'}")
-        st.write(f"**QA chain:** {'✅ Available' if st.session_state.get('qa_chain') else '❌ Not available'}")
-        st.write(f"**API keys loaded:** {'✅ Yes' if os.getenv('WATSONX_API_KEY') else '❌ No'}")
+    # Chat history and input render before the index loads, so the page paints immediately
+    if st.session_state.history_start > 0:
+        if st.button(f"⬆️ Load older messages ({st.session_state.history_start} more)"):
+            start = max(0, st.session_state.history_start - HISTORY_PAGE_SIZE)
+            older = history.read(chat_session_id, start, st.session_state.history_start)
+            st.session_state.messages = older + st.session_state.messages
+            st.session_state.history_start = start
+            st.session_state.history_window += len(older)
+            st.rerun()
     
-    # Display chat history
     for message in st.session_state.messages:
         with st.chat_message(message["role"]):
             st.markdown(message["content"])
@@ -421,61 +976,135 @@ def main():
     # Chat input - always visible at the bottom
     st.markdown("---")
     prompt = st.chat_input("💬 Ask about your AEC documents...")
-    if prompt:
-        # Add user message to chat history
-        st.session_state.messages.append({"role": "user", "content": prompt})
+    
+    # Load documents, the vector store and the QA chain (already warming up in the background)
+    with status_area:
+        if streaming:
+            # Streaming mode never holds every page in memory; only the file list is needed here
+            documents = []
+            pdf_files = sorted(DATA_DIR.glob("*.pdf")) if DATA_DIR.exists() else []
+            if pdf_files and not st.session_state.get('vector_store'):
+                with st.spinner("Creating vector store..."):
+                    vector_store = resources.get("vector_store", lambda: stream_vector_store(pdf_files))
+                if vector_store:
+                    st.session_state.vector_store = vector_store
+        else:
+            # Load documents and create vector store (with caching)
+            with st.spinner("Loading documents..."):
+                documents = load_documents()
+            pdf_files = []
         
-        # Save chat history to file
-        import json
-        chat_history_file = Path("chat_history.json")
-        with open(chat_history_file, 'w') as f:
-            json.dump(st.session_state.messages, f, indent=2)
+            # Create vector store if we have documents and no vector store
+            if documents and not st.session_state.get('vector_store'):
+                with st.spinner("Creating vector store..."):
+                    vector_store = resources.get("vector_store", lambda: create_vector_store(documents))
+                if vector_store:
+                    st.session_state.vector_store = vector_store
         
-        # Display user message
-        with st.chat_message("user"):
-            st.markdown(prompt)
+        # Initialize QA chain if we have vector store but no QA chain
+        if st.session_state.get('vector_store') and not st.session_state.get('qa_chain'):
+            with st.spinner("Initializing QA chain..."):
+                llm = resources.get("llm", choose_llm)
+                if llm:
+                    vector_store = st.session_state.vector_store
+                    st.session_state.qa_chain = resources.get("qa_chain", lambda: create_qa_chain(llm, vector_store))
+                    st.success("✅ QA chain initialized successfully!")
+                else:
+                    st.error("❌ Failed to initialize LLM backend")
         
-        # Generate response
-        if st.session_state.qa_chain:
-            with st.chat_message("assistant"):
-                with st.spinner("Thinking..."):
-                    try:
-                        result = st.session_state.qa_chain({"query": prompt})
-                        
-                        response = result["result"]
-                        source_docs = result.get("source_documents", [])
-                        citations = format_citations(source_docs)
-                        
-                        st.markdown(response)
-                        if citations:
-                            st.markdown(citations)
-                        
-                        # Add assistant response to chat history
-                        st.session_state.messages.append({
-                            "role": "assistant", 
-                            "content": response,
-                            "sources": citations
-                        })
-                        
-                        # Save chat history to file
-                        import json
-                        with open(chat_history_file, 'w') as f:
-                            json.dump(st.session_state.messages, f, indent=2)
-                        
-                    except Exception as e:
-                        error_msg = f"Error generating response: {e}"
-                        st.error(error_msg)
-                        st.session_state.messages.append({
-                            "role": "assistant", 
-                            "content": error_msg
-                        })
+        # Show status message if no documents are loaded
+        if pdf_files:
+            st.success(f"📚 **{len(pdf_files)} PDF files indexed** from your desktop data folder")
+        elif not documents:
+            st.warning("📁 **No documents found!** Please ensure PDF files are in the desktop data folder or upload them using the sidebar.")
         else:
-            error_msg = "No QA chain available. Please configure your LLM backend and ensure documents are loaded."
-            st.error(error_msg)
-            st.session_state.messages.append({
-                "role": "assistant", 
-                "content": error_msg
-            })
+            st.success(f"📚 **{len(documents)} documents loaded** from your desktop data folder")
+    
+    # Debug information
+    with debug_area:
+        with st.expander("🔧 Debug Information"):
+            from bm25_index import get_keyword_index
+            from context_packing import packing_totals
+            from watsonx_client import WatsonxClient
+            
+            st.write(f"**Documents loaded:** {len(documents) if documents else 0}")
+            st.write(f"**Ingestion mode:** {'streaming' if streaming else 'batch'}")
+            st.write(f"**Retrieval mode:** {RETRIEVAL_MODE} (k={RETRIEVAL_K}, keyword index: {len(get_keyword_index(str(live_index_dir())))} chunks)")
+            summary_index = get_summaries(str(live_index_dir()))
+            if summary_index is not None:
+                summaries = summary_index.stats()
+                st.write(f"**Search:** {RETRIEVAL_SEARCH} (summaries of {summaries['documents']} documents / {summaries['pages']} pages over {summaries['chunks']} chunks)")
+            else:
+                st.write(f"**Search:** {RETRIEVAL_SEARCH}")
+            embedder = getattr(st.session_state.get('vector_store'), "embeddings", None)
+            st.write(f"**Embeddings:** {embedding_id(embedder) if embedder else 'n/a'}")
+            embed_stats = embedder.stats() if hasattr(embedder, "stats") else {}
+            if "batches" in embed_stats:
+                st.write(f"**Embedding batches:** {embed_stats['batches']} ({embed_stats['texts']} texts), p50 {embed_stats['p50_ms']} ms / p95 {embed_stats['p95_ms']} ms per batch")
+            if "cache_hits" in embed_stats:
+                st.write(f"**Embedding cache:** {embed_stats['cache_hits']} hits / {embed_stats['cache_misses']} misses ({embed_stats['cache_entries']} vectors, {embed_stats['cache_mb']} MB)")
+            st.write(f"**Vector store:** {'✅ Available' if st.session_state.get('vector_store') else '❌ Not available'}")
+            deduper = get_deduper(str(live_index_dir()))
+            if deduper:
+                dd = deduper.stats()
+                st.write(f"**Duplicate chunks:** {dd['duplicates']} folded into {dd['groups']} groups ({dd['chunks']} chunks stored, threshold {DEDUP_THRESHOLD})")
+            memory = getattr(st.session_state.get('vector_store'), "memory_bytes", None)
+            if memory:
+                mem = memory()
+                st.write(f"**Vector backend:** quantized, {mem['scan_bytes'] / 1e6:.1f} MB int8 codes scanned per query, {mem['rerank_bytes'] / 1e6:.1f} MB float vectors on disk for re-ranking")
+            else:
+                st.write(f"**Vector backend:** {VECTOR_BACKEND}")
+            st.write(f"**QA chain:** {'✅ Available' if st.session_state.get('qa_chain') else '❌ Not available'}")
+            st.write(f"**Shared index version:** {resources.version} (live index: `{live_index_dir()}`)")
+            if CONTEXT_TOKEN_BUDGET > 0:
+                totals = packing_totals()
+                st.write(f"**Context packing:** budget {CONTEXT_TOKEN_BUDGET} tokens, {totals['tokens_in'] - totals['tokens_out']} tokens saved over {totals['queries']} queries")
+            answer_cache = resources.peek("answer_cache")
+            if answer_cache:
+                ac = answer_cache.stats()
+                st.write(f"**Answer cache:** {ac['exact_hits']} exact / {ac['semantic_hits']} semantic hits, {ac['misses']} misses ({ac['entries']} entries)")
+            shared_llm = resources.peek("llm")
+            routed = getattr(shared_llm, "backends", None) or {"llm": shared_llm}
+            if hasattr(shared_llm, "stats"):
+                for name, rs in shared_llm.stats().items():
+                    st.write(
+                        f"**LLM {name}:** {rs['state']}, {rs['requests']} requests ({rs['wins']} won, {rs['hedges']} hedged, {rs['cancelled']} cancelled), "
+                        f"{rs['error_rate']:.0%} errors, first token p50 {rs['ttft_p50_s']}s / p95 {rs['ttft_p95_s']}s"
+                    )
+            for backend in routed.values():
+                if isinstance(getattr(backend, "client", None), WatsonxClient):
+                    wx = backend.client.stats()
+                    st.write(f"**watsonx client:** {wx['requests']} requests, {wx['retries']} retries, {wx['token_refreshes']} token refreshes, {wx['connections_opened']} connections opened ({wx['connection_reuse']:.0%} reuse)")
+            st.write(f"**API keys loaded:** {'✅ Yes' if os.getenv('WATSONX_API_KEY') else '❌ No'}")
+            cache_stats = get_page_cache(PARSE_CACHE_DIR).stats()
+            st.write(f"**Parse cache:** {cache_stats['hits']} hits / {cache_stats['misses']} misses ({cache_stats['files']} files indexed)")
+        
+            # Request tracing: stages of the last question, rolling percentiles and exports
+            traces = tracing.recent_traces()
+            last = next((t for t in traces if t["name"] == "question"), None)
+            if last:
+                st.write(f"**Last question:** {last['duration_ms']:.0f} ms")
+                st.table([
+                    {
+                        "stage": "· " * span["depth"] + span["name"],
+                        "start (ms)": span["start_ms"],
+                        "time (ms)": span["duration_ms"],
+                        "details": ", ".join(f"{k}={v}" for k, v in span["attrs"].items() if v is not None),
+                    }
+                    for span in sorted(last["spans"], key=lambda span: span["start_ms"])
+                ])
+            percentiles = tracing.stage_percentiles()
+            if percentiles:
+                st.write("**Stage latency (rolling, ms):**")
+                st.table([{"stage": name, **values} for name, values in percentiles.items()])
+            if traces:
+                col1, col2 = st.columns(2)
+                col1.download_button("⬇️ Traces (JSONL)", tracing.export_jsonl(traces), file_name="traces.jsonl", mime="application/x-ndjson")
+                col2.download_button("⬇️ Chrome trace", tracing.export_chrome_trace(traces), file_name="trace.json", mime="application/json")
+    
+    if prompt:
+        with tracing.trace("question", query_chars=len(prompt)):
+            answer_question(prompt, resources)
 
 if __name__ == "__main__":
     main()
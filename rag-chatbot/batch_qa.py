@@ -0,0 +1,221 @@
+"""
+Batch question answering
+------------------------
+Runs a file of questions through the same index and prompt as the chatbot,
+without Streamlit:
+
+    python batch_qa.py questions.jsonl answers.jsonl --concurrency 4
+
+Input lines are {"question": "...", "id": "..."} ("id" defaults to the line
+number). Each output line is {"id", "question", "answer", "citations",
+"sources", "latency_s"} or {"id", "question", "error"}; `citations` is the
+`format_citations()` text shown in the chat.
+
+- Retrieval for all pending questions starts with batched embedding passes;
+  each question then goes through the chat's own retriever
+  (`app.create_retriever()`), which reads the precomputed question vector,
+  so batch answers and citations match the chat and the API.
+- LLM calls run with bounded concurrency. Rate-limit errors (HTTP 429) pause
+  every worker with exponential backoff and the question is retried;
+  `--rpm` caps the request rate up front.
+- Answers are appended to the output as they finish. Re-running the same
+  command skips questions that already have an answer, so an interrupted
+  run resumes where it stopped (failed questions are retried).
+"""
+
+import argparse
+import json
+import logging
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Dict, List
+
+from langchain_core.embeddings import Embeddings
+
+import app
+from shared_resources import get_shared_resources
+
+logger = logging.getLogger(__name__)
+
+EMBED_CHUNK = 256
+MAX_ATTEMPTS = 5
+BACKOFF_BASE = 2.0
+BACKOFF_CAP = 60.0
+
+
+def read_questions(path: Path) -> List[Dict[str, str]]:
+    questions = []
+    with open(path, "r") as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            item = json.loads(line)
+            questions.append({"id": str(item.get("id", line_number)), "question": item["question"]})
+    return questions
+
+
+def answered_ids(path: Path) -> set:
+    """IDs that already have an answer in the output file."""
+    done = set()
+    if not path.exists():
+        return done
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                item = json.loads(line)
+            except ValueError:
+                # A line cut short by an interrupted run
+                continue
+            if "answer" in item:
+                done.add(str(item["id"]))
+    return done
+
+
+def is_rate_limit(error: BaseException) -> bool:
+    """Recognise a 429 from OpenAI (RateLimitError) or watsonx (WatsonxError)."""
+    return "RateLimit" in type(error).__name__ or getattr(error, "status_code", None) == 429 or "429" in str(error)
+
+
+class RateLimiter:
+    """Shared pacing for all workers: optional requests/minute cap plus 429 backoff."""
+
+    def __init__(self, rpm: float = 0):
+        self.interval = 60.0 / rpm if rpm else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+        self.rate_limited = 0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next_slot, self._paused_until)
+            self._next_slot = start + self.interval
+        time.sleep(max(0.0, start - time.monotonic()))
+
+    def backoff(self, attempt: int):
+        """Pause every worker after a rate-limit response."""
+        delay = random.uniform(0.5, 1.0) * min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt))
+        with self._lock:
+            self.rate_limited += 1
+            self._paused_until = max(self._paused_until, time.monotonic() + delay)
+        logger.warning("rate limited; pausing all workers for %.1fs", delay)
+
+
+def load_vector_store():
+    if app.INGEST_MODE == "streaming":
+        pdf_files = sorted(app.DATA_DIR.glob("*.pdf")) if app.DATA_DIR.exists() else []
+        return app.stream_vector_store(pdf_files)
+    return app.create_vector_store(app.load_documents())
+
+
+class PrecomputedQueryEmbeddings(Embeddings):
+    """Answer `embed_query` from vectors embedded up front; anything else goes to `underlying`."""
+
+    def __init__(self, underlying: Embeddings, vectors: Dict[str, List[float]]):
+        self.underlying = underlying
+        self.vectors = vectors
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.underlying.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        vector = self.vectors.get(text)
+        return vector if vector is not None else self.underlying.embed_query(text)
+
+
+def retrieve_all(vector_store, questions: List[str]) -> List[List]:
+    """Retrieve context for every question, embedding them in batched passes."""
+    embeddings = vector_store.embeddings
+    # Question vectors stay out of the on-disk chunk embedding cache
+    embed = getattr(embeddings, "embed_queries", embeddings.embed_documents)
+    vectors: Dict[str, List[float]] = {}
+    for start in range(0, len(questions), EMBED_CHUNK):
+        batch = questions[start:start + EMBED_CHUNK]
+        vectors.update(zip(batch, embed(batch)))
+
+    # The same store, opened with embeddings that serve the batch's vectors
+    store = app.new_vector_store(Path(vector_store._persist_directory), PrecomputedQueryEmbeddings(embeddings, vectors))
+    retriever = app.create_retriever(store)
+    return [retriever.invoke(question) for question in questions]
+
+
+def answer_one(chain, limiter: RateLimiter, item: Dict[str, str], docs: List) -> Dict[str, object]:
+    """Answer one question from its retrieved context, retrying on rate limits."""
+    started = time.perf_counter()
+    for attempt in range(MAX_ATTEMPTS):
+        limiter.wait()
+        try:
+            result = chain.combine_documents_chain.invoke({"input_documents": docs, "question": item["question"]})
+        except Exception as e:
+            if is_rate_limit(e) and attempt + 1 < MAX_ATTEMPTS:
+                limiter.backoff(attempt)
+                continue
+            return {**item, "error": str(e)}
+        answer = result["output_text"]
+        return {
+            **item,
+            "answer": answer,
+            "citations": app.format_citations(docs),
+            "sources": [
+                {"source_file": source_file, "page_number": page_number}
+                for source_file, page_number in app.citation_sources(docs)
+            ],
+            "latency_s": round(time.perf_counter() - started, 3),
+        }
+    return {**item, "error": "rate limited"}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Answer a JSONL file of questions with the RAG pipeline")
+    parser.add_argument("input", type=Path, help='JSONL with {"question": ..., "id": ...} per line')
+    parser.add_argument("output", type=Path, help="JSONL to append answers to (also used to resume)")
+    parser.add_argument("--concurrency", type=int, default=4, help="LLM calls in flight (default 4)")
+    parser.add_argument("--rpm", type=float, default=0, help="Max LLM requests per minute (default: unlimited)")
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+
+    questions = read_questions(args.input)
+    done = answered_ids(args.output)
+    pending = [item for item in questions if item["id"] not in done]
+    logger.info("%d questions, %d already answered, %d to go", len(questions), len(questions) - len(pending), len(pending))
+    if not pending:
+        return 0
+
+    app.load_api_keys()
+    resources = get_shared_resources()
+    vector_store = resources.get("vector_store", load_vector_store)
+    llm = resources.get("llm", app.choose_llm)
+    if vector_store is None or llm is None:
+        logger.error("No index or LLM backend available")
+        return 1
+    chain = app.create_qa_chain(llm, vector_store)
+
+    started = time.perf_counter()
+    contexts = retrieve_all(vector_store, [item["question"] for item in pending])
+    logger.info("retrieved context for %d questions in %.1fs", len(pending), time.perf_counter() - started)
+
+    limiter = RateLimiter(args.rpm)
+    failed = 0
+    with open(args.output, "a") as out, ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        if out.tell() and args.output.read_bytes()[-1:] != b"\n":
+            # Terminate a line cut short by an interrupted run
+            out.write("\n")
+        futures = [pool.submit(answer_one, chain, limiter, item, docs) for item, docs in zip(pending, contexts)]
+        for finished, future in enumerate(as_completed(futures), 1):
+            record = future.result()
+            failed += "error" in record
+            out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            out.flush()
+            if finished % 10 == 0 or finished == len(futures):
+                logger.info("%d/%d answered (%d failed, %d rate-limit pauses)", finished, len(futures), failed, limiter.rate_limited)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
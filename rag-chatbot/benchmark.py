@@ -0,0 +1,365 @@
+"""
+Retrieval benchmark
+-------------------
+Builds indexes from a fixed corpus and measures retrieval across settings:
+
+    python benchmark.py --corpus data --queries queries.jsonl \\
+        --chunk-sizes 500,1000 --overlaps 100,200 --k 4,8 \\
+        --space cosine,l2 --M 16,32 --construction-ef 100 --search-ef 10,100
+
+For every combination it reports ingestion chunks/sec, index size on disk,
+vector memory, p50/p95/p99 retrieval latency, queries/sec and recall@k, and
+writes all results to a JSON file (`--baseline` prints the change against an
+earlier run, so regressions are visible).
+
+`--backend chroma,quantized --rerank 2,8` compares Chroma's HNSW index with
+the int8 store (quantized_store.py) at several re-rank depths. `vector_mb` is
+the vector data a query touches in memory: float32 vectors plus level-0 graph
+links for Chroma (all of it is loaded into every process), int8 codes plus
+scales for the quantized store (its float vectors stay on disk and only the
+re-ranked candidates are read). The HNSW options only apply to Chroma.
+
+`--search flat,hierarchical` compares flat search with coarse-to-fine search
+through the document/page summaries (hierarchical_index.py); the summaries
+are only built when hierarchical search is measured, and their build time is
+reported separately (`summary_s`) from the ingest figures.
+`--corpus-fractions 0.25,0.5,1` indexes growing prefixes of the corpus (by
+file) so latency and recall can be followed as the corpus grows; only the
+queries whose relevant pages are in the indexed files count.
+
+Pages come from `load_documents()` and chunks from `make_text_splitter()`,
+as in the app. Vectors come from the deterministic `HashingEmbeddings`
+unless `--embeddings` selects a real backend, HNSW inserts are single
+threaded and the hash seed is fixed, so recall is reproducible run to run.
+
+The labelled query set is JSONL with one
+{"query": "...", "relevant": [{"source_file": "a.pdf", "page_number": 3}]}
+per line. A query counts as recalled if any of the top-k chunks comes from
+a relevant page. Without `--queries`, a set is synthesised from the corpus:
+a phrase taken from a randomly chosen page, labelled with that page.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List
+
+from langchain_community.vectorstores import Chroma
+
+import app
+from bm25_index import BM25Index, HybridRetriever
+from embeddings import get_embeddings
+from hierarchical_index import PageSummaryIndex
+from index_manifest import embedding_id
+from quantized_store import QuantizedVectorStore
+from tracing import percentile
+
+UPSERT_BATCH = 256
+WARMUP_QUERIES = 5
+
+
+def csv_list(cast: Callable) -> Callable[[str], List]:
+    return lambda value: [cast(item) for item in value.split(",") if item]
+
+
+def synthesize_queries(documents: List, count: int, seed: int = 0, words: int = 12) -> List[Dict]:
+    """Take a phrase from `count` random pages; each query's label is its page."""
+    rng = random.Random(seed)
+    pages = [doc for doc in documents if len(doc.page_content.split()) >= words * 3]
+    queries = []
+    for doc in rng.sample(pages, min(count, len(pages))):
+        tokens = doc.page_content.split()
+        start = rng.randrange(0, len(tokens) - words)
+        queries.append({
+            "query": " ".join(tokens[start:start + words]),
+            "relevant": [{"source_file": doc.metadata.get("source_file"), "page_number": doc.metadata.get("page_number")}],
+        })
+    return queries
+
+
+def load_queries(path: Path) -> List[Dict]:
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def dir_size_mb(path: Path) -> float:
+    return round(sum(f.stat().st_size for f in path.rglob("*") if f.is_file()) / (1024 * 1024), 2)
+
+
+def vector_mb(vector_store, chunks: int, dim: int, hnsw: Dict) -> float:
+    """Approximate vector memory a query needs (see the module docstring)."""
+    if isinstance(vector_store, QuantizedVectorStore):
+        size = vector_store.memory_bytes()["scan_bytes"]
+    else:
+        # float32 vector plus 2*M neighbour ids per element at level 0
+        size = chunks * (dim * 4 + 2 * hnsw.get("hnsw:M", 16) * 4)
+    return round(size / (1024 * 1024), 2)
+
+
+def build_index(
+    documents: List, embeddings, chunk_size: int, overlap: int, backend: str, options: Dict, workdir: Path,
+    summaries: bool = False,
+) -> Dict:
+    """Chunk and embed the corpus into a fresh vector store; return it with build figures.
+
+    With `summaries`, the page/document summaries are built alongside, as the
+    app does for hierarchical search; their time is reported as `summary_s`,
+    not counted in `ingest_s` and `chunks_per_sec`.
+    """
+    splits = app.make_text_splitter(chunk_size, overlap).split_documents(documents)
+    if backend == "quantized":
+        vector_store = QuantizedVectorStore(str(workdir), embeddings, rerank_factor=options["rerank"])
+    else:
+        vector_store = Chroma(
+            collection_name="benchmark",
+            persist_directory=str(workdir),
+            embedding_function=embeddings,
+            collection_metadata=options,
+        )
+    summary_index = PageSummaryIndex() if summaries else None
+    elapsed = summary_elapsed = 0.0
+    for start in range(0, len(splits), UPSERT_BATCH):
+        batch = splits[start:start + UPSERT_BATCH]
+        ids = [str(i) for i in range(start, start + len(batch))]
+        started = time.perf_counter()
+        vector_store.add_documents(batch, ids=ids)
+        elapsed += time.perf_counter() - started
+        if summary_index is not None:
+            started = time.perf_counter()
+            summary_index.add_from_store(vector_store, ids)
+            summary_elapsed += time.perf_counter() - started
+    keyword_index = BM25Index()
+    keyword_index.add([str(i) for i in range(len(splits))], splits)
+    return {
+        "vector_store": vector_store,
+        "keyword_index": keyword_index,
+        "summary_index": summary_index,
+        "chunks": len(splits),
+        "ingest_s": round(elapsed, 3),
+        "chunks_per_sec": round(len(splits) / elapsed, 1) if elapsed else 0.0,
+        "summary_s": round(summary_elapsed, 3),
+        "index_mb": dir_size_mb(workdir),
+        "vector_mb": vector_mb(vector_store, len(splits), len(embeddings.embed_query("dimension probe")), options),
+    }
+
+
+def run_queries(retrieve: Callable[[str], List], queries: List[Dict]) -> Dict:
+    """Time every query and score recall against its relevant pages."""
+    for item in queries[:WARMUP_QUERIES]:
+        retrieve(item["query"])
+    latencies, hits = [], 0
+    started = time.perf_counter()
+    for item in queries:
+        t0 = time.perf_counter()
+        docs = retrieve(item["query"])
+        latencies.append((time.perf_counter() - t0) * 1000)
+        relevant = {(r["source_file"], r["page_number"]) for r in item["relevant"]}
+        hits += any((d.metadata.get("source_file"), d.metadata.get("page_number")) in relevant for d in docs)
+    elapsed = time.perf_counter() - started
+    return {
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p95_ms": round(percentile(latencies, 95), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "qps": round(len(queries) / elapsed, 1) if elapsed else 0.0,
+        "recall_at_k": round(hits / len(queries), 4) if queries else 0.0,
+    }
+
+
+def config_key(result: Dict) -> tuple:
+    # Results written before --backend/--search/--corpus-fractions existed are flat Chroma runs on the whole corpus
+    config = {"backend": "chroma", "rerank": None, "search": "flat", "corpus_fraction": 1.0, **result["config"]}
+    return tuple(config[name] for name in sorted(config))
+
+
+def tradeoff(results: List[Dict]):
+    """Print vector memory and recall of each quantized run relative to the matching Chroma run."""
+    def same_query(config: Dict) -> tuple:
+        return tuple(config[name] for name in ("chunk_size", "chunk_overlap", "k", "retrieval", "search", "corpus_fraction"))
+
+    chroma = {}
+    for result in results:
+        if result["config"]["backend"] == "chroma":
+            chroma.setdefault(same_query(result["config"]), result["metrics"])
+    lines = []
+    for result in results:
+        config, now = result["config"], result["metrics"]
+        before = chroma.get(same_query(config))
+        if config["backend"] != "quantized" or before is None:
+            continue
+        lines.append(
+            f"  chunk {config['chunk_size']}/{config['chunk_overlap']} {config['retrieval']} {config['search']} k={config['k']} "
+            f"{config['corpus_fraction']:.0%} of corpus rerank={config['rerank']}: vector memory {now['vector_mb']} vs {before['vector_mb']} MB "
+            f"({now['vector_mb'] / before['vector_mb']:.0%}), recall@k {now['recall_at_k'] - before['recall_at_k']:+.4f}, "
+            f"p95 {now['p95_ms'] - before['p95_ms']:+.2f} ms"
+        )
+    if lines:
+        print("\nQuantized vs Chroma (memory/recall trade-off):")
+        print("\n".join(lines))
+
+    def same_index(config: Dict) -> tuple:
+        return tuple(config.get(name) for name in sorted(config) if name != "search")
+
+    flat = {same_index(r["config"]): r["metrics"] for r in results if r["config"]["search"] == "flat"}
+    lines = []
+    for result in results:
+        config, now = result["config"], result["metrics"]
+        before = flat.get(same_index(config))
+        if config["search"] != "hierarchical" or before is None:
+            continue
+        lines.append(
+            f"  {config['corpus_fraction']:.0%} of corpus ({now['chunks']} chunks) {config['backend']} {config['retrieval']} "
+            f"k={config['k']}: p95 {now['p95_ms']} vs {before['p95_ms']} ms, "
+            f"recall@k {now['recall_at_k'] - before['recall_at_k']:+.4f}"
+        )
+    if lines:
+        print("\nHierarchical vs flat search:")
+        print("\n".join(lines))
+
+
+def compare(results: List[Dict], baseline_path: Path):
+    """Print recall and p95 changes against a previous results file."""
+    with open(baseline_path, "r") as f:
+        baseline = {config_key(r): r["metrics"] for r in json.load(f)["results"]}
+    print(f"\nChange vs {baseline_path}:")
+    for result in results:
+        before = baseline.get(config_key(result))
+        if before is None:
+            continue
+        now = result["metrics"]
+        print(
+            f"  {result['config']}: recall@k {now['recall_at_k'] - before['recall_at_k']:+.4f}, "
+            f"p95 {now['p95_ms'] - before['p95_ms']:+.2f} ms"
+        )
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark retrieval latency, throughput and recall@k")
+    parser.add_argument("--corpus", type=Path, default=app.DATA_DIR, help="Folder of PDFs (default: the app's data folder)")
+    parser.add_argument("--queries", type=Path, help="Labelled query set (JSONL); synthesised from the corpus if omitted")
+    parser.add_argument("--num-queries", type=int, default=200, help="Size of a synthesised query set")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--embeddings", default="hash", help="Embedding backend (default: deterministic hashing)")
+    parser.add_argument("--chunk-sizes", type=csv_list(int), default=[1000])
+    parser.add_argument("--overlaps", type=csv_list(int), default=[200])
+    parser.add_argument("--k", type=csv_list(int), default=[4])
+    parser.add_argument("--retrieval", type=csv_list(str), default=["similarity", "hybrid"])
+    parser.add_argument("--search", type=csv_list(str), default=["flat"], help="Dense search: flat, hierarchical")
+    parser.add_argument("--corpus-fractions", type=csv_list(float), default=[1.0], help="Index this fraction of the PDFs (by file)")
+    parser.add_argument("--backend", type=csv_list(str), default=["chroma"], help="Vector store: chroma, quantized")
+    parser.add_argument("--rerank", type=csv_list(int), default=[8], help="Quantized store: candidates re-ranked per result")
+    parser.add_argument("--space", type=csv_list(str), default=["cosine"], help="HNSW distance: cosine, l2, ip")
+    parser.add_argument("--M", type=csv_list(int), default=[16], help="HNSW graph degree")
+    parser.add_argument("--construction-ef", type=csv_list(int), default=[100])
+    parser.add_argument("--search-ef", type=csv_list(int), default=[10])
+    parser.add_argument("--output", type=Path, help="Results file (default: bench_results/retrieval-<time>.json)")
+    parser.add_argument("--baseline", type=Path, help="Earlier results file to compare against")
+    args = parser.parse_args(argv)
+
+    app.DATA_DIR = args.corpus
+    documents = app.load_documents()
+    if not documents:
+        print(f"No PDFs found in {args.corpus}", file=sys.stderr)
+        return 1
+    queries = load_queries(args.queries) if args.queries else synthesize_queries(documents, args.num_queries, args.seed)
+    embeddings = get_embeddings(args.embeddings)
+    print(f"{len(documents)} pages, {len(queries)} queries, embeddings {embedding_id(embeddings)}")
+
+    # One index per (backend settings, chunking) combination
+    index_configs = []
+    for backend in args.backend:
+        if backend == "quantized":
+            index_configs += [
+                ("quantized", {"rerank": rerank}, {"space": "cosine", "rerank": rerank})
+                for rerank in args.rerank
+            ]
+            continue
+        for space, m, construction_ef, search_ef in itertools.product(args.space, args.M, args.construction_ef, args.search_ef):
+            hnsw = {"hnsw:space": space, "hnsw:M": m, "hnsw:construction_ef": construction_ef, "hnsw:search_ef": search_ef}
+            # Multi-threaded inserts build a different graph on every run
+            hnsw["hnsw:num_threads"] = 1
+            index_configs.append((backend, hnsw, {
+                "space": space, "M": m, "construction_ef": construction_ef, "search_ef": search_ef,
+            }))
+
+    files = sorted({doc.metadata.get("source_file") for doc in documents})
+    results = []
+    for fraction, (chunk_size, overlap), (backend, options, index_config) in itertools.product(
+        args.corpus_fractions, itertools.product(args.chunk_sizes, args.overlaps), index_configs
+    ):
+        if overlap >= chunk_size:
+            continue
+        included = set(files[:max(1, round(len(files) * fraction))])
+        subset = [doc for doc in documents if doc.metadata.get("source_file") in included]
+        subset_queries = [q for q in queries if any(r["source_file"] in included for r in q["relevant"])]
+        workdir = Path(tempfile.mkdtemp(prefix="rag-bench-"))
+        try:
+            index = build_index(
+                subset, embeddings, chunk_size, overlap, backend, options, workdir, summaries="hierarchical" in args.search
+            )
+            vector_store = index["vector_store"]
+            for k, mode, search in itertools.product(args.k, args.retrieval, args.search):
+                summary_index = index["summary_index"] if search == "hierarchical" else None
+                if mode == "hybrid":
+                    retriever = HybridRetriever(
+                        vector_store=vector_store, keyword_index=index["keyword_index"], summary_index=summary_index, k=k
+                    )
+                    retrieve = retriever.invoke
+                elif summary_index is not None:
+                    retrieve = lambda query, k=k: summary_index.search(vector_store, embeddings.embed_query(query), k=k)
+                else:
+                    retrieve = lambda query, k=k: vector_store.similarity_search(query, k=k)
+                metrics = run_queries(retrieve, subset_queries)
+                metrics.update({name: index[name] for name in ("chunks", "ingest_s", "chunks_per_sec", "index_mb", "vector_mb")})
+                if search == "hierarchical":
+                    metrics["summary_s"] = index["summary_s"]
+                config = {
+                    "chunk_size": chunk_size, "chunk_overlap": overlap, "k": k, "retrieval": mode,
+                    "backend": backend, "search": search, "corpus_fraction": fraction, **index_config,
+                }
+                results.append({"config": config, "metrics": metrics})
+                settings = " ".join(f"{name}={value}" for name, value in index_config.items())
+                print(
+                    f"{len(included)} files chunk {chunk_size}/{overlap} {backend} {settings} {mode} {search} k={k}: "
+                    f"recall@k {metrics['recall_at_k']:.3f}, p50 {metrics['p50_ms']} ms, p95 {metrics['p95_ms']} ms, "
+                    f"p99 {metrics['p99_ms']} ms, {metrics['qps']} q/s | ingest {metrics['chunks_per_sec']} chunks/s, "
+                    f"{metrics['index_mb']} MB on disk, {metrics['vector_mb']} MB vectors in memory"
+                    + (f", summaries built in {metrics['summary_s']}s" if search == "hierarchical" else "")
+                )
+            vector_store.delete_collection()
+        finally:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or Path("bench_results") / f"retrieval-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    meta = {
+        "corpus": str(args.corpus),
+        "pages": len(documents),
+        "queries": str(args.queries) if args.queries else f"synthesised:{len(queries)}:seed={args.seed}",
+        "embeddings": embedding_id(embeddings),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(output, "w") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2)
+    print(f"Results written to {output}")
+    tradeoff(results)
+    if args.baseline:
+        compare(results, args.baseline)
+    return 0
+
+
+if __name__ == "__main__":
+    # Chroma's tie-breaking between equidistant chunks follows set iteration order,
+    # so fix the hash seed (by re-executing) for run-to-run reproducible recall
+    if os.environ.get("PYTHONHASHSEED") != "0":
+        os.execve(sys.executable, [sys.executable] + sys.argv, {**os.environ, "PYTHONHASHSEED": "0"})
+    sys.exit(main())
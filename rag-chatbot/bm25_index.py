@@ -0,0 +1,229 @@
+"""
+Keyword index and hybrid retrieval
+----------------------------------
+Dense-only search often misses AEC queries full of exact code section numbers
+("1910.27"), material grades ("A992", "Grade-50") and acronyms. This module
+keeps a compact inverted index with BM25 scoring over the same chunks as the
+Chroma collection. It is updated alongside the vector store during ingestion
+(see index_manifest.sync_documents and ingest.stream_ingest) and persisted
+next to it.
+
+`HybridRetriever` fuses the BM25 and Chroma rankings with reciprocal rank
+fusion, which improves recall at the same small k instead of raising k and
+bloating the prompt.
+"""
+
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+import tracing
+
+KEYWORD_INDEX_FILE = "bm25.json"
+BM25_K1 = 1.5
+BM25_B = 0.75
+RRF_K = 60
+# Candidates taken from each retriever before fusion
+FETCH_K = 12
+
+# Words joined by '.', '-' or '/' stay together ("3.2.1", "a992-50", "hvac/r")
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[.\-/][a-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from how in is it of on or that the this to was what when where which who why with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase tokens; compound tokens also contribute their parts."""
+    tokens = []
+    for token in TOKEN_RE.findall(text.lower()):
+        if token in STOPWORDS:
+            continue
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(part for part in re.split(r"[.\-/]", token) if part and part not in STOPWORDS)
+    return tokens
+
+
+def doc_key(doc: Document) -> Tuple[Any, Any, str]:
+    """Identity of a chunk across retrievers (they don't share IDs)."""
+    return (doc.metadata.get("source_file"), doc.metadata.get("page_number"), doc.page_content)
+
+
+class BM25Index:
+    """Inverted index over chunk texts with BM25 scoring."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = Path(path) if path else None
+        self.postings: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self.lengths: Dict[str, int] = {}
+        self.docs: Dict[str, Tuple[str, dict]] = {}
+        self.total_length = 0
+        self._lock = threading.RLock()
+        if self.path and self.path.exists():
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self.docs)
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        self.postings = defaultdict(dict, data["postings"])
+        self.lengths = data["lengths"]
+        self.docs = {chunk_id: (text, meta) for chunk_id, (text, meta) in data["docs"].items()}
+        self.total_length = sum(self.lengths.values())
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            data = {"postings": self.postings, "lengths": self.lengths, "docs": self.docs}
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(data, f)
+            os.replace(tmp_path, self.path)
+
+    def clear(self):
+        with self._lock:
+            self.postings = defaultdict(dict)
+            self.lengths = {}
+            self.docs = {}
+            self.total_length = 0
+
+    def add(self, ids: List[str], docs: List[Document]):
+        with self._lock:
+            for chunk_id, doc in zip(ids, docs):
+                if chunk_id in self.docs:
+                    self._remove_one(chunk_id)
+                counts = Counter(tokenize(doc.page_content))
+                for term, tf in counts.items():
+                    self.postings[term][chunk_id] = tf
+                length = sum(counts.values())
+                self.lengths[chunk_id] = length
+                self.total_length += length
+                self.docs[chunk_id] = (doc.page_content, dict(doc.metadata))
+
+    def _remove_one(self, chunk_id: str):
+        text, _ = self.docs.pop(chunk_id)
+        for term in set(tokenize(text)):
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(chunk_id, None)
+                if not postings:
+                    del self.postings[term]
+        self.total_length -= self.lengths.pop(chunk_id, 0)
+
+    def remove(self, ids: List[str]):
+        with self._lock:
+            for chunk_id in ids:
+                if chunk_id in self.docs:
+                    self._remove_one(chunk_id)
+
+    def search(self, query: str, k: int = 4, allowed: Optional[set] = None) -> List[Tuple[Document, float]]:
+        """Return the top-k chunks by BM25 score (only chunk IDs in `allowed`, if given)."""
+        with self._lock:
+            n = len(self.docs)
+            if not n:
+                return []
+            avg_length = self.total_length / n
+            scores: Dict[str, float] = defaultdict(float)
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+                for chunk_id, tf in postings.items():
+                    if allowed is not None and chunk_id not in allowed:
+                        continue
+                    norm = tf + BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[chunk_id] / avg_length)
+                    scores[chunk_id] += idf * tf * (BM25_K1 + 1) / norm
+            top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+            return [
+                (Document(page_content=self.docs[chunk_id][0], metadata=dict(self.docs[chunk_id][1])), score)
+                for chunk_id, score in top
+            ]
+
+    def rebuild_from_chroma(self, vector_store, batch_size: int = 5000):
+        """Re-create the index from the chunks already stored in Chroma."""
+        self.clear()
+        offset = 0
+        while True:
+            batch = vector_store.get(include=["documents", "metadatas"], limit=batch_size, offset=offset)
+            if not batch["ids"]:
+                break
+            docs = [Document(page_content=text or "", metadata=meta or {}) for text, meta in zip(batch["documents"], batch["metadatas"])]
+            self.add(batch["ids"], docs)
+            offset += len(batch["ids"])
+        self.save()
+
+
+_keyword_indexes: Dict[str, BM25Index] = {}
+_keyword_indexes_lock = threading.Lock()
+
+
+def get_keyword_index(persist_dir: str) -> BM25Index:
+    """Return the process-wide keyword index stored in `persist_dir`."""
+    path = str(Path(persist_dir) / KEYWORD_INDEX_FILE)
+    with _keyword_indexes_lock:
+        if path not in _keyword_indexes:
+            _keyword_indexes[path] = BM25Index(path)
+        return _keyword_indexes[path]
+
+
+def forget_keyword_index(persist_dir: str):
+    """Drop the in-memory index for `persist_dir` (e.g. an index version that was retired)."""
+    path = str(Path(persist_dir) / KEYWORD_INDEX_FILE)
+    with _keyword_indexes_lock:
+        _keyword_indexes.pop(path, None)
+
+
+def reciprocal_rank_fusion(rankings: List[List[Document]], k: int, rrf_k: int = RRF_K) -> List[Document]:
+    """Fuse several ranked lists: score(d) = sum 1 / (rrf_k + rank)."""
+    scores: Dict[tuple, float] = defaultdict(float)
+    first_seen: Dict[tuple, Document] = {}
+    for ranking in rankings:
+        for rank, doc in enumerate(ranking):
+            key = doc_key(doc)
+            scores[key] += 1.0 / (rrf_k + rank + 1)
+            first_seen.setdefault(key, doc)
+    ordered = sorted(scores, key=lambda key: scores[key], reverse=True)[:k]
+    return [first_seen[key] for key in ordered]
+
+
+class HybridRetriever(BaseRetriever):
+    """BM25 + vector retrieval fused with reciprocal rank fusion."""
+
+    vector_store: Any
+    keyword_index: Any
+    # hierarchical_index.PageSummaryIndex: dense search goes coarse-to-fine
+    summary_index: Any = None
+    k: int = 4
+    fetch_k: int = FETCH_K
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        with tracing.span("embed_query"):
+            vector = self.vector_store.embeddings.embed_query(query)
+        with tracing.span("vector_search", k=self.fetch_k):
+            if self.summary_index is not None:
+                dense = self.summary_index.search(self.vector_store, vector, k=self.fetch_k)
+            else:
+                dense = self.vector_store.similarity_search_by_vector(vector, k=self.fetch_k)
+        with tracing.span("bm25_search", k=self.fetch_k):
+            sparse = [doc for doc, _ in self.keyword_index.search(query, k=self.fetch_k)]
+        return reciprocal_rank_fusion([dense, sparse], self.k)
@@ -0,0 +1,97 @@
+"""
+LangChain callback handlers
+---------------------------
+Kept out of app.py and tracing.py because importing `langchain_core.callbacks`
+costs a large part of LangChain's import graph; app.py imports this module on
+the first question, not at startup.
+"""
+
+import time
+from typing import Any, Dict, List
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+import tracing
+from context_packing import count_tokens
+
+
+class StreamlitTokenHandler(BaseCallbackHandler):
+    """Render LLM tokens into a chat message placeholder as they arrive.
+
+    Also records time to first token, which is the latency users feel.
+    """
+
+    def __init__(self, placeholder):
+        self.placeholder = placeholder
+        self.text = ""
+        self.started = time.perf_counter()
+        self.first_token_at = None
+
+    def on_llm_new_token(self, token: str, **kwargs) -> None:
+        if self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        self.text += token
+        self.placeholder.markdown(self.text + "▌")
+
+    @property
+    def time_to_first_token(self):
+        if self.first_token_at is None:
+            return None
+        return self.first_token_at - self.started
+
+
+class TracingCallbackHandler(BaseCallbackHandler):
+    """Turn LangChain retriever and LLM runs into spans of the current trace."""
+
+    def __init__(self):
+        self._spans: Dict[UUID, Dict[str, Any]] = {}
+
+    def on_retriever_start(self, serialized, query: str, *, run_id: UUID, **kwargs) -> None:
+        # Wrapping retrievers nest: the outer span is "retrieve", inner ones are named by class
+        name = "retrieve" if kwargs.get("parent_run_id") not in self._spans else f"retrieve:{kwargs.get('name')}"
+        self._spans[run_id] = tracing.open_span(name, query_bytes=len(query.encode("utf-8")))
+
+    def on_retriever_end(self, documents, *, run_id: UUID, **kwargs) -> None:
+        handle = self._spans.pop(run_id, None)
+        if handle is not None:
+            handle["attrs"]["chunks"] = len(documents)
+            handle["attrs"]["context_tokens"] = sum(count_tokens(doc.page_content) for doc in documents)
+        tracing.close_span(handle)
+
+    def on_retriever_error(self, error, *, run_id: UUID, **kwargs) -> None:
+        handle = self._spans.pop(run_id, None)
+        if handle is not None:
+            handle["attrs"]["error"] = str(error)
+        tracing.close_span(handle)
+
+    def _start_llm(self, run_id: UUID, text: str):
+        self._spans[run_id] = tracing.open_span("llm", tokens_in=count_tokens(text), bytes_sent=len(text.encode("utf-8")))
+
+    def on_llm_start(self, serialized, prompts: List[str], *, run_id: UUID, **kwargs) -> None:
+        self._start_llm(run_id, "\n".join(prompts))
+
+    def on_chat_model_start(self, serialized, messages, *, run_id: UUID, **kwargs) -> None:
+        self._start_llm(run_id, "\n".join(str(m.content) for batch in messages for m in batch))
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs) -> None:
+        handle = self._spans.get(run_id)
+        if handle is not None and "ttft_ms" not in handle["attrs"]:
+            handle["attrs"]["ttft_ms"] = round((time.perf_counter() - handle["start"]) * 1000, 1)
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs) -> None:
+        handle = self._spans.pop(run_id, None)
+        if handle is not None:
+            text = "".join(g.text for generations in response.generations for g in generations)
+            usage = (response.llm_output or {}).get("token_usage") or {}
+            handle["attrs"]["tokens_out"] = usage.get("completion_tokens") or count_tokens(text)
+            if usage.get("prompt_tokens"):
+                handle["attrs"]["tokens_in"] = usage["prompt_tokens"]
+            handle["attrs"]["bytes_received"] = len(text.encode("utf-8"))
+        tracing.close_span(handle)
+
+    def on_llm_error(self, error, *, run_id: UUID, **kwargs) -> None:
+        handle = self._spans.pop(run_id, None)
+        if handle is not None:
+            handle["attrs"]["error"] = str(error)
+        tracing.close_span(handle)
@@ -0,0 +1,89 @@
+"""
+Import-time budget check
+------------------------
+Cold start of a Streamlit worker pays for everything app.py imports before
+the first paint. LangChain, Chroma, numpy and the embedding backends are
+imported lazily (on first use, or by the background warm-up); this check
+keeps it that way:
+
+    python check_import_time.py --budget-ms 800
+
+It imports app.py in a fresh interpreter with `python -X importtime`, fails
+(exit code 1) if the cumulative import time exceeds the budget or if any
+module in FORBIDDEN was imported, and lists the slowest imports. Run it in
+CI or before merging changes to app.py's imports.
+"""
+
+import argparse
+import os
+import re
+import subprocess
+import sys
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+DEFAULT_BUDGET_MS = float(os.getenv("IMPORT_BUDGET_MS", "800"))
+# Must not be imported by `import app`; they belong to first use or warm_up()
+FORBIDDEN = (
+    "langchain", "langchain_core", "langchain_community", "langchain_openai",
+    "chromadb", "numpy", "sentence_transformers", "torch", "pypdf", "openai", "requests",
+)
+LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| *(\S+)")
+
+
+def measure(module: str, cwd: Path) -> List[Tuple[str, int, int]]:
+    """Import `module` in a fresh interpreter; return (name, self_us, cumulative_us) per import."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=cwd, capture_output=True, text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{result.stderr[-2000:]}")
+    imports = []
+    for line in result.stderr.splitlines():
+        match = LINE.match(line)
+        if match:
+            self_us, cumulative_us, name = match.groups()
+            imports.append((name, int(self_us), int(cumulative_us)))
+    return imports
+
+
+def top_level_costs(imports: List[Tuple[str, int, int]]) -> Dict[str, int]:
+    """Self time in microseconds summed per top-level package."""
+    costs: Dict[str, int] = {}
+    for name, self_us, _ in imports:
+        package = name.split(".")[0]
+        costs[package] = costs.get(package, 0) + self_us
+    return costs
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Fail if importing app.py is too slow or loads heavy modules")
+    parser.add_argument("--module", default="app")
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS, help="Max cumulative import time (env IMPORT_BUDGET_MS)")
+    parser.add_argument("--top", type=int, default=10, help="How many of the slowest packages to list")
+    args = parser.parse_args(argv)
+
+    imports = measure(args.module, Path(__file__).resolve().parent)
+    total_ms = next((cumulative for name, _, cumulative in imports if name == args.module), 0) / 1000
+    loaded = {name.split(".")[0] for name, _, _ in imports}
+    forbidden = sorted(loaded & set(FORBIDDEN))
+
+    print(f"import {args.module}: {total_ms:.0f} ms (budget {args.budget_ms:.0f} ms)")
+    print("Slowest packages (self time):")
+    costs = top_level_costs(imports)
+    for package, us in sorted(costs.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"  {us / 1000:8.1f} ms  {package}")
+
+    failed = False
+    if total_ms > args.budget_ms:
+        print(f"FAIL: import time {total_ms:.0f} ms is over the {args.budget_ms:.0f} ms budget")
+        failed = True
+    if forbidden:
+        print(f"FAIL: heavy modules imported at startup: {', '.join(forbidden)} (import them where they are used)")
+        failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,191 @@
+"""
+Token-budgeted context packing
+------------------------------
+Sits between retrieval and the "stuff" prompt. Retrieved chunks overlap by
+200 characters and neighbouring hits often come from the same page, so the
+raw context repeats itself. Packing:
+
+1. merges chunks from the same `source_file`/`page_number`, removing the
+   overlapping span where one chunk's end is the next one's start
+2. drops chunks whose text is contained in (or identical to) one already kept
+3. fills a token budget with the highest-ranked text first, truncating the
+   last piece at a word boundary
+
+Merged pieces keep the metadata of their page, so `format_citations()` still
+cites exactly the pages that reach the prompt.
+"""
+
+import math
+import threading
+from typing import Any, Dict, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+import tracing
+
+DEFAULT_TOKEN_BUDGET = 1200
+# Shortest suffix/prefix match treated as chunk overlap rather than coincidence
+MIN_OVERLAP_CHARS = 20
+# Don't bother adding a truncated tail shorter than this
+MIN_TAIL_TOKENS = 40
+
+_encoding = None
+_report = threading.local()
+_totals_lock = threading.Lock()
+_totals = {"queries": 0, "tokens_in": 0, "tokens_out": 0}
+
+
+def count_tokens(text: str) -> int:
+    """Count tokens with tiktoken if installed, otherwise ~4 characters per token."""
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.get_encoding("cl100k_base")
+        except ImportError:
+            _encoding = False
+    if _encoding:
+        return len(_encoding.encode(text))
+    return math.ceil(len(text) / 4)
+
+
+def _normalize(text: str) -> str:
+    return " ".join(text.split())
+
+
+def merge_overlapping(first: str, second: str) -> Optional[str]:
+    """Join two chunks of one page if they overlap; None if they don't."""
+    if second in first:
+        return first
+    if first in second:
+        return second
+    for a, b in ((first, second), (second, first)):
+        # Candidate overlaps start wherever b's opening characters occur in a
+        head = b[:MIN_OVERLAP_CHARS]
+        pos = a.find(head)
+        while pos != -1:
+            if b.startswith(a[pos:]):
+                return a[:pos] + b
+            pos = a.find(head, pos + 1)
+    return None
+
+
+def _truncate(text: str, budget: int) -> str:
+    """Cut `text` to roughly `budget` tokens at a word boundary."""
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(text[:mid]) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    cut = text[:low]
+    space = cut.rfind(" ")
+    return (cut[:space] if space > 0 else cut) + " …"
+
+
+def pack_documents(docs: List[Document], token_budget: int = DEFAULT_TOKEN_BUDGET) -> Dict[str, Any]:
+    """Dedupe, merge and pack ranked documents into a token budget.
+
+    Returns the packed documents and a report with tokens in/out/saved.
+    """
+    tokens_in = sum(count_tokens(doc.page_content) for doc in docs)
+
+    # 1. Merge chunks of the same page, keeping the page at its best rank
+    pages: Dict[tuple, List[str]] = {}
+    page_meta: Dict[tuple, dict] = {}
+    page_chunk_ids: Dict[tuple, List[str]] = {}
+    for doc in docs:
+        key = (doc.metadata.get("source_file"), doc.metadata.get("page_number"))
+        pieces = pages.setdefault(key, [])
+        page_meta.setdefault(key, doc.metadata)
+        # Remember every merged chunk so their duplicate groups are still cited (dedup.py)
+        if doc.metadata.get("chunk_id"):
+            page_chunk_ids.setdefault(key, []).append(doc.metadata["chunk_id"])
+        text = doc.page_content
+        merged = True
+        while merged:
+            merged = False
+            for i, piece in enumerate(pieces):
+                joined = merge_overlapping(piece, text)
+                if joined is not None:
+                    text = joined
+                    del pieces[i]
+                    merged = True
+                    break
+        pieces.append(text)
+
+    # 2. Drop text already present on another page (repeated boilerplate)
+    candidates: List[Document] = []
+    seen: List[str] = []
+    for key, pieces in pages.items():
+        kept = []
+        for piece in pieces:
+            normalized = _normalize(piece)
+            if any(normalized in other for other in seen):
+                continue
+            seen.append(normalized)
+            kept.append(piece)
+        if kept:
+            metadata = dict(page_meta[key])
+            if len(page_chunk_ids.get(key, [])) > 1:
+                metadata["chunk_ids"] = page_chunk_ids[key]
+            candidates.append(Document(page_content="\n".join(kept), metadata=metadata))
+
+    # 3. Fill the budget in rank order
+    packed: List[Document] = []
+    remaining = token_budget
+    for doc in candidates:
+        tokens = count_tokens(doc.page_content)
+        if tokens <= remaining:
+            packed.append(doc)
+            remaining -= tokens
+        elif remaining >= MIN_TAIL_TOKENS:
+            packed.append(Document(page_content=_truncate(doc.page_content, remaining), metadata=doc.metadata))
+            remaining = 0
+        if remaining <= 0:
+            break
+
+    tokens_out = sum(count_tokens(doc.page_content) for doc in packed)
+    report = {
+        "chunks_in": len(docs),
+        "chunks_out": len(packed),
+        "tokens_in": tokens_in,
+        "tokens_out": tokens_out,
+        "tokens_saved": tokens_in - tokens_out,
+    }
+    return {"documents": packed, "report": report}
+
+
+def last_packing_report() -> Optional[Dict[str, int]]:
+    """Return the report of the last packing done on the calling thread."""
+    return getattr(_report, "value", None)
+
+
+def packing_totals() -> Dict[str, int]:
+    with _totals_lock:
+        return dict(_totals)
+
+
+class ContextPackingRetriever(BaseRetriever):
+    """Wrap a retriever and pack its results into a token budget."""
+
+    base_retriever: Any
+    token_budget: int = DEFAULT_TOKEN_BUDGET
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        docs = self.base_retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        with tracing.span("pack_context") as attrs:
+            result = pack_documents(docs, self.token_budget)
+            attrs.update(tokens_in=result["report"]["tokens_in"], tokens_out=result["report"]["tokens_out"])
+        _report.value = result["report"]
+        with _totals_lock:
+            _totals["queries"] += 1
+            _totals["tokens_in"] += result["report"]["tokens_in"]
+            _totals["tokens_out"] += result["report"]["tokens_out"]
+        return result["documents"]
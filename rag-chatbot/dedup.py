@@ -0,0 +1,252 @@
+"""
+Near-duplicate chunk elimination
+--------------------------------
+AEC corpora repeat themselves: spec boilerplate, headers and footers, several
+editions of the same code. Without this stage every copy is embedded, stored
+and competes for the k retrieval slots.
+
+During ingestion each chunk is compared with the chunks already stored:
+
+- exact duplicates by a hash of the normalized text,
+- near duplicates by MinHash over word 5-gram shingles (NUM_PERM hashes),
+  with LSH banding (BANDS bands) to find candidates and the estimated
+  Jaccard similarity >= threshold to confirm them.
+
+Only the first chunk of a duplicate group (the canonical chunk) is embedded
+and stored, tagged with `chunk_id` metadata. The others are recorded as
+members of its group with their text and metadata, so `citations()` lists
+every file and page the passage appears on. If the canonical chunk's file is
+changed or removed, a surviving member is stored in its place.
+
+The groups are persisted as `dedup.json` next to the vector store.
+"""
+
+import base64
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+DEDUP_FILE = "dedup.json"
+NUM_PERM = 128
+BANDS = 16
+SHINGLE_WORDS = 5
+DEFAULT_THRESHOLD = 0.9
+# Mersenne prime 2^31 - 1: (a * h + b) stays below 2^63 for 32-bit hashes
+_PRIME = (1 << 31) - 1
+_rng = np.random.RandomState(1)
+_A = _rng.randint(1, _PRIME, size=NUM_PERM).astype(np.int64)
+_B = _rng.randint(0, _PRIME, size=NUM_PERM).astype(np.int64)
+
+WORD_RE = re.compile(r"\w+")
+
+
+def normalize(text: str) -> List[str]:
+    return WORD_RE.findall(text.lower())
+
+
+def text_hash(words: List[str]) -> str:
+    return hashlib.sha1(" ".join(words).encode("utf-8")).hexdigest()
+
+
+def minhash(words: List[str]) -> np.ndarray:
+    """MinHash signature (NUM_PERM int64 values) of the text's word shingles."""
+    if len(words) <= SHINGLE_WORDS:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    hashes = np.array(
+        [int.from_bytes(hashlib.blake2b(s.encode("utf-8"), digest_size=4).digest(), "little") for s in shingles],
+        dtype=np.int64,
+    )
+    return ((_A[:, None] * hashes[None, :] + _B[:, None]) % _PRIME).min(axis=1)
+
+
+def _bands(signature: np.ndarray) -> List[str]:
+    rows = NUM_PERM // BANDS
+    return [f"{band}:{signature[band * rows:(band + 1) * rows].tobytes().hex()}" for band in range(BANDS)]
+
+
+class ChunkDeduplicator:
+    """Duplicate groups of stored chunks: canonical chunk ID -> signature and members."""
+
+    def __init__(self, path: Optional[str] = None, threshold: float = DEFAULT_THRESHOLD):
+        self.path = Path(path) if path else None
+        self.threshold = threshold
+        self.groups: Dict[str, dict] = {}
+        self.member_of: Dict[str, str] = {}
+        self._signatures: Dict[str, np.ndarray] = {}
+        self._exact: Dict[str, str] = {}
+        self._buckets: Dict[str, Set[str]] = defaultdict(set)
+        self._lock = threading.RLock()
+        if self.path and self.path.exists():
+            self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                groups = json.load(f)["groups"]
+        except (OSError, ValueError, KeyError):
+            return
+        for chunk_id, group in groups.items():
+            signature = np.frombuffer(base64.b64decode(group.pop("signature")), dtype=np.int64)
+            self._index(chunk_id, group, signature)
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            groups = {
+                chunk_id: {**group, "signature": base64.b64encode(self._signatures[chunk_id].tobytes()).decode("ascii")}
+                for chunk_id, group in self.groups.items()
+            }
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump({"groups": groups}, f)
+            os.replace(tmp_path, self.path)
+
+    def clear(self):
+        with self._lock:
+            self.groups, self.member_of, self._signatures, self._exact = {}, {}, {}, {}
+            self._buckets = defaultdict(set)
+
+    def _index(self, chunk_id: str, group: dict, signature: np.ndarray):
+        self.groups[chunk_id] = group
+        self._signatures[chunk_id] = signature
+        self._exact[group["text_hash"]] = chunk_id
+        for key in _bands(signature):
+            self._buckets[key].add(chunk_id)
+        for member_id in group["members"]:
+            self.member_of[member_id] = chunk_id
+
+    def _unindex(self, chunk_id: str) -> dict:
+        group = self.groups.pop(chunk_id)
+        signature = self._signatures.pop(chunk_id)
+        if self._exact.get(group["text_hash"]) == chunk_id:
+            del self._exact[group["text_hash"]]
+        for key in _bands(signature):
+            self._buckets[key].discard(chunk_id)
+            if not self._buckets[key]:
+                del self._buckets[key]
+        return group
+
+    def _match(self, digest: str, signature: np.ndarray) -> Optional[str]:
+        """Return the canonical chunk this text duplicates, if any."""
+        if digest in self._exact:
+            return self._exact[digest]
+        candidates = set()
+        for key in _bands(signature):
+            candidates |= self._buckets.get(key, set())
+        best, best_score = None, self.threshold
+        for chunk_id in candidates:
+            score = float(np.mean(self._signatures[chunk_id] == signature))
+            if score >= best_score:
+                best, best_score = chunk_id, score
+        return best
+
+    def add(self, ids: List[str], docs: List) -> Tuple[List[str], List]:
+        """Register chunks; return the IDs and documents that must be embedded and stored."""
+        keep_ids, keep_docs = [], []
+        with self._lock:
+            for chunk_id, doc in zip(ids, docs):
+                if chunk_id in self.member_of:
+                    continue
+                words = normalize(doc.page_content)
+                digest = text_hash(words)
+                signature = minhash(words)
+                canonical = None if chunk_id in self.groups else self._match(digest, signature)
+                if canonical is not None:
+                    self.groups[canonical]["members"][chunk_id] = {"text": doc.page_content, "metadata": doc.metadata}
+                    self.member_of[chunk_id] = canonical
+                    continue
+                if chunk_id not in self.groups:
+                    self._index(chunk_id, {"text_hash": digest, "members": {}}, signature)
+                doc.metadata = {**doc.metadata, "chunk_id": chunk_id}
+                keep_ids.append(chunk_id)
+                keep_docs.append(doc)
+        return keep_ids, keep_docs
+
+    def remove(self, ids: List[str]) -> Tuple[List[str], List[str], List]:
+        """Forget chunks; return (IDs to delete from the store, IDs and documents to store instead).
+
+        A removed canonical chunk with surviving members is replaced by its
+        first member, which becomes the canonical chunk of the group.
+        """
+        from langchain_core.documents import Document
+
+        removed = set(ids)
+        members_removed = set()
+        delete_ids, promoted_ids, promoted_docs = [], [], []
+        with self._lock:
+            # Members were never stored; drop them from their groups first
+            for chunk_id in ids:
+                canonical = self.member_of.pop(chunk_id, None)
+                if canonical is not None:
+                    self.groups[canonical]["members"].pop(chunk_id, None)
+                    members_removed.add(chunk_id)
+            for chunk_id in ids:
+                if chunk_id in members_removed:
+                    continue
+                delete_ids.append(chunk_id)
+                if chunk_id not in self.groups:
+                    continue
+                members = {m: entry for m, entry in self._unindex(chunk_id)["members"].items() if m not in removed}
+                if not members:
+                    continue
+                new_id = next(iter(members))
+                entry = members.pop(new_id)
+                del self.member_of[new_id]
+                words = normalize(entry["text"])
+                self._index(new_id, {"text_hash": text_hash(words), "members": members}, minhash(words))
+                promoted_ids.append(new_id)
+                promoted_docs.append(Document(page_content=entry["text"], metadata={**entry["metadata"], "chunk_id": new_id}))
+        return delete_ids, promoted_ids, promoted_docs
+
+    def citations(self, doc) -> List[Tuple[object, object]]:
+        """(source_file, page_number) of a retrieved chunk and of every duplicate it stands for."""
+        sources = [(doc.metadata.get("source_file", "Unknown"), doc.metadata.get("page_number", "Unknown"))]
+        chunk_ids = doc.metadata.get("chunk_ids") or [doc.metadata.get("chunk_id")]
+        with self._lock:
+            for chunk_id in chunk_ids:
+                group = self.groups.get(chunk_id)
+                if group is None:
+                    continue
+                for entry in group["members"].values():
+                    meta = entry["metadata"]
+                    sources.append((meta.get("source_file", "Unknown"), meta.get("page_number", "Unknown")))
+        return sources
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "chunks": len(self.groups),
+                "duplicates": len(self.member_of),
+                "groups": sum(1 for group in self.groups.values() if group["members"]),
+            }
+
+
+_deduplicators: Dict[str, ChunkDeduplicator] = {}
+_deduplicators_lock = threading.Lock()
+
+
+def get_chunk_deduplicator(persist_dir: str, threshold: float = DEFAULT_THRESHOLD) -> ChunkDeduplicator:
+    """Return the process-wide duplicate groups stored in `persist_dir`."""
+    path = str(Path(persist_dir) / DEDUP_FILE)
+    with _deduplicators_lock:
+        if path not in _deduplicators:
+            _deduplicators[path] = ChunkDeduplicator(path, threshold)
+        return _deduplicators[path]
+
+
+def forget_chunk_deduplicator(persist_dir: str):
+    """Drop the in-memory groups for `persist_dir` (e.g. an index version that was retired)."""
+    path = str(Path(persist_dir) / DEDUP_FILE)
+    with _deduplicators_lock:
+        _deduplicators.pop(path, None)
@@ -0,0 +1,200 @@
+"""
+Persistent embedding cache
+--------------------------
+SQLite cache that sits in front of any embedding backend. Vectors are keyed by
+(embedding model, SHA-256 of the chunk text), so a rebuild after a chunk-size
+change or a dropped `.chroma` directory only embeds text that has never been
+seen before. The least recently used entries are evicted once the stored
+vectors exceed `max_bytes`; the stored size is tracked as a running total.
+
+Queries are one-off texts, so they never touch the disk cache: `embed_query`
+(and `embed_queries`, used by the API's micro-batcher) go through a small
+in-memory LRU of `query_cache_size` vectors instead.
+"""
+
+import hashlib
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, List
+
+from langchain_core.embeddings import Embeddings
+
+DEFAULT_CACHE_PATH = ".embed_cache.sqlite"
+DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+# Evict down to this fraction of max_bytes so eviction doesn't run on every insert
+EVICT_TO_FRACTION = 0.9
+SQLITE_MAX_VARS = 500
+DEFAULT_QUERY_CACHE_SIZE = 256
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class CachedEmbeddings(Embeddings):
+    """Wrap an embedding backend with an on-disk (model, text hash) -> vector cache."""
+
+    def __init__(
+        self,
+        underlying: Embeddings,
+        model_id: str,
+        path: str = DEFAULT_CACHE_PATH,
+        max_bytes: int = DEFAULT_MAX_BYTES,
+        query_cache_size: int = DEFAULT_QUERY_CACHE_SIZE,
+    ):
+        self.underlying = underlying
+        self.model_id = model_id
+        self.path = path
+        self.max_bytes = max_bytes
+        self.query_cache_size = query_cache_size
+        self.hits = 0
+        self.misses = 0
+        self.query_hits = 0
+        self.query_misses = 0
+        self._lock = threading.Lock()
+        # query text -> vector, least recently used first
+        self._queries: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                text_hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (model, text_hash)
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._bytes = self._stored_bytes()
+
+    def _stored_bytes(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings").fetchone()[0]
+
+    def _execute_each(self, statement: str, rows: List[tuple]) -> List[int]:
+        """Run `statement` for every row in one transaction; returns each row's change count."""
+        self._conn.execute("BEGIN")
+        try:
+            changed = [self._conn.execute(statement, row).rowcount for row in rows]
+            self._conn.execute("COMMIT")
+        except Exception:
+            self._conn.execute("ROLLBACK")
+            raise
+        return changed
+
+    def _lookup(self, hashes: List[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        for start in range(0, len(hashes), SQLITE_MAX_VARS):
+            part = hashes[start:start + SQLITE_MAX_VARS]
+            placeholders = ",".join("?" * len(part))
+            rows = self._conn.execute(
+                f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                [self.model_id, *part],
+            ).fetchall()
+            for h, blob in rows:
+                found[h] = array("f", blob).tolist()
+        if found:
+            now = time.time()
+            self._execute_each(
+                "UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?",
+                [(now, self.model_id, h) for h in found],
+            )
+        return found
+
+    def _store(self, vectors: Dict[str, List[float]]):
+        now = time.time()
+        rows = [(self.model_id, h, array("f", v).tobytes(), now) for h, v in vectors.items()]
+        # A row stored meanwhile by another process is identical: keep it and don't count it twice
+        inserted = self._execute_each(
+            "INSERT OR IGNORE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)", rows
+        )
+        self._bytes += sum(len(row[2]) for row, count in zip(rows, inserted) if count)
+        self._evict()
+
+    def _evict(self):
+        if self._bytes <= self.max_bytes:
+            return
+        # Another process may have evicted since this one counted; eviction is rare, so re-count
+        total = self._bytes = self._stored_bytes()
+        if total <= self.max_bytes:
+            return
+        target = int(self.max_bytes * EVICT_TO_FRACTION)
+        freed = 0
+        cutoff = None
+        for last_used, size in self._conn.execute(
+            "SELECT last_used, LENGTH(vector) FROM embeddings ORDER BY last_used"
+        ):
+            freed += size
+            cutoff = last_used
+            if total - freed <= target:
+                break
+        if cutoff is not None:
+            self._conn.execute("DELETE FROM embeddings WHERE last_used <= ?", (cutoff,))
+            self._bytes = self._stored_bytes()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        hashes = [text_hash(t) for t in texts]
+        with self._lock:
+            cached = self._lookup(list(set(hashes)))
+
+        # Embed each unseen text once, even if it appears several times
+        missing: Dict[str, str] = {}
+        for h, t in zip(hashes, texts):
+            if h not in cached and h not in missing:
+                missing[h] = t
+        if missing:
+            vectors = self.underlying.embed_documents(list(missing.values()))
+            new = dict(zip(missing.keys(), vectors))
+            with self._lock:
+                self._store(new)
+            cached.update(new)
+
+        with self._lock:
+            self.misses += len(missing)
+            self.hits += len(texts) - len(missing)
+        return [cached[h] for h in hashes]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed query texts through the in-memory query LRU (never the disk cache)."""
+        with self._lock:
+            found = {}
+            for text in texts:
+                if text in self._queries:
+                    self._queries.move_to_end(text)
+                    found[text] = self._queries[text]
+        missing = list(dict.fromkeys(text for text in texts if text not in found))
+        if missing:
+            vectors = self.underlying.embed_documents(missing) if len(missing) > 1 else [self.underlying.embed_query(missing[0])]
+            with self._lock:
+                for text, vector in zip(missing, vectors):
+                    self._queries[text] = vector
+                    found[text] = vector
+                while len(self._queries) > self.query_cache_size:
+                    self._queries.popitem(last=False)
+        with self._lock:
+            self.query_misses += len(missing)
+            self.query_hits += len(texts) - len(missing)
+        return [found[text] for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_queries([text])[0]
+
+    def stats(self) -> Dict[str, float]:
+        """Return cache counters, merged with the backend's own stats if it has any."""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+            stored_bytes = self._bytes
+        stats = dict(self.underlying.stats()) if hasattr(self.underlying, "stats") else {}
+        stats.update({
+            "cache_hits": self.hits,
+            "cache_misses": self.misses,
+            "cache_entries": entries,
+            "cache_mb": round(stored_bytes / (1024 * 1024), 1),
+            "query_cache_hits": self.query_hits,
+            "query_cache_misses": self.query_misses,
+        })
+        return stats
@@ -0,0 +1,264 @@
+"""
+Embedding backends
+------------------
+`get_embeddings()` picks the embedding backend for the vector store:
+
+- "openai": OpenAIEmbeddings (needs OPENAI_API_KEY)
+- "local":  sentence-transformers on CPU, no network round trips
+- "hash":   deterministic feature hashing of words, no model (benchmarks)
+- "fake":   FakeEmbeddings, random vectors (only useful for UI smoke tests)
+
+Set EMBEDDING_BACKEND to force one; otherwise OpenAI is used when a key is
+present and the local model otherwise.
+"""
+
+import hashlib
+import os
+import queue
+import re
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List
+
+from langchain_core.embeddings import Embeddings
+
+from tracing import percentile
+
+DEFAULT_EMBED_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+DEFAULT_EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+DEFAULT_EMBED_THREADS = int(os.getenv("EMBED_THREADS", "2"))
+LATENCY_WINDOW = 500
+
+# Loaded models, shared by every session in the process
+_models: Dict[str, object] = {}
+_models_lock = threading.Lock()
+
+
+def load_sentence_transformer(model_name: str = DEFAULT_EMBED_MODEL):
+    """Load a sentence-transformers model once per process."""
+    with _models_lock:
+        model = _models.get(model_name)
+        if model is None:
+            from sentence_transformers import SentenceTransformer
+
+            model = SentenceTransformer(model_name, device="cpu")
+            _models[model_name] = model
+        return model
+
+
+class LocalSentenceTransformerEmbeddings(Embeddings):
+    """CPU sentence-transformers embeddings, encoded in batches across threads.
+
+    Every batch is timed; `stats()` returns the recent per-batch latencies.
+    """
+
+    def __init__(
+        self,
+        model_name: str = DEFAULT_EMBED_MODEL,
+        batch_size: int = DEFAULT_EMBED_BATCH_SIZE,
+        num_threads: int = DEFAULT_EMBED_THREADS,
+    ):
+        self.model_name = model_name
+        self.batch_size = max(1, batch_size)
+        self.num_threads = max(1, num_threads)
+        self.batch_latencies = deque(maxlen=LATENCY_WINDOW)
+        self.texts_embedded = 0
+        self._stats_lock = threading.Lock()
+
+    @property
+    def encoder(self):
+        return load_sentence_transformer(self.model_name)
+
+    def _encode_batch(self, texts: List[str]) -> List[List[float]]:
+        started = time.perf_counter()
+        vectors = self.encoder.encode(
+            texts,
+            batch_size=len(texts),
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+            show_progress_bar=False,
+        )
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        with self._stats_lock:
+            self.batch_latencies.append(elapsed_ms)
+            self.texts_embedded += len(texts)
+        return vectors.tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        if len(batches) <= 1 or self.num_threads == 1:
+            results = [self._encode_batch(batch) for batch in batches]
+        else:
+            # torch releases the GIL while encoding, so batches overlap across threads
+            with ThreadPoolExecutor(max_workers=self.num_threads) as pool:
+                results = list(pool.map(self._encode_batch, batches))
+        return [vector for batch in results for vector in batch]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._encode_batch([text])[0]
+
+    def stats(self) -> Dict[str, float]:
+        """Return per-batch latency figures for the debug panel."""
+        with self._stats_lock:
+            latencies = list(self.batch_latencies)
+        return {
+            "batches": len(latencies),
+            "texts": self.texts_embedded,
+            "p50_ms": round(percentile(latencies, 50), 1),
+            "p95_ms": round(percentile(latencies, 95), 1),
+        }
+
+
+class HashingEmbeddings(Embeddings):
+    """Deterministic bag-of-words embedder: words and word pairs hashed into `size` signed buckets.
+
+    Needs no model or network and gives the same vectors on every machine,
+    so benchmark results are reproducible. Retrieval quality is lexical only.
+    """
+
+    def __init__(self, size: int = 384):
+        self.size = size
+        self.model_name = f"hashing-{size}"
+
+    def _embed(self, text: str) -> List[float]:
+        import numpy as np
+
+        words = re.findall(r"\w+", text.lower())
+        vector = np.zeros(self.size, dtype=np.float32)
+        for feature in words + [f"{a} {b}" for a, b in zip(words, words[1:])]:
+            digest = int.from_bytes(hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest(), "little")
+            vector[digest % self.size] += 1.0 if digest >> 63 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+class MicroBatchingEmbeddings(Embeddings):
+    """Coalesce concurrent `embed_query` calls into one `embed_documents` call.
+
+    Each caller waits at most `max_wait_ms` for others to join its batch, so
+    under load N concurrent questions cost one encoder call instead of N.
+    """
+
+    def __init__(self, underlying: Embeddings, max_batch_size: int = 32, max_wait_ms: float = 5.0):
+        self.underlying = underlying
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "queue.Queue" = queue.Queue()
+        self._worker = threading.Thread(target=self._run, name="query-embed-batcher", daemon=True)
+        self._worker.start()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.queries = 0
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            texts = [text for text, _ in batch]
+            # The embedding cache keeps query vectors out of its on-disk chunk cache
+            embed = getattr(self.underlying, "embed_queries", self.underlying.embed_documents)
+            try:
+                vectors = embed(texts)
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, future), vector in zip(batch, vectors):
+                future.set_result(vector)
+            with self._stats_lock:
+                self.batches += 1
+                self.queries += len(batch)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.underlying.embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        future: Future = Future()
+        self._queue.put((text, future))
+        return future.result()
+
+    def stats(self) -> Dict[str, float]:
+        stats = dict(self.underlying.stats()) if hasattr(self.underlying, "stats") else {}
+        with self._stats_lock:
+            stats.update({
+                "query_batches": self.batches,
+                "queries_batched": self.queries,
+                "mean_query_batch": round(self.queries / self.batches, 2) if self.batches else 0.0,
+            })
+        return stats
+
+
+def local_embeddings_available() -> bool:
+    """Return True if sentence-transformers is installed (without importing torch)."""
+    import importlib.util
+
+    return importlib.util.find_spec("sentence_transformers") is not None
+
+
+# Backends (wrapped in the embedding cache) shared by every session in the process
+_backends: Dict[str, Embeddings] = {}
+
+
+def _create_backend(backend: str) -> Embeddings:
+    if backend == "openai":
+        from langchain_community.embeddings import OpenAIEmbeddings
+
+        return OpenAIEmbeddings()
+    if backend == "local":
+        return LocalSentenceTransformerEmbeddings(DEFAULT_EMBED_MODEL, DEFAULT_EMBED_BATCH_SIZE, DEFAULT_EMBED_THREADS)
+    if backend == "hash":
+        return HashingEmbeddings()
+    if backend == "fake":
+        from langchain_community.embeddings import FakeEmbeddings
+
+        return FakeEmbeddings(size=1536)
+    raise ValueError(f"Unknown EMBEDDING_BACKEND: {backend}")
+
+
+def get_embeddings(backend: str = None) -> Embeddings:
+    """Return the embedding backend selected by EMBEDDING_BACKEND / API keys.
+
+    Real backends are wrapped in the persistent embedding cache
+    (embedding_cache.py) unless EMBED_CACHE=0.
+    """
+    backend = backend or os.getenv("EMBEDDING_BACKEND")
+    if not backend:
+        if os.getenv("OPENAI_API_KEY"):
+            backend = "openai"
+        elif local_embeddings_available():
+            backend = "local"
+        else:
+            backend = "fake"
+
+    with _models_lock:
+        if backend not in _backends:
+            embeddings = _create_backend(backend)
+            # Random and hashed vectors are never worth caching
+            if backend not in ("fake", "hash") and os.getenv("EMBED_CACHE", "1") != "0":
+                from embedding_cache import DEFAULT_CACHE_PATH, DEFAULT_MAX_BYTES, CachedEmbeddings
+                from index_manifest import embedding_id
+
+                embeddings = CachedEmbeddings(
+                    embeddings,
+                    model_id=embedding_id(embeddings),
+                    path=os.getenv("EMBED_CACHE_PATH", DEFAULT_CACHE_PATH),
+                    max_bytes=int(os.getenv("EMBED_CACHE_MAX_MB", DEFAULT_MAX_BYTES // (1024 * 1024))) * 1024 * 1024,
+                )
+            _backends[backend] = embeddings
+        return _backends[backend]
@@ -0,0 +1,267 @@
+"""
+Coarse-to-fine (hierarchical) retrieval
+---------------------------------------
+Flat similarity search ranks every chunk in the corpus, so with dozens of
+textbooks and code volumes the top-k hits scatter across unrelated books and
+search cost grows with the corpus. This module keeps a coarse layer of
+summary vectors next to the vector store:
+
+- one vector per page: the normalized mean of the page's chunk embeddings,
+- one vector per document: the normalized mean of its page vectors.
+
+A query first picks the `docs` closest documents, then the `pages` closest
+pages within them, and only the chunks of those pages are scored exactly
+(their vectors are read back from the store by ID). The work per query
+depends on `docs` and `pages`, not on the number of chunks.
+
+Summary vectors are centroids rather than embedded LLM summaries, so building
+them costs no extra embedding calls: chunk vectors are read back from the
+store as chunks are added (see index_manifest.add_chunks). The layer is
+persisted as `summaries.npz` next to the vector store, and only maintained
+while RETRIEVAL_SEARCH=hierarchical (see `get_summaries` in app.py).
+"""
+
+import json
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+import tracing
+
+SUMMARY_INDEX_FILE = "summaries.npz"
+COARSE_DOCS = int(os.getenv("HIERARCHY_DOCS", "3"))
+COARSE_PAGES = int(os.getenv("HIERARCHY_PAGES", "16"))
+READ_BATCH = 5000
+
+
+def page_key(metadata: dict) -> str:
+    return f"{metadata.get('source_file', 'Unknown')}\0{metadata.get('page_number', 'Unknown')}"
+
+
+def _unit(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class PageSummaryIndex:
+    """Per-page and per-document centroid vectors over the chunks of a vector store."""
+
+    def __init__(self, path: Optional[str] = None):
+        self.path = Path(path) if path else None
+        # page key -> {"source_file", "page_number", "chunk_ids"}
+        self.pages: Dict[str, dict] = {}
+        # page key -> sum of the page's unit chunk vectors
+        self.sums: Dict[str, np.ndarray] = {}
+        self.chunk_page: Dict[str, str] = {}
+        self._lock = threading.RLock()
+        self._layers = None
+        if self.path and self.path.exists():
+            self._load()
+
+    def __len__(self) -> int:
+        return len(self.chunk_page)
+
+    def _load(self):
+        try:
+            with np.load(self.path, allow_pickle=False) as data:
+                pages = json.loads(str(data["pages"]))
+                sums = data["sums"]
+        except (OSError, ValueError, KeyError):
+            return
+        for (key, entry), vector in zip(pages, sums):
+            self.pages[key] = entry
+            self.sums[key] = vector
+            for chunk_id in entry["chunk_ids"]:
+                self.chunk_page[chunk_id] = key
+
+    def save(self):
+        if not self.path:
+            return
+        with self._lock:
+            keys = list(self.pages)
+            sums = np.stack([self.sums[key] for key in keys]) if keys else np.zeros((0, 0), dtype=np.float32)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = self.path.with_name(self.path.stem + ".tmp.npz")
+            np.savez(tmp_path, pages=np.array(json.dumps([[key, self.pages[key]] for key in keys])), sums=sums)
+            os.replace(tmp_path, self.path)
+
+    def clear(self):
+        with self._lock:
+            self.pages, self.sums, self.chunk_page = {}, {}, {}
+            self._layers = None
+
+    def add(self, ids: List[str], metadatas: List[dict], vectors) -> None:
+        """Fold chunk vectors into the centroids of their pages."""
+        if not ids:
+            return
+        unit = _unit(np.asarray(vectors, dtype=np.float32))
+        with self._lock:
+            for chunk_id, metadata, vector in zip(ids, metadatas, unit):
+                if chunk_id in self.chunk_page:
+                    continue
+                key = page_key(metadata or {})
+                entry = self.pages.get(key)
+                if entry is None:
+                    entry = self.pages[key] = {
+                        "source_file": (metadata or {}).get("source_file", "Unknown"),
+                        "page_number": (metadata or {}).get("page_number", "Unknown"),
+                        "chunk_ids": [],
+                    }
+                    self.sums[key] = np.zeros_like(vector)
+                entry["chunk_ids"].append(chunk_id)
+                self.sums[key] = self.sums[key] + vector
+                self.chunk_page[chunk_id] = key
+            self._layers = None
+
+    def remove(self, ids: List[str], vectors_by_id: Dict[str, np.ndarray]) -> None:
+        """Take chunks out of their pages' centroids; pages left without chunks are dropped."""
+        with self._lock:
+            for chunk_id in ids:
+                key = self.chunk_page.pop(chunk_id, None)
+                if key is None:
+                    continue
+                entry = self.pages[key]
+                entry["chunk_ids"].remove(chunk_id)
+                if not entry["chunk_ids"]:
+                    del self.pages[key], self.sums[key]
+                elif chunk_id in vectors_by_id:
+                    self.sums[key] = self.sums[key] - _unit(np.asarray(vectors_by_id[chunk_id], dtype=np.float32))
+            self._layers = None
+
+    def add_from_store(self, vector_store, ids: List[str]):
+        """Read the vectors of just-stored chunks back from the store and add them."""
+        if not ids:
+            return
+        batch = vector_store.get(ids=list(ids), include=["embeddings", "metadatas"])
+        self.add(batch["ids"], batch["metadatas"], batch["embeddings"])
+
+    def remove_from_store(self, vector_store, ids: List[str]):
+        """Remove chunks, reading their vectors from the store before they are deleted."""
+        stored = [chunk_id for chunk_id in ids if chunk_id in self.chunk_page]
+        if not stored:
+            return
+        batch = vector_store.get(ids=stored, include=["embeddings"])
+        self.remove(stored, dict(zip(batch["ids"], batch["embeddings"])))
+
+    def rebuild_from_store(self, vector_store, batch_size: int = READ_BATCH):
+        """Re-create the summaries from the chunks already in the vector store."""
+        self.clear()
+        offset = 0
+        while True:
+            batch = vector_store.get(include=["embeddings", "metadatas"], limit=batch_size, offset=offset)
+            if not len(batch["ids"]):
+                break
+            self.add(batch["ids"], batch["metadatas"], batch["embeddings"])
+            offset += len(batch["ids"])
+        self.save()
+
+    def _build_layers(self):
+        """Stack the page centroids and derive the document centroids for search."""
+        keys = list(self.pages)
+        page_matrix = _unit(np.stack([self.sums[key] for key in keys]))
+        doc_names: List[str] = []
+        doc_pages: Dict[str, List[int]] = {}
+        for row, key in enumerate(keys):
+            name = self.pages[key]["source_file"]
+            if name not in doc_pages:
+                doc_names.append(name)
+                doc_pages[name] = []
+            doc_pages[name].append(row)
+        doc_matrix = _unit(np.stack([page_matrix[doc_pages[name]].sum(axis=0) for name in doc_names]))
+        return {
+            "keys": keys,
+            "page_matrix": page_matrix,
+            "doc_names": doc_names,
+            "doc_pages": [np.array(doc_pages[name]) for name in doc_names],
+            "doc_matrix": doc_matrix,
+        }
+
+    def candidates(self, vector, docs: int = COARSE_DOCS, pages: int = COARSE_PAGES) -> List[str]:
+        """Chunk IDs on the `pages` best pages of the `docs` best documents."""
+        with self._lock:
+            if not self.pages:
+                return []
+            if self._layers is None:
+                self._layers = self._build_layers()
+            layers = self._layers
+            query = _unit(np.asarray(vector, dtype=np.float32))
+            doc_scores = layers["doc_matrix"] @ query
+            top_docs = np.argsort(-doc_scores)[:docs]
+            rows = np.concatenate([layers["doc_pages"][d] for d in top_docs])
+            page_scores = layers["page_matrix"][rows] @ query
+            top_pages = rows[np.argsort(-page_scores)[:pages]]
+            return [chunk_id for row in top_pages for chunk_id in self.pages[layers["keys"][row]]["chunk_ids"]]
+
+    def search(self, vector_store, vector, k: int = 4, docs: int = COARSE_DOCS, pages: int = COARSE_PAGES) -> List[Document]:
+        """Coarse-to-fine search; falls back to flat search while the summaries are empty."""
+        with tracing.span("coarse_search", docs=docs, pages=pages):
+            ids = self.candidates(vector, docs, pages)
+        if not ids:
+            return vector_store.similarity_search_by_vector(vector, k=k)
+        with tracing.span("fine_search", candidates=len(ids), k=k):
+            batch = vector_store.get(ids=ids, include=["embeddings", "documents", "metadatas"])
+            if not len(batch["ids"]):
+                return vector_store.similarity_search_by_vector(vector, k=k)
+            scores = _unit(np.asarray(batch["embeddings"], dtype=np.float32)) @ _unit(np.asarray(vector, dtype=np.float32))
+            order = np.argsort(-scores)[:k]
+            return [
+                Document(page_content=batch["documents"][i] or "", metadata=batch["metadatas"][i] or {})
+                for i in order
+            ]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "documents": len({entry["source_file"] for entry in self.pages.values()}),
+                "pages": len(self.pages),
+                "chunks": len(self.chunk_page),
+            }
+
+
+class HierarchicalRetriever(BaseRetriever):
+    """Dense retrieval through the page/document summary layer."""
+
+    vector_store: object
+    summary_index: object
+    k: int = 4
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        with tracing.span("embed_query"):
+            vector = self.vector_store.embeddings.embed_query(query)
+        return self.summary_index.search(self.vector_store, vector, k=self.k)
+
+
+_summary_indexes: Dict[str, PageSummaryIndex] = {}
+_summary_indexes_lock = threading.Lock()
+
+
+def get_summary_index(persist_dir: str) -> PageSummaryIndex:
+    """Return the process-wide summary layer stored in `persist_dir`."""
+    path = str(Path(persist_dir) / SUMMARY_INDEX_FILE)
+    with _summary_indexes_lock:
+        if path not in _summary_indexes:
+            _summary_indexes[path] = PageSummaryIndex(path)
+        return _summary_indexes[path]
+
+
+def forget_summary_index(persist_dir: str):
+    """Drop the in-memory summaries for `persist_dir` (e.g. an index version that was retired)."""
+    path = str(Path(persist_dir) / SUMMARY_INDEX_FILE)
+    with _summary_indexes_lock:
+        _summary_indexes.pop(path, None)
+
+
+def remove_summary_index(persist_dir: str):
+    """Forget and delete the summaries of `persist_dir`; they are rebuilt from the store when next needed."""
+    forget_summary_index(persist_dir)
+    path = Path(persist_dir) / SUMMARY_INDEX_FILE
+    if path.exists():
+        path.unlink()
@@ -0,0 +1,150 @@
+"""
+Append-only chat history
+------------------------
+Replaces rewriting the whole `chat_history.json` on every message. Each chat
+session gets its own JSONL file under `chat_history/`; a message is one
+appended line, so a write is O(1) regardless of conversation length and
+concurrent sessions never overwrite each other.
+
+Reads are paginated: a per-file index of line offsets (built once, then
+extended as the file grows) lets the UI load just the most recent messages
+and fetch older pages on demand.
+"""
+
+import json
+import os
+import re
+import threading
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+DEFAULT_HISTORY_DIR = "chat_history"
+DEFAULT_SESSION = "default"
+# Created in the history directory once the legacy chat_history.json has been imported
+LEGACY_MARKER = ".legacy_imported"
+
+
+def safe_session_id(session_id: str) -> str:
+    """Restrict a session ID to characters that are safe in a file name."""
+    return re.sub(r"[^A-Za-z0-9_-]", "", session_id)[:64] or DEFAULT_SESSION
+
+
+class ChatHistoryStore:
+    """Per-session JSONL message logs with O(1) appends and paginated reads."""
+
+    def __init__(self, root: str = DEFAULT_HISTORY_DIR):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # session -> (line start offsets, bytes scanned so far)
+        self._offsets: Dict[str, Tuple[List[int], int]] = {}
+
+    def _path(self, session_id: str) -> Path:
+        return self.root / f"{safe_session_id(session_id)}.jsonl"
+
+    def _refresh(self, session_id: str) -> List[int]:
+        """Extend the line-offset index with anything appended since the last scan."""
+        path = self._path(session_id)
+        offsets, scanned = self._offsets.get(session_id, ([], 0))
+        size = path.stat().st_size if path.exists() else 0
+        if size < scanned:
+            offsets, scanned = [], 0
+        if size > scanned:
+            with open(path, "rb") as f:
+                f.seek(scanned)
+                position = scanned
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        # A write in progress; pick it up next time
+                        break
+                    offsets.append(position)
+                    position += len(line)
+                scanned = position
+        self._offsets[session_id] = (offsets, scanned)
+        return offsets
+
+    def append(self, session_id: str, message: dict) -> int:
+        """Append one message to the session's log; return the bytes written."""
+        line = (json.dumps(message, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            # O_APPEND makes each single write land at the end, even across processes
+            fd = os.open(self._path(session_id), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+        return len(line)
+
+    def count(self, session_id: str) -> int:
+        with self._lock:
+            return len(self._refresh(session_id))
+
+    def read(self, session_id: str, start: int, end: int) -> List[dict]:
+        """Return messages [start, end) of the session."""
+        with self._lock:
+            offsets = self._refresh(session_id)
+            start, end = max(0, start), min(end, len(offsets))
+            if start >= end:
+                return []
+            messages = []
+            with open(self._path(session_id), "rb") as f:
+                f.seek(offsets[start])
+                for _ in range(end - start):
+                    line = f.readline()
+                    try:
+                        messages.append(json.loads(line))
+                    except ValueError:
+                        continue
+            return messages
+
+    def tail(self, session_id: str, limit: int) -> Tuple[int, List[dict]]:
+        """Return (index of the first returned message, the last `limit` messages)."""
+        total = self.count(session_id)
+        start = max(0, total - limit)
+        return start, self.read(session_id, start, total)
+
+    def clear(self, session_id: str):
+        with self._lock:
+            path = self._path(session_id)
+            if path.exists():
+                path.unlink()
+            self._offsets.pop(session_id, None)
+
+    def import_legacy(self, legacy_file: Path, session_id: str) -> bool:
+        """Copy an old whole-file `chat_history.json` into a session's log, once.
+
+        The legacy file is left in place (it may be under version control); a
+        marker in the history directory records the import and its session.
+        """
+        marker = self.root / LEGACY_MARKER
+        if marker.exists() or not legacy_file.exists():
+            return False
+        try:
+            with open(legacy_file, "r") as f:
+                messages = json.load(f)
+        except (OSError, ValueError):
+            return False
+        try:
+            # Exclusive create: of two sessions opening at once, only one imports
+            fd = os.open(marker, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            return False
+        try:
+            os.write(fd, safe_session_id(session_id).encode("utf-8"))
+        finally:
+            os.close(fd)
+        for message in messages:
+            self.append(session_id, message)
+        return True
+
+
+_stores: Dict[str, ChatHistoryStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_history_store(root: str = DEFAULT_HISTORY_DIR) -> ChatHistoryStore:
+    """Return the process-wide history store (keeps the offset indexes warm)."""
+    with _stores_lock:
+        if root not in _stores:
+            _stores[root] = ChatHistoryStore(root)
+        return _stores[root]
@@ -0,0 +1,262 @@
+"""
+Incremental vector-store ingestion
+----------------------------------
+Keeps a manifest of which files are in the Chroma index, a fingerprint of
+their contents and the IDs of the chunks they produced. On each sync only
+added or changed files are split and embedded, and only the chunks of
+changed or deleted files are removed, so the cost of an update scales with
+the size of the change rather than the size of the corpus. `index_file`
+adds or updates a single file (an upload) without a full sync.
+"""
+
+import hashlib
+import json
+import os
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional
+
+MANIFEST_FILE = "manifest.json"
+UPSERT_BATCH_SIZE = 256
+
+
+def group_by_source(documents: List) -> "OrderedDict[str, List]":
+    """Group page documents by their `source_file` metadata, keeping order."""
+    groups: "OrderedDict[str, List]" = OrderedDict()
+    for doc in documents:
+        groups.setdefault(doc.metadata.get("source_file", "Unknown"), []).append(doc)
+    return groups
+
+
+def fingerprint(docs: List) -> str:
+    """Return a hash of a file's extracted pages (text and page numbers)."""
+    digest = hashlib.sha256()
+    for doc in docs:
+        digest.update(str(doc.metadata.get("page_number", "")).encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(doc.page_content.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def embedding_id(embeddings) -> str:
+    """Return a label identifying an embedding backend and model."""
+    # Caching wrappers don't change the vectors, so label the wrapped backend
+    if hasattr(embeddings, "underlying"):
+        return embedding_id(embeddings.underlying)
+    model = getattr(embeddings, "model", None) or getattr(embeddings, "model_name", None)
+    return f"{type(embeddings).__name__}:{model}" if model else type(embeddings).__name__
+
+
+def chunk_ids(name: str, file_fingerprint: str, count: int) -> List[str]:
+    """Return deterministic chunk IDs for a file version.
+
+    The file name is part of the key so two copies of the same PDF under
+    different names don't share (and later delete) each other's chunks.
+    """
+    prefix = hashlib.sha256(f"{name}\0{file_fingerprint}".encode("utf-8")).hexdigest()[:16]
+    return [f"{prefix}-{i}" for i in range(count)]
+
+
+def add_chunks(vector_store, ids: List[str], docs: List, keyword_index=None, deduper=None, summary_index=None) -> int:
+    """Embed and store chunks (skipping duplicates of stored ones if `deduper` is given).
+
+    Returns how many chunks were stored.
+    """
+    if deduper is not None:
+        ids, docs = deduper.add(ids, docs)
+    if ids:
+        vector_store.add_documents(docs, ids=ids)
+        if keyword_index is not None:
+            keyword_index.add(ids, docs)
+        if summary_index is not None:
+            summary_index.add_from_store(vector_store, ids)
+    return len(ids)
+
+
+def delete_chunks(vector_store, ids: List[str], keyword_index=None, deduper=None, summary_index=None):
+    """Delete chunks; a duplicate group losing its stored chunk is re-stored under a survivor."""
+    promoted_ids: List[str] = []
+    promoted_docs: List = []
+    if deduper is not None:
+        ids, promoted_ids, promoted_docs = deduper.remove(ids)
+    if ids:
+        if summary_index is not None:
+            # Needs the vectors, so before they are deleted
+            summary_index.remove_from_store(vector_store, ids)
+        vector_store.delete(ids=ids)
+        if keyword_index is not None:
+            keyword_index.remove(ids)
+    if promoted_ids:
+        vector_store.add_documents(promoted_docs, ids=promoted_ids)
+        if keyword_index is not None:
+            keyword_index.add(promoted_ids, promoted_docs)
+        if summary_index is not None:
+            summary_index.add_from_store(vector_store, promoted_ids)
+
+
+class IndexManifest:
+    """Record of indexed files: fingerprint, chunk IDs and their page numbers per `source_file`."""
+
+    def __init__(self, persist_dir: str):
+        self.path = Path(persist_dir) / MANIFEST_FILE
+        self.files: Dict[str, dict] = {}
+        self.embedding = ""
+        # Vector store backend the chunks were written to (see VECTOR_BACKEND in app.py)
+        self.backend = "chroma"
+        # Whether duplicate chunks were folded into groups (see dedup.py)
+        self.dedup = False
+        if self.path.exists():
+            try:
+                with open(self.path, "r") as f:
+                    data = json.load(f)
+                self.files = data.get("files", {})
+                self.embedding = data.get("embedding", "")
+                self.backend = data.get("backend", "chroma")
+                self.dedup = data.get("dedup", False)
+            except (OSError, ValueError):
+                self.files = {}
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def save(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"embedding": self.embedding, "backend": self.backend, "dedup": self.dedup, "files": self.files}, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def chunk_count(self) -> int:
+        return sum(len(entry["chunk_ids"]) for entry in self.files.values())
+
+    def diff(self, groups: Dict[str, List], present: Optional[Iterable[str]] = None) -> Dict[str, List[str]]:
+        """Compare the manifest with the current documents.
+
+        A file counts as removed when it is not in `present` (the file names
+        on disk), so a file that is still there but failed to parse keeps its
+        chunks. Without `present`, any file missing from `groups` is removed.
+        """
+        added, changed, unchanged = [], [], []
+        for name, docs in groups.items():
+            entry = self.files.get(name)
+            if entry is None:
+                added.append(name)
+            elif entry["fingerprint"] != fingerprint(docs):
+                changed.append(name)
+            else:
+                unchanged.append(name)
+        present = set(groups) if present is None else set(present)
+        removed = [name for name in self.files if name not in groups and name not in present]
+        return {"added": added, "changed": changed, "removed": removed, "unchanged": unchanged}
+
+
+def _store_file(
+    vector_store, manifest: IndexManifest, name: str, docs: List, splitter, progress=None,
+    keyword_index=None, deduper=None, summary_index=None,
+) -> int:
+    """Split, embed and store one file's pages and record it in the manifest; returns its chunk count."""
+    file_fingerprint = fingerprint(docs)
+    splits = splitter.split_documents(docs)
+    ids = chunk_ids(name, file_fingerprint, len(splits))
+    for start in range(0, len(splits), UPSERT_BATCH_SIZE):
+        add_chunks(
+            vector_store,
+            ids[start:start + UPSERT_BATCH_SIZE],
+            splits[start:start + UPSERT_BATCH_SIZE],
+            keyword_index,
+            deduper,
+            summary_index,
+        )
+        if progress:
+            progress(min(start + UPSERT_BATCH_SIZE, len(splits)) / max(len(splits), 1))
+    manifest.files[name] = {
+        "fingerprint": file_fingerprint,
+        "chunk_ids": ids,
+        # Page of each chunk, so scoped searches can select a page range (see scoped_search.py)
+        "page_numbers": [split.metadata.get("page_number") for split in splits],
+    }
+    # Save after every file so an interrupted sync resumes where it stopped
+    manifest.save()
+    return len(ids)
+
+
+def index_file(
+    vector_store,
+    manifest: IndexManifest,
+    name: str,
+    docs: List,
+    splitter,
+    progress: Optional[Callable[[float], None]] = None,
+    keyword_index=None,
+    deduper=None,
+    summary_index=None,
+) -> Optional[int]:
+    """Add or update one file in the index without touching the other files.
+
+    Returns the file's chunk count, or None if it was already indexed with
+    the same content. `progress` is called with the fraction of chunks stored.
+    """
+    entry = manifest.files.get(name)
+    if entry is not None and entry["fingerprint"] == fingerprint(docs):
+        return None
+    if entry is not None:
+        delete_chunks(vector_store, manifest.files.pop(name)["chunk_ids"], keyword_index, deduper, summary_index)
+    count = _store_file(vector_store, manifest, name, docs, splitter, progress, keyword_index, deduper, summary_index)
+    for index in (keyword_index, deduper, summary_index):
+        if index is not None:
+            index.save()
+    return count
+
+
+def sync_documents(
+    vector_store,
+    manifest: IndexManifest,
+    documents: List,
+    splitter,
+    progress: Optional[Callable[[float, str], None]] = None,
+    keyword_index=None,
+    deduper=None,
+    summary_index=None,
+    present: Optional[Iterable[str]] = None,
+) -> Dict[str, List[str]]:
+    """Bring the vector store in line with `documents`, touching only what changed.
+
+    Returns the diff that was applied. `present` lists the file names on disk:
+    indexed files among them that have no pages in `documents` (failed to
+    parse) keep their chunks; only files gone from disk are removed. `progress` is called with a fraction
+    in [0, 1] and a status message while chunks are being embedded. If given,
+    `keyword_index` (bm25_index.BM25Index) receives the same adds and deletes,
+    `deduper` (dedup.ChunkDeduplicator) keeps duplicate chunks out of both,
+    and `summary_index` (hierarchical_index.PageSummaryIndex) keeps the page
+    and document centroids up to date.
+    """
+    groups = group_by_source(documents)
+    changes = manifest.diff(groups, present)
+
+    # Drop the chunks of files that changed or disappeared
+    stale_ids = []
+    for name in changes["changed"] + changes["removed"]:
+        stale_ids.extend(manifest.files.pop(name)["chunk_ids"])
+    if stale_ids:
+        delete_chunks(vector_store, stale_ids, keyword_index, deduper, summary_index)
+
+    # Split and upsert only new or changed files
+    to_index = changes["added"] + changes["changed"]
+    for file_num, name in enumerate(to_index):
+        file_progress = None
+        if progress:
+            file_progress = lambda fraction, file_num=file_num, name=name: progress(
+                (file_num + fraction) / len(to_index), f"🧠 Embedding {name}... ({file_num + 1}/{len(to_index)})"
+            )
+        _store_file(vector_store, manifest, name, groups[name], splitter, file_progress, keyword_index, deduper, summary_index)
+
+    if stale_ids or not manifest.exists():
+        manifest.save()
+    if keyword_index is not None and (stale_ids or to_index):
+        keyword_index.save()
+    if deduper is not None and (stale_ids or to_index):
+        deduper.save()
+    if summary_index is not None and (stale_ids or to_index):
+        summary_index.save()
+    return changes
@@ -0,0 +1,194 @@
+"""
+Blue/green index versions
+-------------------------
+"Rebuild Index" used to delete `.chroma` in place: chat was unusable until
+the whole corpus was re-embedded, and a crash halfway left no index at all.
+Now every rebuild writes a new, self-contained index directory
+
+    .chroma/versions/<version>/   Chroma files, manifest.json, bm25.json
+    .chroma/CURRENT               name of the live version
+
+in a background thread. Queries keep using the live version until the build
+finishes; then `CURRENT` is replaced atomically (write + os.replace), the
+caller is told to reopen its resources, and versions that are no longer live
+are deleted. A failed build is removed and the live version is untouched.
+
+A store written before versioning (files directly in `.chroma`) stays live
+until the first rebuild, and is cleaned up by the garbage collection after it.
+"""
+
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+CURRENT_FILE = "CURRENT"
+VERSIONS_DIR = "versions"
+# Chroma's file in an unversioned (legacy) store
+LEGACY_MARKER = "chroma.sqlite3"
+
+logger = logging.getLogger(__name__)
+
+
+class IndexVersions:
+    """The versioned index directories under `root` and the pointer to the live one."""
+
+    def __init__(self, root: str):
+        self.root = Path(root)
+        self.versions = self.root / VERSIONS_DIR
+        self._lock = threading.Lock()
+
+    def _read_pointer(self) -> Optional[Path]:
+        try:
+            name = (self.root / CURRENT_FILE).read_text().strip()
+        except OSError:
+            return None
+        path = self.versions / name
+        return path if name and path.is_dir() else None
+
+    def current_dir(self) -> Path:
+        """Return the live index directory, creating an empty version if there is none."""
+        with self._lock:
+            current = self._read_pointer()
+            if current is not None:
+                return current
+            if (self.root / LEGACY_MARKER).exists():
+                return self.root
+            version_dir = self._new_version_dir()
+            self._switch(version_dir)
+            return version_dir
+
+    def _new_version_dir(self) -> Path:
+        version_dir = self.versions / f"v{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:6]}"
+        version_dir.mkdir(parents=True)
+        return version_dir
+
+    def new_version_dir(self) -> Path:
+        """Create an empty directory for a version being built."""
+        with self._lock:
+            return self._new_version_dir()
+
+    def _switch(self, version_dir: Path):
+        self.root.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.root / f"{CURRENT_FILE}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(version_dir.name)
+            f.flush()
+            os.fsync(f.fileno())
+        # Readers see either the old or the new name, never a partial write
+        os.replace(tmp_path, self.root / CURRENT_FILE)
+
+    def switch(self, version_dir: Path):
+        """Atomically make `version_dir` the live version."""
+        with self._lock:
+            self._switch(version_dir)
+
+    def collect_garbage(self, keep: tuple = ()) -> List[Path]:
+        """Delete every version that is not live (or in `keep`); return what was removed."""
+        with self._lock:
+            current = self._read_pointer()
+            if current is None:
+                return []
+            keep_names = {current.name} | {Path(path).name for path in keep}
+            removed = []
+            if self.versions.is_dir():
+                for path in self.versions.iterdir():
+                    if path.is_dir() and path.name not in keep_names:
+                        shutil.rmtree(path, ignore_errors=True)
+                        removed.append(path)
+            # A pre-versioning store lives directly in the root
+            if (self.root / LEGACY_MARKER).exists():
+                for path in self.root.iterdir():
+                    if path.name in (VERSIONS_DIR, CURRENT_FILE, f"{CURRENT_FILE}.tmp"):
+                        continue
+                    if path.is_dir():
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        path.unlink()
+                removed.append(self.root)
+            return removed
+
+
+class BackgroundIndexBuilder:
+    """Builds one index version at a time in a daemon thread and switches to it."""
+
+    def __init__(self, versions: IndexVersions):
+        self.versions = versions
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self._status: Dict[str, object] = {"state": "idle"}
+
+    def status(self) -> Dict[str, object]:
+        """Return a snapshot: state (idle/building/done/failed), fraction, message, version, error."""
+        with self._lock:
+            status = dict(self._status)
+        if status.get("state") == "building":
+            status["elapsed_s"] = round(time.time() - status["started"], 1)
+        return status
+
+    def is_building(self) -> bool:
+        return self.status()["state"] == "building"
+
+    def start(
+        self,
+        build: Callable[[Path, Callable[[float, str], None]], None],
+        on_switch: Optional[Callable[[Path, Path], None]] = None,
+    ) -> bool:
+        """Start building a new version with `build(version_dir, progress)`.
+
+        `on_switch(old_dir, new_dir)` runs right after the pointer moves, before
+        garbage collection. Returns False if a build is already running.
+        """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            version_dir = self.versions.new_version_dir()
+            self._status = {
+                "state": "building",
+                "version": version_dir.name,
+                "fraction": 0.0,
+                "message": "Starting...",
+                "started": time.time(),
+            }
+            self._thread = threading.Thread(
+                target=self._run, args=(build, on_switch, version_dir), name="index-builder", daemon=True
+            )
+            self._thread.start()
+            return True
+
+    def _progress(self, fraction: float, message: str):
+        with self._lock:
+            self._status.update(fraction=min(max(fraction, 0.0), 1.0), message=message)
+
+    def _run(self, build, on_switch, version_dir: Path):
+        try:
+            build(version_dir, self._progress)
+            old_dir = self.versions.current_dir()
+            self.versions.switch(version_dir)
+            if on_switch:
+                on_switch(old_dir, version_dir)
+            self.versions.collect_garbage()
+        except Exception as e:
+            logger.exception("index build failed")
+            shutil.rmtree(version_dir, ignore_errors=True)
+            with self._lock:
+                self._status.update(state="failed", error=str(e), finished=time.time())
+            return
+        with self._lock:
+            self._status.update(state="done", fraction=1.0, finished=time.time())
+
+
+_builders: Dict[str, BackgroundIndexBuilder] = {}
+_builders_lock = threading.Lock()
+
+
+def get_index_builder(root: str) -> BackgroundIndexBuilder:
+    """Return the process-wide builder (and its IndexVersions) for `root`."""
+    with _builders_lock:
+        if root not in _builders:
+            _builders[root] = BackgroundIndexBuilder(IndexVersions(root))
+        return _builders[root]
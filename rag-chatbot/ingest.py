@@ -0,0 +1,293 @@
+"""
+Streaming ingestion pipeline
+----------------------------
+Alternative to `load_documents()` + `create_vector_store()` for large data
+folders. PDFs are extracted in a process pool and flow through the pipeline
+
+    pages -> chunks -> embedding batches -> vector store
+
+one file at a time. A bounded number of files is in flight in the pool and a
+bounded queue sits between chunking and the thread that embeds and upserts,
+so peak memory depends on `max_pending_files` and `queue_depth` rather than
+on the size of the corpus.
+
+The pipeline keeps the incremental manifest from index_manifest.py up to date,
+so unchanged files are skipped and changed files only replace their own chunks.
+"""
+
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from index_manifest import IndexManifest, add_chunks, chunk_ids, delete_chunks, fingerprint
+
+DEFAULT_WORKERS = max(1, (os.cpu_count() or 2) - 1)
+DEFAULT_BATCH_SIZE = 64
+DEFAULT_QUEUE_DEPTH = 8
+
+_DONE = object()
+
+
+def parse_pdf(file_path: Path) -> List:
+    """Extract the pages of one PDF and tag them with citation metadata."""
+    from langchain_community.document_loaders import PyPDFLoader
+
+    loader = PyPDFLoader(str(file_path))
+    docs = loader.load()
+    # Add metadata for citations
+    for doc in docs:
+        doc.metadata["source_file"] = file_path.name
+        if "page" in doc.metadata:
+            doc.metadata["page_number"] = doc.metadata["page"] + 1
+    return docs
+
+
+def _extract_worker(path: str) -> List[Tuple[str, dict]]:
+    """Process-pool entry point: return (text, metadata) pairs for one PDF."""
+    return [(doc.page_content, doc.metadata) for doc in parse_pdf(Path(path))]
+
+
+class IngestStats:
+    """Counters for one pipeline run, read by the progress callback."""
+
+    def __init__(self, total_files: int):
+        self.total_files = total_files
+        self.files_done = 0
+        self.pages = 0
+        self.chunks = 0
+        self.duplicates = 0
+        self.started = time.perf_counter()
+
+    @property
+    def elapsed(self) -> float:
+        return max(time.perf_counter() - self.started, 1e-9)
+
+    @property
+    def pages_per_sec(self) -> float:
+        return self.pages / self.elapsed
+
+    @property
+    def chunks_per_sec(self) -> float:
+        return self.chunks / self.elapsed
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "files": self.files_done,
+            "pages": self.pages,
+            "chunks": self.chunks,
+            "duplicates": self.duplicates,
+            "elapsed_s": round(self.elapsed, 3),
+            "pages_per_sec": round(self.pages_per_sec, 1),
+            "chunks_per_sec": round(self.chunks_per_sec, 1),
+        }
+
+
+def iter_file_pages(
+    pdf_files: List[Path],
+    page_cache=None,
+    workers: int = DEFAULT_WORKERS,
+    max_pending_files: Optional[int] = None,
+    on_error: Optional[Callable[[Path, Exception], None]] = None,
+) -> Iterator[Tuple[Path, List]]:
+    """Yield (file, pages) as files are extracted, in completion order.
+
+    Cache hits are yielded straight away; misses are parsed in a process pool
+    with at most `max_pending_files` files submitted at once. A single miss
+    (or `workers=1`) is parsed in the calling thread instead of starting a
+    pool. Files that fail to parse are reported to `on_error` and skipped.
+    """
+    from langchain.schema import Document
+
+    max_pending_files = max_pending_files or workers * 2
+    misses: List[Tuple[Path, Optional[str]]] = []
+    for file_path in pdf_files:
+        if page_cache is None:
+            misses.append((file_path, None))
+            continue
+        sha, docs = page_cache.lookup(file_path, keep_in_memory=False)
+        if docs is None:
+            misses.append((file_path, sha))
+        else:
+            yield file_path, docs
+
+    if not misses:
+        return
+
+    if len(misses) == 1 or workers <= 1:
+        for file_path, sha in misses:
+            try:
+                docs = parse_pdf(file_path)
+            except Exception as e:
+                if on_error:
+                    on_error(file_path, e)
+                continue
+            if page_cache is not None:
+                page_cache.store(sha, docs, keep_in_memory=False)
+            yield file_path, docs
+        return
+
+    # Callers are threaded (Streamlit, the index builder) and hold SQLite/Chroma
+    # state, which a forked child could inherit mid-lock: start workers fresh
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        pending = {}
+        remaining = iter(misses)
+        while True:
+            while len(pending) < max_pending_files:
+                item = next(remaining, None)
+                if item is None:
+                    break
+                pending[pool.submit(_extract_worker, str(item[0]))] = item
+            if not pending:
+                break
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                file_path, sha = pending.pop(future)
+                try:
+                    records = future.result()
+                except Exception as e:
+                    if on_error:
+                        on_error(file_path, e)
+                    continue
+                docs = [Document(page_content=text, metadata=meta) for text, meta in records]
+                if page_cache is not None:
+                    page_cache.store(sha, docs, keep_in_memory=False)
+                yield file_path, docs
+
+
+def _upsert_worker(
+    vector_store,
+    manifest: IndexManifest,
+    work: "queue.Queue",
+    stats: IngestStats,
+    errors: List[BaseException],
+    keyword_index=None,
+    deduper=None,
+    summary_index=None,
+):
+    """Single writer thread: embed and upsert batches, record finished files."""
+    while True:
+        item = work.get()
+        try:
+            if item is _DONE:
+                return
+            if errors:
+                continue
+            kind = item[0]
+            if kind == "delete":
+                delete_chunks(vector_store, item[1], keyword_index, deduper, summary_index)
+            elif kind == "add":
+                stored = add_chunks(vector_store, item[2], item[1], keyword_index, deduper, summary_index)
+                stats.chunks += len(item[1])
+                stats.duplicates += len(item[1]) - stored
+            elif kind == "file":
+                _, name, entry = item
+                manifest.files[name] = entry
+                manifest.save()
+        except BaseException as e:  # surfaced to the producer
+            errors.append(e)
+        finally:
+            work.task_done()
+
+
+def stream_ingest(
+    vector_store,
+    manifest: IndexManifest,
+    pdf_files: List[Path],
+    splitter,
+    page_cache=None,
+    workers: int = DEFAULT_WORKERS,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    queue_depth: int = DEFAULT_QUEUE_DEPTH,
+    progress: Optional[Callable[[float, str], None]] = None,
+    on_error: Optional[Callable[[Path, Exception], None]] = None,
+    keyword_index=None,
+    deduper=None,
+    summary_index=None,
+) -> Dict[str, object]:
+    """Sync the vector store with `pdf_files` through the streaming pipeline.
+
+    Returns the applied changes plus throughput figures (pages/sec, chunks/sec).
+    `keyword_index` (bm25_index.BM25Index), if given, is updated alongside;
+    `deduper` (dedup.ChunkDeduplicator) keeps duplicate chunks out of both;
+    `summary_index` (hierarchical_index.PageSummaryIndex) follows the same
+    adds and deletes.
+    """
+    stats = IngestStats(len(pdf_files))
+    changes: Dict[str, List[str]] = {"added": [], "changed": [], "removed": [], "unchanged": []}
+    work: "queue.Queue" = queue.Queue(maxsize=queue_depth)
+    errors: List[BaseException] = []
+    writer = threading.Thread(target=_upsert_worker, args=(vector_store, manifest, work, stats, errors, keyword_index, deduper, summary_index), daemon=True)
+    writer.start()
+
+    def report(name: str):
+        if progress:
+            progress(
+                stats.files_done / max(stats.total_files, 1),
+                f"📄 {name} ({stats.files_done}/{stats.total_files}) · "
+                f"{stats.pages_per_sec:.1f} pages/s · {stats.chunks_per_sec:.1f} chunks/s",
+            )
+
+    try:
+        names = {file_path.name for file_path in pdf_files}
+        removed = [name for name in manifest.files if name not in names]
+        for name in removed:
+            work.put(("delete", manifest.files.pop(name)["chunk_ids"]))
+        changes["removed"] = removed
+        if page_cache is not None:
+            page_cache.prune()
+
+        for file_path, docs in iter_file_pages(pdf_files, page_cache, workers, on_error=on_error):
+            if errors:
+                raise errors[0]
+            stats.files_done += 1
+            stats.pages += len(docs)
+            name = file_path.name
+            file_fingerprint = fingerprint(docs)
+            entry = manifest.files.get(name)
+            if entry is not None and entry["fingerprint"] == file_fingerprint:
+                changes["unchanged"].append(name)
+                report(name)
+                continue
+
+            changes["changed" if entry is not None else "added"].append(name)
+            if entry is not None:
+                work.put(("delete", entry["chunk_ids"]))
+
+            splits = splitter.split_documents(docs)
+            ids = chunk_ids(name, file_fingerprint, len(splits))
+            del docs
+            for start in range(0, len(splits), batch_size):
+                work.put(("add", splits[start:start + batch_size], ids[start:start + batch_size]))
+                report(name)
+            page_numbers = [split.metadata.get("page_number") for split in splits]
+            work.put(("file", name, {"fingerprint": file_fingerprint, "chunk_ids": ids, "page_numbers": page_numbers}))
+            report(name)
+
+        work.put(_DONE)
+        writer.join()
+        if progress:
+            progress(
+                1.0,
+                f"✅ {stats.files_done} files · {stats.pages_per_sec:.1f} pages/s · "
+                f"{stats.chunks_per_sec:.1f} chunks/s",
+            )
+    finally:
+        if writer.is_alive():
+            work.put(_DONE)
+    if errors:
+        raise errors[0]
+
+    if changes["removed"] or not manifest.exists():
+        manifest.save()
+    if keyword_index is not None and (changes["removed"] or changes["added"] or changes["changed"]):
+        keyword_index.save()
+    if deduper is not None and (changes["removed"] or changes["added"] or changes["changed"]):
+        deduper.save()
+    if summary_index is not None and (changes["removed"] or changes["added"] or changes["changed"]):
+        summary_index.save()
+    return {"changes": changes, "stats": stats.as_dict()}
@@ -0,0 +1,262 @@
+"""
+Upload ingestion queue
+----------------------
+The sidebar uploader used to write every selected file to the data folder on
+every rerun, and nothing was indexed until the next full sync. Now an upload
+becomes a job in a durable SQLite queue:
+
+- The file's SHA-256 is the dedup key. Content that is already queued,
+  running or indexed (and still on disk) is not written or queued again, so
+  reruns and repeated uploads cost one hash at most.
+- New content is written to the data folder atomically (temp file + rename)
+  and queued. A pool of worker threads parses, chunks and embeds each file
+  and adds it to the live index (see `app.ingest_upload`), while chat keeps
+  answering from the same index.
+- Every job records its state (queued, running, done, failed), progress and
+  message, so the sidebar can show per-file status. The ETA is estimated
+  from the bytes/sec of recently finished jobs.
+- Jobs survive restarts: jobs left running by a stopped process are queued
+  again when the workers start.
+
+Workers only pick up jobs while `ready()` is true (the app waits for the live
+index to be loaded and for no rebuild to be running).
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_QUEUE_PATH = ".ingest_queue.sqlite"
+DEFAULT_WORKERS = 2
+# Used for ETAs until some jobs have finished
+DEFAULT_BYTES_PER_SEC = 256 * 1024
+THROUGHPUT_WINDOW = 20
+POLL_S = 2.0
+ACTIVE_STATES = ("queued", "running")
+
+# Held while a job writes to the live index; jobs parse and embed in parallel but store one at a time
+index_write_lock = threading.Lock()
+
+
+class IngestQueue:
+    """Durable queue of file ingestion jobs, processed by a pool of worker threads."""
+
+    def __init__(
+        self,
+        path: str,
+        process: Callable[[dict, Callable[[float, str], None]], dict],
+        workers: int = DEFAULT_WORKERS,
+        ready: Optional[Callable[[], bool]] = None,
+    ):
+        self.path = path
+        self.process = process
+        self.workers = workers
+        self.ready = ready
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                name TEXT NOT NULL,
+                sha TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                state TEXT NOT NULL,
+                fraction REAL NOT NULL DEFAULT 0,
+                message TEXT NOT NULL DEFAULT '',
+                chunks INTEGER,
+                error TEXT,
+                created REAL NOT NULL,
+                started REAL,
+                finished REAL
+            )"""
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_sha ON jobs (sha)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)")
+
+    # -- producer side -------------------------------------------------------
+
+    def enqueue(self, name: str, data: bytes, dest_dir: Path) -> dict:
+        """Queue `data` for ingestion as `dest_dir / name`, unless the same content is already handled.
+
+        Returns the job that covers this content (possibly an existing one
+        under another file name).
+        """
+        sha = hashlib.sha256(data).hexdigest()
+        dest_path = Path(dest_dir) / name
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT * FROM jobs WHERE sha = ? ORDER BY (name = ?) DESC, id DESC LIMIT 1", (sha, name)
+            ).fetchone()
+            if row is not None:
+                if row["state"] in ACTIVE_STATES:
+                    return dict(row)
+                # A finished job still covers the content if its file wasn't deleted or replaced since
+                latest = self._conn.execute("SELECT MAX(id) FROM jobs WHERE path = ?", (row["path"],)).fetchone()[0]
+                if latest == row["id"] and Path(row["path"]).exists():
+                    return dict(row)
+            dest_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp_path = dest_path.with_name(f".{name}.upload")
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            # Readers of the data folder never see a half-written PDF
+            os.replace(tmp_path, dest_path)
+            cursor = self._conn.execute(
+                "INSERT INTO jobs (name, sha, path, size, state, message, created) VALUES (?, ?, ?, ?, 'queued', 'Queued', ?)",
+                (name, sha, str(dest_path), len(data), time.time()),
+            )
+            job = dict(self._conn.execute("SELECT * FROM jobs WHERE id = ?", (cursor.lastrowid,)).fetchone())
+        with self._wakeup:
+            self._wakeup.notify()
+        return job
+
+    def jobs(self, ids: Optional[List[int]] = None, limit: int = 50) -> List[dict]:
+        """Jobs (the given IDs, or the most recent ones) with an `eta_s` estimate for unfinished ones."""
+        with self._lock:
+            if ids is not None:
+                marks = ",".join("?" * len(ids))
+                rows = self._conn.execute(f"SELECT * FROM jobs WHERE id IN ({marks}) ORDER BY id", list(ids)).fetchall() if ids else []
+            else:
+                rows = self._conn.execute("SELECT * FROM jobs ORDER BY id DESC LIMIT ?", (limit,)).fetchall()[::-1]
+            active = self._conn.execute(
+                "SELECT * FROM jobs WHERE state IN ('queued', 'running') ORDER BY id"
+            ).fetchall()
+        etas = self._estimate(active)
+        return [{**dict(row), "eta_s": etas.get(row["id"])} for row in rows]
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        return {state: count for state, count in rows}
+
+    def throughput(self) -> float:
+        """Bytes/sec of the last jobs that actually indexed something."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT size, finished - started FROM jobs WHERE state = 'done' AND chunks > 0 ORDER BY id DESC LIMIT ?",
+                (THROUGHPUT_WINDOW,),
+            ).fetchall()
+        size = sum(row[0] for row in rows)
+        seconds = sum(row[1] for row in rows)
+        return size / seconds if rows and seconds > 0 else DEFAULT_BYTES_PER_SEC
+
+    def _estimate(self, active: List[sqlite3.Row]) -> Dict[int, float]:
+        """Seconds until each active job finishes: running jobs by their progress, queued ones in order behind them."""
+        rate = self.throughput()
+        now = time.time()
+        # When each worker becomes free
+        free_at = [0.0] * max(1, self.workers)
+        etas: Dict[int, float] = {}
+        for row in active:
+            if row["state"] != "running":
+                continue
+            elapsed = now - (row["started"] or now)
+            if row["fraction"] >= 0.1:
+                remaining = elapsed / row["fraction"] * (1 - row["fraction"])
+            else:
+                remaining = row["size"] / rate - elapsed
+            # Past its estimate: unknown until progress is reported
+            etas[row["id"]] = remaining if remaining > 0 else None
+            slot = free_at.index(min(free_at))
+            free_at[slot] = max(free_at[slot], remaining, 0.0)
+        for row in active:
+            if row["state"] != "queued":
+                continue
+            slot = free_at.index(min(free_at))
+            free_at[slot] += row["size"] / rate
+            etas[row["id"]] = free_at[slot]
+        return {job_id: round(eta, 1) if eta is not None else None for job_id, eta in etas.items()}
+
+    # -- worker side ---------------------------------------------------------
+
+    def start(self):
+        """Start the workers once, re-queueing jobs interrupted by a restart."""
+        with self._lock:
+            if self._threads:
+                return
+            requeued = self._conn.execute(
+                "UPDATE jobs SET state = 'queued', fraction = 0, started = NULL, message = 'Queued (resumed after restart)' "
+                "WHERE state = 'running'"
+            ).rowcount
+            if requeued:
+                logger.info("re-queued %d interrupted ingestion jobs", requeued)
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._work, name=f"ingest-queue-{i}", daemon=True)
+                self._threads.append(thread)
+                thread.start()
+
+    def _claim(self) -> Optional[dict]:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT * FROM jobs WHERE state = 'queued' ORDER BY id LIMIT 1").fetchone()
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET state = 'running', started = ?, message = 'Starting...' WHERE id = ?",
+                        (time.time(), row["id"]),
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return dict(row) if row is not None else None
+
+    def _update(self, job_id: int, **fields):
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _work(self):
+        while True:
+            job = self._claim() if self.ready is None or self.ready() else None
+            if job is None:
+                with self._wakeup:
+                    self._wakeup.wait(POLL_S)
+                continue
+            self._run(job)
+
+    def _run(self, job: dict):
+        def progress(fraction: float, message: str):
+            self._update(job["id"], fraction=min(max(fraction, 0.0), 1.0), message=message)
+
+        try:
+            result = self.process(job, progress) or {}
+        except Exception as e:
+            logger.exception("ingestion of %s failed", job["name"])
+            self._update(job["id"], state="failed", error=str(e), message="Failed", finished=time.time())
+            return
+        self._update(
+            job["id"], state="done", fraction=1.0, chunks=result.get("chunks", 0),
+            message=result.get("message", "Indexed"), finished=time.time(),
+        )
+
+
+_queues: Dict[str, IngestQueue] = {}
+_queues_lock = threading.Lock()
+
+
+def get_ingest_queue(
+    path: str = DEFAULT_QUEUE_PATH,
+    process: Optional[Callable[[dict, Callable[[float, str], None]], dict]] = None,
+    workers: int = DEFAULT_WORKERS,
+    ready: Optional[Callable[[], bool]] = None,
+) -> IngestQueue:
+    """Return the process-wide queue stored at `path`, with its workers running."""
+    with _queues_lock:
+        if path not in _queues:
+            _queues[path] = IngestQueue(path, process, workers, ready)
+        queue = _queues[path]
+    queue.start()
+    return queue
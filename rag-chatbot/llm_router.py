@@ -0,0 +1,331 @@
+"""
+LLM router: hedged requests and failover
+----------------------------------------
+`choose_llm()` used to pick one backend at startup, so a provider with a slow
+tail or an outage made every question wait for the full timeout. When more
+than one backend is configured, `LLMRouter` wraps them (in preference order):
+
+- Rolling stats per backend: time to first token (the latency users feel),
+  total latency and error rate over the last STATS_WINDOW requests.
+- Hedging: if the first backend has not produced a token after its p95 time
+  to first token (HEDGE_DELAY_S until it has HEDGE_MIN_SAMPLES requests), the
+  question is also sent to the next backend. The first backend to stream a
+  token wins; the other request is cancelled. Backends with
+  `supports_abort` (watsonx) get an `on_abort` hook, so a cancelled request
+  that is stuck waiting for a token has its connection shut down at once;
+  others stop at their next chunk. A cancelled request that never produced
+  a token records its wait so far as its time to first token (a lower
+  bound), so slow requests lost to hedging still count in the p95.
+- Failover: an error before the first token moves on to the next backend.
+- Circuit breaker: BREAKER_FAILURES consecutive errors (or an error rate
+  above BREAKER_ERROR_RATE) take a backend out of rotation for
+  BREAKER_COOLDOWN_S; then a single probe request decides whether it is back.
+
+Backends are any LangChain LLM or chat model that can `.stream()`, so the
+router can be exercised with local stub backends (or OPENAI_BASE_URL /
+WATSONX_URL / WATSONX_IAM_URL pointing at stub servers).
+"""
+
+import os
+import queue
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+
+from tracing import percentile
+
+STATS_WINDOW = 200
+HEDGE_ENABLED = os.getenv("LLM_HEDGE", "1") != "0"
+HEDGE_DELAY_S = float(os.getenv("LLM_HEDGE_DELAY_S", "5"))
+HEDGE_MIN_SAMPLES = 20
+BREAKER_FAILURES = int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+BREAKER_ERROR_RATE = 0.5
+BREAKER_MIN_REQUESTS = 10
+BREAKER_COOLDOWN_S = float(os.getenv("LLM_BREAKER_COOLDOWN_S", "30"))
+
+
+class BackendHealth:
+    """Rolling latency/error stats and circuit breaker for one backend."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self.ttft: deque = deque(maxlen=STATS_WINDOW)
+        self.latency: deque = deque(maxlen=STATS_WINDOW)
+        self.outcomes: deque = deque(maxlen=STATS_WINDOW)
+        self.requests = 0
+        self.wins = 0
+        self.hedges = 0
+        self.cancelled = 0
+        self.consecutive_failures = 0
+        self.state = "closed"
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def hedge_delay(self) -> float:
+        """Seconds to wait for a first token before hedging to another backend."""
+        with self._lock:
+            if len(self.ttft) < HEDGE_MIN_SAMPLES:
+                return HEDGE_DELAY_S
+            return percentile(list(self.ttft), 95)
+
+    def error_rate(self) -> float:
+        with self._lock:
+            return self.outcomes.count(False) / len(self.outcomes) if self.outcomes else 0.0
+
+    def try_acquire(self) -> bool:
+        """True if a request may go to this backend now (closed, or the half-open probe)."""
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self.opened_at >= BREAKER_COOLDOWN_S:
+                self.state = "half-open"
+            if self.state == "closed":
+                return True
+            if self.state == "half-open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def first_token(self, seconds: float):
+        with self._lock:
+            self.ttft.append(seconds)
+
+    def success(self, seconds: float):
+        with self._lock:
+            self.latency.append(seconds)
+            self.outcomes.append(True)
+            self.consecutive_failures = 0
+            self.state = "closed"
+            self._probe_in_flight = False
+
+    def failure(self):
+        with self._lock:
+            self.outcomes.append(False)
+            self.consecutive_failures += 1
+            failing = self.consecutive_failures >= BREAKER_FAILURES or (
+                len(self.outcomes) >= BREAKER_MIN_REQUESTS
+                and self.outcomes.count(False) / len(self.outcomes) > BREAKER_ERROR_RATE
+            )
+            if self.state == "half-open" or failing:
+                self.state = "open"
+                self.opened_at = time.monotonic()
+            self._probe_in_flight = False
+
+    def release(self, waited: Optional[float] = None):
+        """A cancelled request says nothing about errors; free the probe slot.
+
+        `waited` is how long it ran without a first token, recorded as a
+        censored time to first token.
+        """
+        with self._lock:
+            self.cancelled += 1
+            self._probe_in_flight = False
+            if waited is not None:
+                self.ttft.append(waited)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            ttft, latency, outcomes = list(self.ttft), list(self.latency), list(self.outcomes)
+            return {
+                "state": self.state,
+                "requests": self.requests,
+                "wins": self.wins,
+                "hedges": self.hedges,
+                "cancelled": self.cancelled,
+                "error_rate": round(outcomes.count(False) / len(outcomes), 3) if outcomes else 0.0,
+                "ttft_p50_s": round(percentile(ttft, 50), 3),
+                "ttft_p95_s": round(percentile(ttft, 95), 3),
+                "latency_p95_s": round(percentile(latency, 95), 3),
+            }
+
+
+def _chunk_text(chunk: Any) -> str:
+    # LLMs stream str, chat models stream message chunks
+    return chunk if isinstance(chunk, str) else getattr(chunk, "content", "") or ""
+
+
+class _Attempt:
+    """One request to one backend, streamed by a worker thread into the router's queue."""
+
+    def __init__(self, name: str, backend: Any, health: BackendHealth, events: "queue.Queue"):
+        self.name = name
+        self.backend = backend
+        self.health = health
+        self.events = events
+        self.cancel = threading.Event()
+        self.started = time.perf_counter()
+        self.first_token_at: Optional[float] = None
+        self._abort_lock = threading.Lock()
+        self._aborts: List[Callable[[], None]] = []
+
+    def start(self, prompt: str, stop: Optional[List[str]]):
+        threading.Thread(target=self._run, args=(prompt, stop), name=f"llm-{self.name}", daemon=True).start()
+
+    def on_abort(self, callback: Callable[[], None]):
+        """Backend hook: `callback` tears down this request's stream if it is cancelled."""
+        with self._abort_lock:
+            if not self.cancel.is_set():
+                self._aborts.append(callback)
+                return
+        callback()
+
+    def abort(self):
+        """Cancel a request that lost (or is no longer needed) and close its stream."""
+        with self._abort_lock:
+            if self.cancel.is_set():
+                return
+            self.cancel.set()
+            callbacks, self._aborts = self._aborts, []
+        waited = None if self.first_token_at is not None else time.perf_counter() - self.started
+        self.health.release(waited)
+        for callback in callbacks:
+            callback()
+
+    def _run(self, prompt: str, stop: Optional[List[str]]):
+        kwargs = {"on_abort": self.on_abort} if getattr(self.backend, "supports_abort", False) else {}
+        try:
+            stream = self.backend.stream(prompt, stop=stop, **kwargs)
+            try:
+                for chunk in stream:
+                    if self.cancel.is_set():
+                        break
+                    text = _chunk_text(chunk)
+                    if text:
+                        self.events.put(("chunk", self, text))
+            finally:
+                # Closing the generator closes the HTTP response of a cancelled stream
+                stream.close()
+        except Exception as e:
+            self.events.put(("error", self, e))
+            return
+        self.events.put(("done", self, None))
+
+
+class LLMRouter(LLM):
+    """Route each prompt across several LLM backends with hedging and circuit breakers."""
+
+    backends: Dict[str, Any]
+    hedge: bool = HEDGE_ENABLED
+    backend_health: Dict[str, Any] = {}
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.backend_health = {name: BackendHealth(name) for name in self.backends}
+
+    @property
+    def _llm_type(self) -> str:
+        return "router"
+
+    def health(self, name: str) -> BackendHealth:
+        return self.backend_health[name]
+
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {name: health.stats() for name, health in self.backend_health.items()}
+
+    def _next_backend(self, tried: set) -> Optional[str]:
+        for name in self.backends:
+            if name not in tried and self.backend_health[name].try_acquire():
+                return name
+        return None
+
+    def _stream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[GenerationChunk]:
+        events: "queue.Queue" = queue.Queue()
+        tried: set = set()
+        running: List[_Attempt] = []
+        winner: Optional[_Attempt] = None
+        last_error: Optional[BaseException] = None
+
+        def launch() -> Optional[_Attempt]:
+            name = self._next_backend(tried)
+            if name is None:
+                return None
+            tried.add(name)
+            health = self.backend_health[name]
+            with health._lock:
+                health.requests += 1
+            attempt = _Attempt(name, self.backends[name], health, events)
+            attempt.start(prompt, stop)
+            running.append(attempt)
+            return attempt
+
+        if launch() is None:
+            raise RuntimeError("all LLM backends are unavailable (circuit breakers open)")
+        hedged = False
+        try:
+            while running:
+                timeout = None
+                if winner is None and self.hedge and not hedged and len(tried) < len(self.backends):
+                    first = running[0]
+                    timeout = max(0.0, first.health.hedge_delay() - (time.perf_counter() - first.started))
+                try:
+                    kind, attempt, payload = events.get(timeout=timeout)
+                except queue.Empty:
+                    # No token within the primary's p95: ask the next backend as well
+                    hedged = True
+                    hedge = launch()
+                    if hedge is not None:
+                        with hedge.health._lock:
+                            hedge.health.hedges += 1
+                    continue
+                if attempt.cancel.is_set():
+                    continue
+
+                if kind == "chunk":
+                    if attempt.first_token_at is None:
+                        attempt.first_token_at = time.perf_counter()
+                        attempt.health.first_token(attempt.first_token_at - attempt.started)
+                    if winner is None:
+                        winner = attempt
+                        with attempt.health._lock:
+                            attempt.health.wins += 1
+                        for other in running:
+                            if other is not attempt:
+                                other.abort()
+                        running[:] = [attempt]
+                    chunk = GenerationChunk(text=payload)
+                    if run_manager:
+                        run_manager.on_llm_new_token(payload, chunk=chunk)
+                    yield chunk
+                elif kind == "done":
+                    attempt.health.success(time.perf_counter() - attempt.started)
+                    if winner is None:
+                        # Finished without streaming anything: an empty answer still wins
+                        winner = attempt
+                        for other in running:
+                            if other is not attempt:
+                                other.abort()
+                    return
+                else:  # error
+                    attempt.health.failure()
+                    running.remove(attempt)
+                    last_error = payload
+                    if attempt is winner:
+                        # Tokens were already shown; a retry elsewhere would repeat them
+                        raise payload
+                    if not running and launch() is None:
+                        raise last_error
+        finally:
+            for attempt in running:
+                if attempt is not winner:
+                    attempt.abort()
+        if last_error is not None:
+            raise last_error
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        return "".join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs))
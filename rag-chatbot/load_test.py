@@ -0,0 +1,657 @@
+"""
+Load testing with stub backends
+-------------------------------
+Replays recorded questions against the full headless pipeline (the
+`api_server.get_qa_chain()` chain: query embedding, vector + BM25 search,
+context packing, LLM streaming) with OpenAI and watsonx replaced by local
+stub servers, so capacity can be planned without API keys or spend:
+
+    python load_test.py --questions chat_history.json --concurrency 1,4,16 \\
+        --ttft-ms 400 --ttft-p95-ms 1500 --error-rate 0.02
+
+The stubs run in a child process and serve:
+
+- OpenAI `/v1/embeddings` (deterministic hashed vectors) and
+  `/v1/chat/completions` (streamed or not),
+- watsonx `/identity/token`, `/ml/v1/text/generation` and
+  `/ml/v1/text/generation_stream`.
+
+Embedding latency, time to first token and per-token delay are drawn from
+log-normal distributions given by their median and p95. `--error-rate`
+answers that share of requests with `--error-status`, and `--stub-capacity`
+caps concurrent stub requests like a provider's concurrency limit.
+`python load_test.py --serve-stubs --port 9000` runs the stubs on their own,
+e.g. to point a real `api_server.py` at them.
+
+For each concurrency level, that many sessions replay the question stream
+(in order, cycling) one question at a time, `--think-ms` apart, through at
+most `--workers` pipelines in flight (default API_MAX_CONCURRENCY). The
+report shows, per level:
+
+- throughput (questions/s and tokens/s) and errors,
+- end-to-end latency, time to first token and service time percentiles,
+- queueing: time waiting for a pipeline slot, and inside the stubs,
+- resident memory: baseline after warm-up, peak, and growth per session,
+- p50/p95 of every traced stage.
+
+The environment is pointed at the stubs before anything is built (real keys
+are never used), the index is built from `--corpus` in a temporary
+directory and `EMBED_CACHE_PATH` points there too, so neither the app's
+index nor its embedding cache are touched.
+"""
+
+import argparse
+import base64
+import json
+import math
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+from tracing import percentile
+
+STUB_PROJECT_ID = "load-test"
+STUB_MODEL_ID = "stub-model"
+STUB_EMBED_DIM = 384
+MEMORY_SAMPLE_S = 0.05
+WORDS = (
+    "the beam load column slab design shear moment steel concrete section code "
+    "requirement table figure value factor member span support wind seismic"
+).split()
+
+
+def csv_list(cast):
+    return lambda value: [cast(item) for item in value.split(",") if item]
+
+
+class LatencyModel:
+    """Log-normal delay given its median and p95 (milliseconds)."""
+
+    def __init__(self, median_ms: float, p95_ms: Optional[float] = None):
+        self.median_s = max(0.0, median_ms) / 1000
+        p95_s = max(self.median_s, (p95_ms if p95_ms is not None else median_ms) / 1000)
+        # p95 of a log-normal is median * exp(1.645 * sigma)
+        self.sigma = 0.0 if not self.median_s else math.log(p95_s / self.median_s) / 1.645
+
+    def sample(self, rng: random.Random) -> float:
+        if not self.median_s:
+            return 0.0
+        return rng.lognormvariate(math.log(self.median_s), self.sigma)
+
+
+# -- stub servers ---------------------------------------------------------------
+
+
+class StubServer(ThreadingHTTPServer):
+    """OpenAI and watsonx stand-ins with configurable latency, errors and capacity."""
+
+    daemon_threads = True
+
+    def __init__(self, address, config: Dict[str, Any]):
+        super().__init__(address, StubHandler)
+        self.config = config
+        self.embed_latency = LatencyModel(config["embed_ms"], config["embed_p95_ms"])
+        self.ttft_latency = LatencyModel(config["ttft_ms"], config["ttft_p95_ms"])
+        self.token_latency = LatencyModel(config["token_ms"], config["token_p95_ms"])
+        self.rng = random.Random(config["seed"])
+        self.rng_lock = threading.Lock()
+        self.slots = threading.BoundedSemaphore(config["capacity"]) if config["capacity"] > 0 else None
+        self.stats_lock = threading.Lock()
+        self.reset_stats()
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.requests: Dict[str, int] = {}
+            self.errors = 0
+            self.queue_waits: List[float] = []
+            self.in_flight = 0
+            self.peak_in_flight = 0
+
+    def draw(self, model: LatencyModel) -> float:
+        with self.rng_lock:
+            return model.sample(self.rng)
+
+    def fail(self) -> bool:
+        with self.rng_lock:
+            return self.rng.random() < self.config["error_rate"]
+
+    def stats(self) -> Dict[str, Any]:
+        with self.stats_lock:
+            waits = list(self.queue_waits)
+            return {
+                "requests": dict(self.requests),
+                "errors_injected": self.errors,
+                "peak_in_flight": self.peak_in_flight,
+                "queue_wait_p50_ms": round(percentile(waits, 50) * 1000, 1),
+                "queue_wait_p95_ms": round(percentile(waits, 95) * 1000, 1),
+            }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "RAGStub/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_body(self, status: int, body: Any, content_type: str = "application/json"):
+        data = body if isinstance(body, bytes) else json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def start_events(self):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def send_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        if self.path == "/stats":
+            self.send_body(200, self.server.stats())
+        else:
+            self.send_body(404, {"error": "not found"})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        path = self.path.split("?", 1)[0]
+        if path == "/stats/reset":
+            self.server.reset_stats()
+            self.send_body(200, {"ok": True})
+            return
+        if path.endswith("/identity/token"):
+            # The IAM exchange is not part of what is being measured
+            self.send_body(200, {"access_token": "stub-token", "expires_in": 3600})
+            return
+        handlers = {
+            "/v1/embeddings": self.embeddings,
+            "/v1/chat/completions": self.chat_completions,
+            "/ml/v1/text/generation": self.generation,
+            "/ml/v1/text/generation_stream": self.generation,
+        }
+        handler = handlers.get(path)
+        if handler is None:
+            self.send_body(404, {"error": "not found"})
+            return
+        server = self.server
+        with server.stats_lock:
+            server.requests[path] = server.requests.get(path, 0) + 1
+        queued = time.perf_counter()
+        if server.slots is not None:
+            server.slots.acquire()
+        try:
+            with server.stats_lock:
+                server.queue_waits.append(time.perf_counter() - queued)
+                server.in_flight += 1
+                server.peak_in_flight = max(server.peak_in_flight, server.in_flight)
+            if server.fail():
+                with server.stats_lock:
+                    server.errors += 1
+                self.send_body(server.config["error_status"], {"error": "injected failure"})
+                return
+            handler(json.loads(raw or b"{}"), stream=path.endswith("_stream"))
+        except (BrokenPipeError, ConnectionResetError):
+            # The client cancelled (e.g. a hedged request that lost)
+            self.close_connection = True
+        finally:
+            with server.stats_lock:
+                server.in_flight -= 1
+            if server.slots is not None:
+                server.slots.release()
+
+    def answer_tokens(self) -> List[str]:
+        with self.server.rng_lock:
+            return [self.server.rng.choice(WORDS) + " " for _ in range(self.server.config["answer_tokens"])]
+
+    def stream_tokens(self, tokens: List[str], event):
+        """Send one server-sent event per token, after the time-to-first-token delay."""
+        self.start_events()
+        time.sleep(self.server.draw(self.server.ttft_latency))
+        for i, token in enumerate(tokens):
+            if i:
+                time.sleep(self.server.draw(self.server.token_latency))
+            self.send_chunk(event(token, i))
+
+    def embeddings(self, body: dict, stream: bool = False):
+        from embeddings import HashingEmbeddings
+
+        inputs = body.get("input", [])
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        # Token arrays (OpenAIEmbeddings tokenizes long texts first) are hashed as text too
+        texts = [text if isinstance(text, str) else " ".join(map(str, text)) for text in inputs]
+        time.sleep(self.server.draw(self.server.embed_latency))
+        vectors = HashingEmbeddings(STUB_EMBED_DIM).embed_documents(texts)
+        data = []
+        for i, vector in enumerate(vectors):
+            if body.get("encoding_format") == "base64":
+                import numpy as np
+
+                vector = base64.b64encode(np.asarray(vector, dtype="<f4").tobytes()).decode("ascii")
+            data.append({"object": "embedding", "index": i, "embedding": vector})
+        tokens = sum(len(text.split()) for text in texts)
+        self.send_body(200, {
+            "object": "list", "data": data, "model": body.get("model", STUB_MODEL_ID),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        })
+
+    def chat_completions(self, body: dict, stream: bool = False):
+        tokens = self.answer_tokens()
+        created = int(time.time())
+        model = body.get("model", STUB_MODEL_ID)
+        if not body.get("stream"):
+            time.sleep(self.server.draw(self.server.ttft_latency) + sum(
+                self.server.draw(self.server.token_latency) for _ in tokens[1:]
+            ))
+            self.send_body(200, {
+                "id": "chatcmpl-stub", "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(tokens)}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(tokens), "total_tokens": len(tokens)},
+            })
+            return
+
+        def event(token: str, i: int) -> bytes:
+            delta = {"role": "assistant", "content": token} if i == 0 else {"content": token}
+            chunk = {
+                "id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None}],
+            }
+            return f"data: {json.dumps(chunk)}\n\n".encode("utf-8")
+
+        self.stream_tokens(tokens, event)
+        done = {
+            "id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": created, "model": model,
+            "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}],
+        }
+        self.send_chunk(f"data: {json.dumps(done)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+        self.send_chunk(b"")
+
+    def generation(self, body: dict, stream: bool = False):
+        tokens = self.answer_tokens()
+        if not stream:
+            time.sleep(self.server.draw(self.server.ttft_latency) + sum(
+                self.server.draw(self.server.token_latency) for _ in tokens[1:]
+            ))
+            self.send_body(200, {
+                "model_id": body.get("model_id", STUB_MODEL_ID),
+                "results": [{"generated_text": "".join(tokens), "generated_token_count": len(tokens), "stop_reason": "eos_token"}],
+            })
+            return
+
+        def event(token: str, i: int) -> bytes:
+            payload = {"results": [{"generated_text": token, "generated_token_count": i + 1, "stop_reason": "not_finished"}]}
+            return f"id: {i + 1}\nevent: message\ndata: {json.dumps(payload)}\n\n".encode("utf-8")
+
+        self.stream_tokens(tokens, event)
+        self.send_chunk(b"")
+
+
+def serve_stubs(config: Dict[str, Any], port: int = 0, ready=None):
+    """Run the stub servers until killed; the bound port is put on `ready` if given."""
+    server = StubServer(("127.0.0.1", port), config)
+    if ready is not None:
+        ready.put(server.server_port)
+    else:
+        print(f"Stub OpenAI/watsonx servers on http://127.0.0.1:{server.server_port}", flush=True)
+    server.serve_forever()
+
+
+def start_stubs(config: Dict[str, Any]):
+    """Start the stubs in a child process, so they don't share its GIL or memory with the pipeline."""
+    context = multiprocessing.get_context("spawn")
+    ready = context.Queue()
+    process = context.Process(target=serve_stubs, args=(config, 0, ready), daemon=True)
+    process.start()
+    return process, f"http://127.0.0.1:{ready.get(timeout=60)}"
+
+
+def stub_request(url: str, path: str, method: str = "GET") -> dict:
+    request = urllib.request.Request(url + path, data=b"" if method == "POST" else None, method=method)
+    with urllib.request.urlopen(request, timeout=10) as response:
+        return json.loads(response.read())
+
+
+def point_environment_at(url: str, llm: str, embeddings: str, workdir: Path):
+    """Configure the app's backends to use the stubs (and never a real key)."""
+    for name in ("OPENAI_API_KEY", "OPENAI_BASE_URL", "OPENAI_API_BASE",
+                 "WATSONX_API_KEY", "WATSONX_URL", "WATSONX_IAM_URL", "WATSONX_PROJECT_ID", "WATSONX_MODEL_ID"):
+        os.environ.pop(name, None)
+    if llm in ("openai", "both") or embeddings == "stub":
+        os.environ.update({
+            "OPENAI_API_KEY": "stub-key",
+            "OPENAI_BASE_URL": f"{url}/v1",
+            "OPENAI_API_BASE": f"{url}/v1",
+        })
+    if llm in ("watsonx", "both"):
+        os.environ.update({
+            "WATSONX_API_KEY": "stub-key",
+            "WATSONX_URL": url,
+            "WATSONX_IAM_URL": f"{url}/identity/token",
+            "WATSONX_PROJECT_ID": STUB_PROJECT_ID,
+            "WATSONX_MODEL_ID": STUB_MODEL_ID,
+        })
+    os.environ["EMBEDDING_BACKEND"] = "openai" if embeddings == "stub" else embeddings
+    os.environ["EMBED_CACHE_PATH"] = str(workdir / "embed_cache.sqlite")
+
+
+# -- question streams -----------------------------------------------------------
+
+
+def load_questions(path: Path) -> List[str]:
+    """User questions from a chat history (JSON list or session JSONL logs) or a batch_qa JSONL file."""
+    if path.is_dir():
+        items = []
+        for log in sorted(path.glob("*.jsonl")):
+            items.extend(_read_jsonl(log))
+    elif path.suffix == ".jsonl":
+        items = _read_jsonl(path)
+    else:
+        with open(path, "r") as f:
+            items = json.load(f)
+    questions = []
+    for item in items:
+        if isinstance(item, str):
+            questions.append(item)
+        elif "question" in item:
+            questions.append(str(item["question"]))
+        elif item.get("role") == "user" and item.get("content"):
+            questions.append(str(item["content"]))
+    return [question for question in questions if question.strip()]
+
+
+def _read_jsonl(path: Path) -> List[Any]:
+    items = []
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                continue
+    return items
+
+
+# -- load generation ------------------------------------------------------------
+
+
+def rss_bytes() -> int:
+    """Resident set size of this process (peak RSS where /proc is unavailable)."""
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+class MemorySampler:
+    """Track peak RSS in the background while a level runs."""
+
+    def __init__(self, interval: float = MEMORY_SAMPLE_S):
+        self.interval = interval
+        self.peak = rss_bytes()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="memory-sampler", daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, rss_bytes())
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, rss_bytes())
+
+
+def ask(question: str) -> Dict[str, Any]:
+    """Run one question through the shared chain like api_server does; returns timings."""
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    import api_server
+    import tracing
+    from callback_handlers import TracingCallbackHandler
+    from shared_resources import get_shared_resources
+
+    class TokenTimer(BaseCallbackHandler):
+        def __init__(self):
+            self.first_token_at = None
+            self.tokens = 0
+
+        def on_llm_new_token(self, token: str, **kwargs) -> None:
+            if self.first_token_at is None:
+                self.first_token_at = time.perf_counter()
+            self.tokens += 1
+
+    timer = TokenTimer()
+    started = time.perf_counter()
+    resources = get_shared_resources()
+    for _ in range(2):
+        chain, version = api_server.get_qa_chain()
+        if chain is None:
+            raise RuntimeError("QA chain unavailable")
+        with resources.reading(), tracing.trace("question", query=question):
+            if version != resources.version:
+                continue
+            chain({"query": question}, callbacks=[timer, TracingCallbackHandler()])
+            break
+    return {
+        "ttft_s": timer.first_token_at - started if timer.first_token_at else None,
+        "tokens": timer.tokens,
+    }
+
+
+def run_level(questions: List[str], sessions: int, total: int, workers: int, think_s: float) -> List[Dict[str, Any]]:
+    """`sessions` closed-loop sessions replay `total` questions through at most `workers` pipelines."""
+    slots = threading.BoundedSemaphore(workers)
+    records: List[Dict[str, Any]] = []
+    lock = threading.Lock()
+    position = iter(range(total))
+
+    def session(session_id: int):
+        while True:
+            with lock:
+                index = next(position, None)
+            if index is None:
+                return
+            question = questions[index % len(questions)]
+            arrived = time.perf_counter()
+            with slots:
+                started = time.perf_counter()
+                record = {"session": session_id, "queue_wait_s": started - arrived}
+                try:
+                    record.update(ask(question))
+                except Exception as e:
+                    record["error"] = str(e)
+                finished = time.perf_counter()
+            record["service_s"] = finished - started
+            record["latency_s"] = finished - arrived
+            record["finished_at"] = finished
+            with lock:
+                records.append(record)
+            if think_s:
+                time.sleep(think_s)
+
+    threads = [threading.Thread(target=session, args=(i,), name=f"session-{i}", daemon=True) for i in range(sessions)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return records
+
+
+def summarize(records: List[Dict[str, Any]], elapsed: float) -> Dict[str, Any]:
+    ok = [r for r in records if "error" not in r]
+    ms = lambda values, pct: round(percentile(values, pct) * 1000, 1)
+    latency = [r["latency_s"] for r in ok]
+    # As users feel it: queueing included
+    ttft = [r["ttft_s"] + r["queue_wait_s"] for r in ok if r.get("ttft_s") is not None]
+    service = [r["service_s"] for r in ok]
+    waits = [r["queue_wait_s"] for r in records]
+    return {
+        "questions": len(records),
+        "errors": len(records) - len(ok),
+        "elapsed_s": round(elapsed, 2),
+        "throughput_qps": round(len(ok) / elapsed, 2) if elapsed else 0.0,
+        "tokens_per_s": round(sum(r["tokens"] for r in ok) / elapsed, 1) if elapsed else 0.0,
+        "latency_p50_ms": ms(latency, 50),
+        "latency_p95_ms": ms(latency, 95),
+        "latency_p99_ms": ms(latency, 99),
+        "ttft_p50_ms": ms(ttft, 50),
+        "ttft_p95_ms": ms(ttft, 95),
+        "service_p50_ms": ms(service, 50),
+        "service_p95_ms": ms(service, 95),
+        "queue_wait_p50_ms": ms(waits, 50),
+        "queue_wait_p95_ms": ms(waits, 95),
+        "queue_wait_max_ms": round(max(waits, default=0.0) * 1000, 1),
+    }
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Load-test the RAG pipeline against stub LLM/embedding servers")
+    parser.add_argument("--questions", type=Path, default=Path("chat_history.json"),
+                        help="Question stream: chat_history.json, a chat_history/ folder or batch_qa JSONL")
+    parser.add_argument("--corpus", type=Path, help="Folder of PDFs to index (default: the app's data folder)")
+    parser.add_argument("--concurrency", type=csv_list(int), default=[1, 4, 16], help="Concurrent sessions per level")
+    parser.add_argument("--per-level", type=int, default=0, help="Questions per level (default: the stream once, at least 2 per session)")
+    parser.add_argument("--workers", type=int, help="Pipelines in flight (default: API_MAX_CONCURRENCY)")
+    parser.add_argument("--think-ms", type=float, default=0, help="Pause between a session's questions")
+    parser.add_argument("--llm", choices=["watsonx", "openai", "both"], default="watsonx",
+                        help="Stub LLM backend(s); 'both' goes through the LLM router")
+    parser.add_argument("--embeddings", choices=["stub", "hash", "local"], default="stub",
+                        help="Query/chunk embeddings: the OpenAI stub, or a local backend")
+    parser.add_argument("--embed-ms", type=float, default=20, help="Stub embedding latency, median")
+    parser.add_argument("--embed-p95-ms", type=float, default=60)
+    parser.add_argument("--ttft-ms", type=float, default=400, help="Stub time to first token, median")
+    parser.add_argument("--ttft-p95-ms", type=float, default=1500)
+    parser.add_argument("--token-ms", type=float, default=15, help="Stub delay between tokens, median")
+    parser.add_argument("--token-p95-ms", type=float, default=40)
+    parser.add_argument("--answer-tokens", type=int, default=60, help="Tokens per stub answer")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of stub requests that fail")
+    parser.add_argument("--error-status", type=int, default=503, help="HTTP status of injected failures")
+    parser.add_argument("--stub-capacity", type=int, default=0, help="Max concurrent stub requests (0: unlimited)")
+    parser.add_argument("--stub-url", help="Use stubs already running at this URL")
+    parser.add_argument("--serve-stubs", action="store_true", help="Only run the stub servers")
+    parser.add_argument("--port", type=int, default=9000, help="Port for --serve-stubs")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", type=Path, help="Report file (default: bench_results/load-<time>.json)")
+    args = parser.parse_args(argv)
+
+    stub_config = {
+        "embed_ms": args.embed_ms, "embed_p95_ms": args.embed_p95_ms,
+        "ttft_ms": args.ttft_ms, "ttft_p95_ms": args.ttft_p95_ms,
+        "token_ms": args.token_ms, "token_p95_ms": args.token_p95_ms,
+        "answer_tokens": args.answer_tokens, "error_rate": args.error_rate, "error_status": args.error_status,
+        "capacity": args.stub_capacity, "seed": args.seed,
+    }
+    if args.serve_stubs:
+        serve_stubs(stub_config, args.port)
+        return 0
+
+    questions = load_questions(args.questions)
+    if not questions:
+        print(f"No questions found in {args.questions}", file=sys.stderr)
+        return 1
+    stub_process = None
+    if args.stub_url:
+        url = args.stub_url.rstrip("/")
+    else:
+        stub_process, url = start_stubs(stub_config)
+    workdir = Path(tempfile.mkdtemp(prefix="rag-load-"))
+    point_environment_at(url, args.llm, args.embeddings, workdir)
+
+    # Imported only now: the backends read the environment set above
+    import api_server
+    import app
+    import tracing
+
+    app.PERSIST_DIR = str(workdir / "index")
+    if args.corpus:
+        app.DATA_DIR = args.corpus
+    workers = args.workers or api_server.API_MAX_CONCURRENCY
+    try:
+        started = time.perf_counter()
+        chain, _ = api_server.get_qa_chain()
+        if chain is None:
+            print(f"Could not build the QA chain from {app.DATA_DIR}", file=sys.stderr)
+            return 1
+        print(f"Index and chain ready in {time.perf_counter() - started:.1f}s; {len(questions)} questions, "
+              f"LLM stub {args.llm}, embeddings {args.embeddings}, {workers} workers")
+        ask(questions[0])
+
+        results = []
+        for sessions in args.concurrency:
+            total = args.per_level or max(len(questions), 2 * sessions)
+            stub_request(url, "/stats/reset", "POST")
+            tracing.reset()
+            baseline = rss_bytes()
+            with MemorySampler() as memory:
+                level_started = time.perf_counter()
+                records = run_level(questions, sessions, total, workers, args.think_ms / 1000)
+                elapsed = time.perf_counter() - level_started
+            metrics = summarize(records, elapsed)
+            metrics.update({
+                "rss_baseline_mb": round(baseline / 2**20, 1),
+                "rss_peak_mb": round(memory.peak / 2**20, 1),
+                "mb_per_session": round((memory.peak - baseline) / 2**20 / sessions, 2),
+                "stub": stub_request(url, "/stats"),
+                "stages": {name: {"p50_ms": s["p50_ms"], "p95_ms": s["p95_ms"]} for name, s in tracing.stage_percentiles().items()},
+            })
+            errors = sorted({r["error"] for r in records if "error" in r})
+            if errors:
+                metrics["error_samples"] = errors[:5]
+            results.append({"sessions": sessions, "workers": workers, "metrics": metrics})
+            print(
+                f"{sessions:3d} sessions: {metrics['throughput_qps']} q/s, {metrics['tokens_per_s']} tok/s, "
+                f"{metrics['errors']}/{metrics['questions']} errors | latency p50 {metrics['latency_p50_ms']} "
+                f"p95 {metrics['latency_p95_ms']} p99 {metrics['latency_p99_ms']} ms, ttft p50 {metrics['ttft_p50_ms']} "
+                f"p95 {metrics['ttft_p95_ms']} ms | queue p95 {metrics['queue_wait_p95_ms']} ms "
+                f"(stub {metrics['stub']['queue_wait_p95_ms']} ms) | RSS peak {metrics['rss_peak_mb']} MB, "
+                f"{metrics['mb_per_session']} MB/session"
+            )
+            slowest = sorted(metrics["stages"].items(), key=lambda item: -item[1]["p95_ms"])[:6]
+            print("     stages p95: " + ", ".join(f"{name} {s['p95_ms']} ms" for name, s in slowest))
+    finally:
+        if stub_process is not None:
+            stub_process.terminate()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    output = args.output or Path("bench_results") / f"load-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    meta = {
+        "questions": str(args.questions),
+        "corpus": str(app.DATA_DIR),
+        "llm": args.llm,
+        "embeddings": args.embeddings,
+        "stub": stub_config,
+        "think_ms": args.think_ms,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+    with open(output, "w") as f:
+        json.dump({"meta": meta, "results": results}, f, indent=2)
+    print(f"Results written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
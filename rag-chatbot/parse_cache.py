@@ -0,0 +1,179 @@
+"""
+Persistent page cache for parsed PDFs
+-------------------------------------
+Streamlit reruns the whole script on every interaction, which used to mean
+running PyPDFLoader over every file in the data folder for every chat message.
+This cache stores the extracted pages on disk, keyed by the SHA-256 of the file
+contents, so only new or changed files are ever parsed again.
+
+A small index of (size, mtime) per path is used as a fast check so unchanged
+files are not even re-hashed. Syncs call `prune()` so paths that were deleted
+drop out of it. Parsed pages are also kept in memory for the most recently
+used files (at most `memory_files`).
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+DEFAULT_CACHE_DIR = ".parse_cache"
+INDEX_FILE = "index.json"
+HASH_BLOCK_SIZE = 1024 * 1024
+DEFAULT_MEMORY_FILES = 64
+
+
+def file_sha256(file_path: Path) -> str:
+    """Return the hex SHA-256 of a file's contents."""
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class PageCache:
+    """On-disk cache of extracted pages keyed by file content hash."""
+
+    def __init__(self, cache_dir: str = DEFAULT_CACHE_DIR, memory_files: int = DEFAULT_MEMORY_FILES):
+        self.cache_dir = Path(cache_dir)
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.memory_files = memory_files
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # content hash -> pages, least recently used first
+        self._memory: "OrderedDict[str, List]" = OrderedDict()
+        self._index = self._read_index()
+
+    def _read_index(self) -> Dict[str, dict]:
+        index_path = self.cache_dir / INDEX_FILE
+        if not index_path.exists():
+            return {}
+        try:
+            with open(index_path, "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _write_index(self):
+        index_path = self.cache_dir / INDEX_FILE
+        tmp_path = index_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, index_path)
+
+    def content_hash(self, file_path: Path) -> str:
+        """Return the content hash, re-hashing only if size or mtime changed."""
+        stat = file_path.stat()
+        key = str(file_path.resolve())
+        entry = self._index.get(key)
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry["sha256"]
+
+        sha = file_sha256(file_path)
+        with self._lock:
+            self._index[key] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "sha256": sha}
+            self._write_index()
+        return sha
+
+    def prune(self) -> int:
+        """Drop index entries of files that no longer exist; returns how many were dropped."""
+        with self._lock:
+            stale = [key for key in self._index if not Path(key).exists()]
+            for key in stale:
+                del self._index[key]
+            if stale:
+                self._write_index()
+        return len(stale)
+
+    def _pages_path(self, sha: str) -> Path:
+        return self.cache_dir / f"{sha}.json"
+
+    def _remember(self, sha: str, docs: List):
+        with self._lock:
+            self._memory[sha] = docs
+            self._memory.move_to_end(sha)
+            while len(self._memory) > self.memory_files:
+                self._memory.popitem(last=False)
+
+    def _load_pages(self, sha: str, keep_in_memory: bool = True) -> Optional[List]:
+        from langchain.schema import Document
+
+        with self._lock:
+            docs = self._memory.get(sha)
+            if docs is not None:
+                self._memory.move_to_end(sha)
+                return docs
+        pages_path = self._pages_path(sha)
+        if not pages_path.exists():
+            return None
+        try:
+            with open(pages_path, "r") as f:
+                records = json.load(f)
+        except (OSError, ValueError):
+            return None
+        docs = [Document(page_content=r["page_content"], metadata=r["metadata"]) for r in records]
+        if keep_in_memory:
+            self._remember(sha, docs)
+        return docs
+
+    def lookup(self, file_path: Path, keep_in_memory: bool = True) -> Tuple[str, Optional[List]]:
+        """Return the file's content hash and its cached pages (None on a miss).
+
+        Streaming ingestion passes `keep_in_memory=False` so pages are not
+        pinned in RAM after they have been indexed.
+        """
+        sha = self.content_hash(file_path)
+        docs = self._load_pages(sha, keep_in_memory)
+        if docs and docs[0].metadata.get("source_file") != file_path.name:
+            # Same content cached under another file name: cite this file
+            docs = [
+                type(d)(page_content=d.page_content, metadata={**d.metadata, "source": str(file_path), "source_file": file_path.name})
+                for d in docs
+            ]
+        with self._lock:
+            if docs is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return sha, docs
+
+    def store(self, sha: str, docs: List, keep_in_memory: bool = True):
+        """Write extracted pages for a content hash to the cache."""
+        records = [{"page_content": d.page_content, "metadata": d.metadata} for d in docs]
+        pages_path = self._pages_path(sha)
+        tmp_path = pages_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(records, f)
+        os.replace(tmp_path, pages_path)
+        if keep_in_memory:
+            self._remember(sha, docs)
+
+    def get_or_parse(self, file_path: Path, parse: Callable[[Path], List]) -> List:
+        """Return cached pages for a file, parsing and caching them on a miss."""
+        sha, docs = self.lookup(file_path)
+        if docs is None:
+            docs = parse(file_path)
+            self.store(sha, docs)
+        return docs
+
+    def stats(self) -> Dict[str, int]:
+        """Return hit/miss counters for the debug panel."""
+        return {"hits": self.hits, "misses": self.misses, "files": len(self._index)}
+
+
+_page_cache: Optional[PageCache] = None
+_page_cache_lock = threading.Lock()
+
+
+def get_page_cache(cache_dir: str = DEFAULT_CACHE_DIR) -> PageCache:
+    """Return the process-wide page cache (shared across Streamlit reruns)."""
+    global _page_cache
+    with _page_cache_lock:
+        if _page_cache is None or _page_cache.cache_dir != Path(cache_dir):
+            _page_cache = PageCache(cache_dir)
+        return _page_cache
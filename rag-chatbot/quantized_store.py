@@ -0,0 +1,398 @@
+"""
+Quantized vector store
+----------------------
+Chroma keeps each chunk's float32 vector (6 KB at 1536 dimensions) and the
+HNSW graph in memory, in every process that opens the index. This backend
+(VECTOR_BACKEND=quantized) stores vectors in flat files in the index directory:
+
+    vectors.i8      int8 codes, one row per chunk (1 byte per dimension)
+    vectors.f32     the exact vectors, unit length, float32
+    chunks.sqlite   chunk ID, text, metadata, row number and int8 scale
+
+Both vector files are memory-mapped read-only, so every process that opens an
+index shares one copy in the OS page cache. A query scans the int8 codes with
+NumPy (a quarter of the bytes of float32), then re-ranks the best
+`rerank_factor * k` candidates by exact cosine similarity; only those rows of
+vectors.f32 are read from disk.
+
+Codes use symmetric per-vector scaling, q = round(v / s) with s = max|v| / 127,
+on unit-length vectors. Deleting chunks leaves dead rows in the vector files;
+they are compacted away once they outnumber the live ones. One process writes
+an index version (the background builder or a sync), any number read it;
+readers notice new commits through SQLite's data_version.
+
+Compaction renumbers rows, so every renumbering bumps a `generation` counter.
+A search maps the rows it scanned back to chunks only if the generation is
+still the one it scanned, and scans again if it changed or a hit has been
+deleted meanwhile. Readers map the vector
+files while holding SQLite's write lock, which a writer holds while it swaps
+them, so the rows they read always describe the files they map.
+
+`python benchmark.py --backend chroma,quantized` reports the memory/recall
+trade-off against Chroma.
+"""
+
+import json
+import os
+import sqlite3
+import threading
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+CODES_FILE = "vectors.i8"
+VECTORS_FILE = "vectors.f32"
+CHUNKS_FILE = "chunks.sqlite"
+RERANK_FACTOR = int(os.getenv("QUANTIZED_RERANK_FACTOR", "8"))
+# Rows converted to float32 at a time while scanning codes
+SCAN_BLOCK = 16384
+SQLITE_MAX_VARS = 500
+# Scans repeated when a compaction renumbers rows mid-query, before giving up
+MAX_SEARCH_ATTEMPTS = 5
+
+
+def quantize(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Return (unit-length float32 vectors, int8 codes, per-row scales)."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    unit = (vectors / np.where(norms == 0, 1, norms)).astype(np.float32)
+    peak = np.abs(unit).max(axis=1, keepdims=True)
+    scales = np.where(peak == 0, 1, peak) / 127
+    codes = np.clip(np.round(unit / scales), -127, 127).astype(np.int8)
+    return unit, codes, scales.ravel().astype(np.float32)
+
+
+class QuantizedVectorStore(VectorStore):
+    """Int8 codes scanned with NumPy, exact float re-ranking, memory-mapped files."""
+
+    def __init__(
+        self,
+        persist_directory: str,
+        embedding_function: Embeddings,
+        rerank_factor: int = RERANK_FACTOR,
+    ):
+        self._persist_directory = persist_directory
+        self._embedding_function = embedding_function
+        self.rerank_factor = rerank_factor
+        os.makedirs(persist_directory, exist_ok=True)
+        self._codes_path = os.path.join(persist_directory, CODES_FILE)
+        self._vectors_path = os.path.join(persist_directory, VECTORS_FILE)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(
+            os.path.join(persist_directory, CHUNKS_FILE), check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            """CREATE TABLE IF NOT EXISTS chunks (
+                id TEXT PRIMARY KEY,
+                row INTEGER NOT NULL UNIQUE,
+                scale REAL NOT NULL,
+                text TEXT NOT NULL,
+                metadata TEXT NOT NULL
+            )"""
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._data_version = None
+        self._generation = 0
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding_function
+
+    # -- bookkeeping -------------------------------------------------------
+
+    def _meta(self, key: str) -> int:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def _transaction(self, begin: str, read):
+        """Run `read()` inside a transaction on the shared connection (hold `_lock`)."""
+        self._conn.execute(begin)
+        try:
+            result = read()
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        return result
+
+    def _refresh(self):
+        """Reload row bookkeeping and remap the vector files if the index changed."""
+        version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        if version == self._data_version:
+            return
+
+        def load():
+            rows, dim = self._meta("rows"), self._meta("dim")
+            self._generation = self._meta("generation")
+            self._scales = np.zeros(rows, dtype=np.float32)
+            self._alive = np.zeros(rows, dtype=bool)
+            for row, scale in self._conn.execute("SELECT row, scale FROM chunks"):
+                self._scales[row] = scale
+                self._alive[row] = True
+            if rows and dim:
+                self._codes = np.memmap(self._codes_path, dtype=np.int8, mode="r", shape=(rows, dim))
+                self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(rows, dim))
+            else:
+                self._codes = self._vectors = None
+
+        # Under the write lock: a writer in another process can't swap the files in between
+        self._transaction("BEGIN IMMEDIATE", load)
+        self._data_version = version
+
+    def _changed(self):
+        # data_version only moves for other connections' commits; force a reload after our own
+        self._data_version = None
+
+    def count(self) -> int:
+        return self._conn.execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+    def memory_bytes(self) -> Dict[str, int]:
+        """Bytes scanned per query (codes + scales) and bytes kept on disk for re-ranking."""
+        rows, dim = self._meta("rows"), self._meta("dim")
+        return {"scan_bytes": rows * (dim + 4), "rerank_bytes": rows * dim * 4}
+
+    # -- writes ------------------------------------------------------------
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        texts = list(texts)
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        ids = list(ids) if ids else [uuid.uuid4().hex for _ in texts]
+        unit, codes, scales = quantize(np.asarray(self._embedding_function.embed_documents(texts), dtype=np.float32))
+        with self._lock:
+            rows, dim = self._meta("rows"), self._meta("dim")
+            if dim and unit.shape[1] != dim:
+                raise ValueError(f"embedding dimension {unit.shape[1]} does not match the index ({dim})")
+            dim = unit.shape[1]
+            # Drop bytes a crashed writer appended after the last commit
+            for path, itemsize, data in ((self._codes_path, 1, codes), (self._vectors_path, 4, unit)):
+                with open(path, "ab") as f:
+                    f.truncate(rows * dim * itemsize)
+                    f.write(data.tobytes())
+            self._conn.execute("BEGIN")
+            self._delete_ids(ids)
+            self._conn.executemany(
+                "INSERT INTO chunks (id, row, scale, text, metadata) VALUES (?, ?, ?, ?, ?)",
+                [
+                    (chunk_id, rows + i, float(scale), text, json.dumps(meta or {}))
+                    for i, (chunk_id, scale, text, meta) in enumerate(zip(ids, scales, texts, metadatas))
+                ],
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                [("rows", rows + len(texts)), ("dim", dim)],
+            )
+            self._conn.execute("COMMIT")
+            self._changed()
+        return ids
+
+    def _delete_ids(self, ids: List[str]):
+        for start in range(0, len(ids), SQLITE_MAX_VARS):
+            part = ids[start:start + SQLITE_MAX_VARS]
+            self._conn.execute(f"DELETE FROM chunks WHERE id IN ({','.join('?' * len(part))})", part)
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        if not ids:
+            return False
+        with self._lock:
+            self._conn.execute("BEGIN")
+            self._delete_ids(list(ids))
+            self._conn.execute("COMMIT")
+            self._changed()
+            if self._meta("rows") > 2 * self.count():
+                self.compact()
+        return True
+
+    def compact(self):
+        """Rewrite the vector files without dead rows."""
+        with self._lock:
+            self._refresh()
+            live = [row for (row,) in self._conn.execute("SELECT row FROM chunks ORDER BY row")]
+            dim = self._meta("dim")
+            for path, source in ((self._codes_path, self._codes), (self._vectors_path, self._vectors)):
+                with open(path + ".tmp", "wb") as f:
+                    for start in range(0, len(live), SCAN_BLOCK):
+                        f.write(np.ascontiguousarray(source[live[start:start + SCAN_BLOCK]]).tobytes() if dim else b"")
+            self._codes = self._vectors = None
+
+            def renumber():
+                # Two passes so the new row numbers never collide with old ones under UNIQUE(row)
+                self._conn.execute("UPDATE chunks SET row = -1 - row")
+                self._conn.executemany(
+                    "UPDATE chunks SET row = ? WHERE row = ?", [(new, -1 - old) for new, old in enumerate(live)]
+                )
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                    [("rows", len(live)), ("generation", self._meta("generation") + 1)],
+                )
+                # Swapped while the write lock is held, so no reader maps new files with old rows
+                os.replace(self._codes_path + ".tmp", self._codes_path)
+                os.replace(self._vectors_path + ".tmp", self._vectors_path)
+
+            self._transaction("BEGIN IMMEDIATE", renumber)
+            self._changed()
+
+    def delete_collection(self):
+        """Remove every chunk and empty the vector files."""
+        with self._lock:
+
+            def clear():
+                generation = self._meta("generation")
+                self._conn.execute("DELETE FROM chunks")
+                self._conn.execute("DELETE FROM meta")
+                # Row numbers start again from 0
+                self._conn.execute("INSERT INTO meta (key, value) VALUES ('generation', ?)", (generation + 1,))
+                # New empty files rather than truncating: readers may still be scanning the old ones
+                for path in (self._codes_path, self._vectors_path):
+                    open(path + ".tmp", "wb").close()
+                    os.replace(path + ".tmp", path)
+
+            self._codes = self._vectors = None
+            self._transaction("BEGIN IMMEDIATE", clear)
+            self._changed()
+
+    # -- reads -------------------------------------------------------------
+
+    def get(self, ids: Optional[List[str]] = None, include: Optional[List[str]] = None,
+            limit: Optional[int] = None, offset: int = 0, **kwargs: Any) -> Dict[str, List]:
+        """Chroma-style bulk read of stored chunks (used to rebuild the keyword index).
+
+        `include=["embeddings", ...]` also returns the exact (unit-length) vectors.
+        """
+
+        def read() -> List[tuple]:
+            if ids is None:
+                return self._conn.execute(
+                    "SELECT id, row, text, metadata FROM chunks ORDER BY row LIMIT ? OFFSET ?",
+                    (-1 if limit is None else limit, offset),
+                ).fetchall()
+            rows, wanted = [], list(ids)
+            for start in range(0, len(wanted), SQLITE_MAX_VARS):
+                part = wanted[start:start + SQLITE_MAX_VARS]
+                rows += self._conn.execute(
+                    f"SELECT id, row, text, metadata FROM chunks WHERE id IN ({','.join('?' * len(part))})", part
+                ).fetchall()
+            return sorted(rows, key=lambda r: r[1])
+
+        if include and "embeddings" in include:
+
+            def read_with_vectors():
+                rows, dim = read(), self._meta("dim")
+                if not rows:
+                    return rows, []
+                # Mapped afresh under the write lock, so the rows index the files as they are now
+                vectors = np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(self._meta("rows"), dim))
+                return rows, vectors[[r[1] for r in rows]]
+
+            with self._lock:
+                rows, vectors = self._transaction("BEGIN IMMEDIATE", read_with_vectors)
+        else:
+            rows = read()
+        result = {
+            "ids": [r[0] for r in rows],
+            "documents": [r[2] for r in rows],
+            "metadatas": [json.loads(r[3]) for r in rows],
+        }
+        if include and "embeddings" in include:
+            result["embeddings"] = vectors
+        return result
+
+    def _search(self, embedding: List[float], k: int) -> Tuple[int, List[Tuple[int, float]]]:
+        """Return the row generation scanned and (row, cosine similarity) of the k nearest live rows."""
+        query = np.asarray(embedding, dtype=np.float32)
+        query = query / (np.linalg.norm(query) or 1)
+        with self._lock:
+            self._refresh()
+            codes, vectors, scales, alive = self._codes, self._vectors, self._scales, self._alive
+            generation = self._generation
+        if codes is None or not alive.any():
+            return generation, []
+        if query.shape[0] != codes.shape[1]:
+            raise ValueError(f"query dimension {query.shape[0]} does not match the index ({codes.shape[1]})")
+
+        # Approximate scores from the int8 codes, a block at a time
+        scores = np.empty(len(codes), dtype=np.float32)
+        for start in range(0, len(codes), SCAN_BLOCK):
+            block = codes[start:start + SCAN_BLOCK]
+            scores[start:start + len(block)] = block.astype(np.float32) @ query
+        scores *= scales
+        scores[~alive] = -np.inf
+
+        # Re-rank the best candidates with their exact vectors
+        candidates = min(int(alive.sum()), max(k, k * self.rerank_factor))
+        top = np.sort(np.argpartition(-scores, candidates - 1)[:candidates])
+        exact = vectors[top] @ query
+        order = np.argsort(-exact)[:k]
+        return generation, [(int(top[i]), float(exact[i])) for i in order]
+
+    def _documents(self, rows: List[int], generation: int) -> Optional[Dict[int, Document]]:
+        """Documents at `rows` as numbered in `generation`, or None if rows were renumbered since."""
+
+        def read():
+            if self._meta("generation") != generation:
+                return None
+            found = {}
+            for start in range(0, len(rows), SQLITE_MAX_VARS):
+                part = rows[start:start + SQLITE_MAX_VARS]
+                for row, text, metadata in self._conn.execute(
+                    f"SELECT row, text, metadata FROM chunks WHERE row IN ({','.join('?' * len(part))})", part
+                ):
+                    found[row] = Document(page_content=text, metadata=json.loads(metadata))
+            return found
+
+        with self._lock:
+            return self._transaction("BEGIN", read)
+
+    def similarity_search_by_vector_with_score(
+        self, embedding: List[float], k: int = 4, filter: Optional[dict] = None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        """Nearest chunks with their cosine distance (lower is closer, as Chroma reports)."""
+        if filter:
+            raise ValueError("QuantizedVectorStore does not support metadata filters")
+        for attempt in range(MAX_SEARCH_ATTEMPTS):
+            generation, hits = self._search(embedding, k)
+            docs = self._documents([row for row, _ in hits], generation)
+            if docs is None:
+                continue
+            # Rows are never reused within a generation, so a missing row was deleted (or
+            # re-added as a new row) since the scan: scan again, or skip it on the last try
+            if len(docs) == len(hits) or attempt == MAX_SEARCH_ATTEMPTS - 1:
+                return [(docs[row], 1.0 - similarity) for row, similarity in hits if row in docs]
+        raise RuntimeError("the index kept being compacted during the search, please retry")
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, **kwargs)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self._embedding_function.embed_query(query), k, **kwargs)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, **kwargs)]
+
+    def _select_relevance_score_fn(self):
+        return self._cosine_relevance_score_fn
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        persist_directory: str = ".quantized",
+        **kwargs: Any,
+    ) -> "QuantizedVectorStore":
+        store = cls(persist_directory=persist_directory, embedding_function=embedding, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
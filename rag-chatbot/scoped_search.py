@@ -0,0 +1,240 @@
+"""
+Scoped retrieval: one file or a page range
+------------------------------------------
+Users often ask about one spec or one book. Filtering a global top-k after
+the fact returns too few (or no) hits from the wanted file, and raising k
+until enough survive makes the search as slow as the whole corpus.
+
+Instead the manifest is used as a metadata index: it records the chunk IDs
+of every file and the page number of each chunk. A scoped query resolves the scope (files plus an optional page range) to
+chunk IDs, reads just those vectors from the store and scores them exactly
+with NumPy, so the cost is proportional to the size of the selected subset.
+The vectors of the last few scopes are kept in memory, since a user
+usually asks several questions about the same document. With hybrid
+retrieval the BM25 search is restricted to the same chunks.
+
+The scope travels with the request in a context variable, because the QA
+chain (and its retriever) is shared by every session:
+
+    with search_scope(SearchScope(files=("ASCE-7.pdf",), first_page=10, last_page=40)):
+        chain({"query": question})
+
+Chunks folded into a duplicate group (see dedup.py) are scored through
+their group's stored chunk, but returned with their own file and page.
+"""
+
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+import tracing
+from bm25_index import FETCH_K, reciprocal_rank_fusion
+from index_manifest import MANIFEST_FILE, IndexManifest
+
+# Scopes whose vectors stay in memory
+SUBSET_CACHE_SIZE = 8
+
+
+@dataclass(frozen=True)
+class SearchScope:
+    """Files to search (every file if empty) and an optional inclusive page range."""
+
+    files: Tuple[str, ...] = ()
+    first_page: Optional[int] = None
+    last_page: Optional[int] = None
+
+    def __bool__(self) -> bool:
+        return bool(self.files) or self.first_page is not None or self.last_page is not None
+
+    def matches_page(self, page: Any) -> bool:
+        if self.first_page is None and self.last_page is None:
+            return True
+        if not isinstance(page, int):
+            return False
+        return (self.first_page is None or page >= self.first_page) and (self.last_page is None or page <= self.last_page)
+
+    def label(self) -> str:
+        label = ", ".join(self.files) if self.files else "all files"
+        if self.first_page is not None or self.last_page is not None:
+            label += f", pages {self.first_page or 1}-{self.last_page if self.last_page is not None else 'end'}"
+        return label
+
+
+_current_scope: ContextVar[Optional[SearchScope]] = ContextVar("search_scope", default=None)
+
+
+@contextmanager
+def search_scope(scope: Optional[SearchScope]):
+    """Restrict retrieval in this context (thread / request) to `scope`."""
+    token = _current_scope.set(scope or None)
+    try:
+        yield
+    finally:
+        _current_scope.reset(token)
+
+
+def current_scope() -> Optional[SearchScope]:
+    return _current_scope.get()
+
+
+def _unit(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
+
+
+class ScopePartitions:
+    """Per-file partitions of an index (chunk IDs and page numbers), read from its manifest."""
+
+    def __init__(self, persist_dir: str):
+        self.persist_dir = persist_dir
+        self._lock = threading.Lock()
+        self._manifest_mtime: Optional[int] = None
+        # file name -> [(chunk ID, page number)]
+        self.files: Dict[str, List[Tuple[str, Any]]] = {}
+        # stored chunk IDs of a scope -> (unit vectors, {stored ID: (row, Document)})
+        self._subsets: "OrderedDict[tuple, tuple]" = OrderedDict()
+
+    def refresh(self):
+        """Reload the partitions if the manifest changed since the last query."""
+        path = Path(self.persist_dir) / MANIFEST_FILE
+        mtime = path.stat().st_mtime_ns if path.exists() else None
+        with self._lock:
+            if mtime == self._manifest_mtime:
+                return
+            manifest = IndexManifest(self.persist_dir)
+            self.files = {
+                name: list(zip(entry["chunk_ids"], entry["page_numbers"])) for name, entry in manifest.files.items()
+            }
+            self._manifest_mtime = mtime
+
+    def page_range(self, name: str) -> Tuple[int, int]:
+        pages = [page for _, page in self.files.get(name, []) if isinstance(page, int)]
+        return (min(pages), max(pages)) if pages else (1, 1)
+
+    def resolve(self, scope: SearchScope, deduper=None) -> List[Tuple[str, str]]:
+        """(chunk ID, stored chunk ID) of every chunk in the scope."""
+        names = scope.files or tuple(self.files)
+        pairs = []
+        for name in names:
+            for chunk_id, page in self.files.get(name, []):
+                if scope.matches_page(page):
+                    stored = deduper.member_of.get(chunk_id, chunk_id) if deduper is not None else chunk_id
+                    pairs.append((chunk_id, stored))
+        return pairs
+
+    def _subset(self, vector_store, stored_ids: List[str]):
+        key = tuple(stored_ids)
+        with self._lock:
+            if key in self._subsets:
+                self._subsets.move_to_end(key)
+                return self._subsets[key]
+        batch = vector_store.get(ids=stored_ids, include=["embeddings", "documents", "metadatas"])
+        if len(batch["ids"]):
+            matrix = _unit(np.asarray(batch["embeddings"], dtype=np.float32))
+        else:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+        docs = {
+            chunk_id: (row, Document(page_content=text or "", metadata=meta or {}))
+            for row, (chunk_id, text, meta) in enumerate(zip(batch["ids"], batch["documents"], batch["metadatas"]))
+        }
+        with self._lock:
+            self._subsets[key] = (matrix, docs)
+            while len(self._subsets) > SUBSET_CACHE_SIZE:
+                self._subsets.popitem(last=False)
+        return matrix, docs
+
+    def search(self, vector_store, vector, scope: SearchScope, k: int = 4, deduper=None) -> List[Document]:
+        """Exact top-k over the chunks in `scope` only."""
+        self.refresh()
+        pairs = self.resolve(scope, deduper)
+        stored_ids = list(dict.fromkeys(stored for _, stored in pairs))
+        with tracing.span("scoped_search", candidates=len(stored_ids), k=k):
+            if not stored_ids:
+                return []
+            matrix, docs = self._subset(vector_store, stored_ids)
+            if not docs:
+                return []
+            scores = matrix @ _unit(np.asarray(vector, dtype=np.float32))
+            scoped_chunks = {chunk_id for chunk_id, _ in pairs}
+            ranked = []
+            for chunk_id, stored in pairs:
+                if stored not in docs:
+                    continue
+                if chunk_id != stored and stored in scoped_chunks:
+                    # The group's stored chunk is in scope itself and cites this copy
+                    continue
+                ranked.append((float(scores[docs[stored][0]]), chunk_id, stored))
+            ranked.sort(key=lambda item: -item[0])
+            results, seen = [], set()
+            for _, chunk_id, stored in ranked:
+                if stored in seen:
+                    continue
+                seen.add(stored)
+                if chunk_id == stored:
+                    doc = docs[stored][1]
+                    # Copies, so the cached subset is never modified downstream
+                    results.append(Document(page_content=doc.page_content, metadata=dict(doc.metadata)))
+                else:
+                    member = deduper.groups[stored]["members"][chunk_id]
+                    results.append(Document(page_content=member["text"], metadata={**member["metadata"], "chunk_id": stored}))
+                if len(results) == k:
+                    break
+            return results
+
+    def stored_ids(self, scope: SearchScope, deduper=None) -> set:
+        return {stored for _, stored in self.resolve(scope, deduper)}
+
+
+class ScopedRetriever(BaseRetriever):
+    """Searches only the current scope's chunks when one is set; otherwise defers to `base_retriever`."""
+
+    base_retriever: Any
+    vector_store: Any
+    partitions: Any
+    keyword_index: Any = None
+    deduper: Any = None
+    k: int = 4
+    fetch_k: int = FETCH_K
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        scope = current_scope()
+        if not scope:
+            return self.base_retriever.invoke(query, config={"callbacks": run_manager.get_child()})
+        with tracing.span("embed_query"):
+            vector = self.vector_store.embeddings.embed_query(query)
+        if self.keyword_index is None:
+            return self.partitions.search(self.vector_store, vector, scope, self.k, self.deduper)
+        dense = self.partitions.search(self.vector_store, vector, scope, self.fetch_k, self.deduper)
+        with tracing.span("bm25_search", k=self.fetch_k):
+            allowed = self.partitions.stored_ids(scope, self.deduper)
+            sparse = [doc for doc, _ in self.keyword_index.search(query, k=self.fetch_k, allowed=allowed)]
+        return reciprocal_rank_fusion([dense, sparse], self.k)
+
+
+_partitions: Dict[str, ScopePartitions] = {}
+_partitions_lock = threading.Lock()
+
+
+def get_scope_partitions(persist_dir: str) -> ScopePartitions:
+    """Return the process-wide partitions of the index in `persist_dir`."""
+    with _partitions_lock:
+        if persist_dir not in _partitions:
+            _partitions[persist_dir] = ScopePartitions(persist_dir)
+        return _partitions[persist_dir]
+
+
+def forget_scope_partitions(persist_dir: str):
+    """Drop the partitions and cached vectors of `persist_dir` (e.g. an index version that was retired)."""
+    with _partitions_lock:
+        _partitions.pop(persist_dir, None)
@@ -0,0 +1,121 @@
+"""
+Process-wide shared resources
+-----------------------------
+Streamlit runs every browser session in its own thread but in the same
+process. Keeping the vector store, LLM client and QA chain in
+`st.session_state` meant every new tab opened its own Chroma client and LLM
+wrapper. This registry builds each resource once per process and hands the
+same instance to every session.
+
+Queries take the read side of a readers-writer lock; invalidating the index
+takes the write side, so it waits for in-flight queries and bumps `version`.
+Sessions compare their last seen version with `version` to notice that they
+must pick up the new resources.
+"""
+
+import threading
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Optional
+
+
+class ReadWriteLock:
+    """Many concurrent readers or one writer; writers are not starved by new readers."""
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def reading(self):
+        with self._cond:
+            while self._writer or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def writing(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writer = False
+                self._cond.notify_all()
+
+
+class SharedResources:
+    """Build-once registry of objects shared by every session in the process."""
+
+    def __init__(self):
+        self.version = 0
+        self.rw_lock = ReadWriteLock()
+        self._items: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+        self._build_locks: Dict[str, threading.Lock] = {}
+        self._threads: Dict[str, threading.Thread] = {}
+
+    def peek(self, key: str) -> Optional[Any]:
+        return self._items.get(key)
+
+    def get(self, key: str, factory: Callable[[], Any]) -> Optional[Any]:
+        """Return the shared `key`, building it with `factory` if needed.
+
+        Concurrent sessions asking for the same key wait for a single build.
+        A factory returning None is not cached, so it is retried next time.
+        """
+        item = self._items.get(key)
+        if item is not None:
+            return item
+        with self._lock:
+            build_lock = self._build_locks.setdefault(key, threading.Lock())
+        with build_lock:
+            item = self._items.get(key)
+            if item is None:
+                item = factory()
+                if item is not None:
+                    self._items[key] = item
+            return item
+
+    def invalidate(self, *keys: str):
+        """Drop resources (all if no keys given) once in-flight reads finish."""
+        with self.rw_lock.writing():
+            with self._lock:
+                for key in keys or list(self._items):
+                    self._items.pop(key, None)
+                self.version += 1
+
+    def reading(self):
+        """Context manager held while a query uses the shared resources."""
+        return self.rw_lock.reading()
+
+    def run_in_background(self, key: str, func: Callable[[], Any]) -> threading.Thread:
+        """Start `func` in a daemon thread once per process; return that thread."""
+        with self._lock:
+            thread = self._threads.get(key)
+            if thread is None:
+                thread = threading.Thread(target=func, name=key, daemon=True)
+                self._threads[key] = thread
+                thread.start()
+            return thread
+
+
+_shared = SharedResources()
+
+
+def get_shared_resources() -> SharedResources:
+    """Return the registry shared by all Streamlit sessions in this process."""
+    return _shared
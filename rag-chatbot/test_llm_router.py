@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Tests for the LLM router's hedging, failover and circuit breakers with stub backends
+Run with: python -m pytest test_llm_router.py
+"""
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import llm_router
+from llm_router import LLMRouter
+from watsonx_llm import WatsonxLLMWrapper
+
+
+class StubBackend:
+    """Streams `tokens` after `delay` seconds, or raises `error`; counts its calls."""
+
+    def __init__(self, tokens=("ok",), delay: float = 0.0, error: Exception = None):
+        self.tokens = list(tokens)
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+
+    def stream(self, prompt, stop=None):
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        yield from self.tokens
+
+
+@pytest.fixture(autouse=True)
+def fast_router(monkeypatch):
+    monkeypatch.setattr(llm_router, "HEDGE_DELAY_S", 0.05)
+    monkeypatch.setattr(llm_router, "BREAKER_FAILURES", 2)
+    monkeypatch.setattr(llm_router, "BREAKER_COOLDOWN_S", 0.1)
+
+
+def test_slow_primary_is_hedged_and_its_wait_recorded():
+    primary, secondary = StubBackend(["slow"], delay=1.0), StubBackend(["fast ", "answer"])
+    router = LLMRouter(backends={"primary": primary, "secondary": secondary})
+    started = time.perf_counter()
+    assert router.invoke("question") == "fast answer"
+    assert time.perf_counter() - started < 0.5
+
+    stats = router.stats()
+    assert stats["secondary"]["hedges"] == 1 and stats["secondary"]["wins"] == 1
+    assert stats["primary"]["cancelled"] == 1
+    # The cancelled primary never streamed, but its wait counts as a (censored) first token time
+    assert stats["primary"]["ttft_p95_s"] >= 0.05
+
+
+def test_fast_primary_is_not_hedged():
+    primary, secondary = StubBackend(["hi"]), StubBackend(["unused"])
+    router = LLMRouter(backends={"primary": primary, "secondary": secondary})
+    assert router.invoke("question") == "hi"
+    assert secondary.calls == 0
+
+
+def test_error_fails_over_to_the_next_backend():
+    primary, secondary = StubBackend(error=RuntimeError("down")), StubBackend(["backup"])
+    router = LLMRouter(backends={"primary": primary, "secondary": secondary}, hedge=False)
+    assert router.invoke("question") == "backup"
+    assert router.stats()["primary"]["error_rate"] == 1.0
+
+    secondary.error = RuntimeError("also down")
+    with pytest.raises(RuntimeError, match="also down"):
+        router.invoke("question")
+
+
+def test_breaker_opens_then_half_open_probe_closes_it():
+    primary, secondary = StubBackend(error=RuntimeError("down")), StubBackend(["backup"])
+    router = LLMRouter(backends={"primary": primary, "secondary": secondary}, hedge=False)
+    for _ in range(2):
+        router.invoke("question")
+    assert router.health("primary").state == "open"
+
+    # Open: the primary is skipped altogether
+    router.invoke("question")
+    assert primary.calls == 2
+
+    # After the cooldown a single probe goes through; a failure re-opens the breaker
+    time.sleep(0.15)
+    router.invoke("question")
+    assert primary.calls == 3
+    assert router.health("primary").state == "open"
+
+    time.sleep(0.15)
+    primary.error = None
+    primary.tokens = ["recovered"]
+    assert router.invoke("question") == "recovered"
+    assert router.health("primary").state == "closed"
+
+
+def test_all_breakers_open_raises():
+    router = LLMRouter(backends={"only": StubBackend(error=RuntimeError("down"))}, hedge=False)
+    for _ in range(2):
+        with pytest.raises(RuntimeError, match="down"):
+            router.invoke("question")
+    with pytest.raises(RuntimeError, match="unavailable"):
+        router.invoke("question")
+
+
+class HangingWatsonx(ThreadingHTTPServer):
+    """IAM endpoint plus a generation stream that sends headers, then never a token."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), HangingHandler)
+        self.release = threading.Event()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class HangingHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.path == "/identity/token":
+            body = b'{"access_token": "token", "expires_in": 3600}'
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        self.wfile.flush()
+        self.server.release.wait(30)
+
+
+def test_cancelled_watsonx_stream_is_closed_at_once():
+    server = HangingWatsonx()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        hung = WatsonxLLMWrapper(
+            api_key="hang-key", url=server.url, iam_url=f"{server.url}/identity/token",
+            project_id="project", model_id="model",
+        )
+        router = LLMRouter(backends={"watsonx": hung, "stub": StubBackend(["hedged"])})
+        assert router.invoke("question") == "hedged"
+
+        # Without the abort hook the worker would sit in recv() until the 60s read timeout
+        workers = [t for t in threading.enumerate() if t.name == "llm-watsonx"]
+        for worker in workers:
+            worker.join(timeout=2)
+        assert not any(worker.is_alive() for worker in workers)
+    finally:
+        server.release.set()
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Tests for the quantized vector store, including searches racing compaction
+Run with: python -m pytest test_quantized_store.py
+"""
+
+import threading
+
+import numpy as np
+
+from embeddings import HashingEmbeddings
+from quantized_store import QuantizedVectorStore
+
+ANCHORS = 20
+
+
+def anchor_text(i: int) -> str:
+    return f"anchor {i} girder{i} bolt{i} weld{i}"
+
+
+def make_store(tmp_path) -> QuantizedVectorStore:
+    store = QuantizedVectorStore(str(tmp_path / "index"), HashingEmbeddings(64))
+    store.add_texts(
+        [anchor_text(i) for i in range(ANCHORS)],
+        metadatas=[{"anchor": i} for i in range(ANCHORS)],
+        ids=[f"anchor-{i}" for i in range(ANCHORS)],
+    )
+    return store
+
+
+def test_search_and_exact_vectors(tmp_path):
+    store = make_store(tmp_path)
+    doc, distance = store.similarity_search_with_score(anchor_text(3), k=1)[0]
+    assert doc.metadata == {"anchor": 3}
+    assert abs(distance) < 1e-5
+
+    result = store.get(ids=["anchor-5", "anchor-2"], include=["embeddings"])
+    assert result["ids"] == ["anchor-2", "anchor-5"]
+    expected = np.asarray(HashingEmbeddings(64).embed_documents([anchor_text(2), anchor_text(5)]))
+    assert np.allclose(result["embeddings"], expected, atol=1e-6)
+
+
+def test_compaction_keeps_chunks_and_drops_dead_rows(tmp_path):
+    store = make_store(tmp_path)
+    store.add_texts([f"filler {i}" for i in range(ANCHORS * 2)], ids=[f"filler-{i}" for i in range(ANCHORS * 2)])
+    store.delete(ids=[f"filler-{i}" for i in range(ANCHORS * 2)])
+    assert store.memory_bytes()["scan_bytes"] == ANCHORS * (64 + 4)
+    assert store.similarity_search(anchor_text(7), k=1)[0].metadata == {"anchor": 7}
+
+    store.delete_collection()
+    assert store.count() == 0
+    assert store.similarity_search(anchor_text(7), k=1) == []
+
+
+def test_search_during_deletes_and_compaction(tmp_path):
+    store = make_store(tmp_path)
+    stop = threading.Event()
+    errors = []
+
+    def churn():
+        # Fillers sit before and between anchors, so every compaction renumbers the anchors
+        round_ = 0
+        while not stop.is_set():
+            ids = [f"filler-{round_}-{i}" for i in range(ANCHORS * 2)]
+            store.add_texts([f"filler text {round_} {i}" for i in range(len(ids))], ids=ids)
+            store.add_texts([anchor_text(round_ % ANCHORS)], metadatas=[{"anchor": round_ % ANCHORS}],
+                            ids=[f"anchor-{round_ % ANCHORS}"])
+            store.delete(ids=ids)
+            round_ += 1
+
+    def search(worker: int):
+        try:
+            for n in range(150):
+                i = (worker * 7 + n) % ANCHORS
+                doc = store.similarity_search(anchor_text(i), k=1)[0]
+                assert doc.metadata == {"anchor": i} and doc.page_content == anchor_text(i)
+                result = store.get(ids=[f"anchor-{i}"], include=["embeddings"])
+                assert np.allclose(result["embeddings"][0], HashingEmbeddings(64).embed_query(anchor_text(i)), atol=1e-6)
+        except BaseException as e:
+            errors.append(e)
+
+    writer = threading.Thread(target=churn)
+    readers = [threading.Thread(target=search, args=(worker,)) for worker in range(4)]
+    writer.start()
+    for reader in readers:
+        reader.start()
+    for reader in readers:
+        reader.join()
+    stop.set()
+    writer.join()
+    assert not errors, errors[0]
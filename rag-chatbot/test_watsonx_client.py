@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+"""
+Tests for the pooled watsonx client against a local stub HTTP server
+Run with: python -m pytest test_watsonx_client.py
+"""
+
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import watsonx_client
+from watsonx_client import WatsonxClient
+from watsonx_llm import WatsonxError, WatsonxLLMWrapper, iter_sse_events
+
+GENERATION_PATH = "/ml/v1/text/generation?version=2024-11-20"
+
+
+class StubWatsonx(ThreadingHTTPServer):
+    """IAM and text generation endpoints that answer from a script of statuses."""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.token_requests = 0
+        self.tokens_seen = []
+        # (status, headers) answered by the next generation requests, then 200s
+        self.script = []
+        self.stream_events = []
+        self.lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status: int, body: dict, headers: dict = None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        server = self.server
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        if self.path == "/identity/token":
+            with server.lock:
+                server.token_requests += 1
+                token = f"token-{server.token_requests}"
+            self.send_json(200, {"access_token": token, "expires_in": 3600})
+            return
+        with server.lock:
+            server.tokens_seen.append(self.headers.get("Authorization"))
+            status, headers = server.script.pop(0) if server.script else (200, {})
+        if status != 200:
+            self.send_json(status, {"error": "scripted"}, headers)
+        elif self.path.startswith("/ml/v1/text/generation_stream"):
+            body = "".join(f"data: {json.dumps(event)}\n\n" for event in server.stream_events).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        else:
+            self.send_json(200, {"results": [{"generated_text": "ok"}]})
+
+
+@pytest.fixture
+def stub():
+    server = StubWatsonx()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_client(stub, **kwargs) -> WatsonxClient:
+    return WatsonxClient("key", stub.url, iam_url=f"{stub.url}/identity/token", backoff_base=0.01, **kwargs)
+
+
+def test_token_is_cached_and_refreshed_near_expiry(stub):
+    client = make_client(stub)
+    for _ in range(3):
+        assert client.post(GENERATION_PATH, json={}).status_code == 200
+    assert stub.token_requests == 1
+    assert stub.tokens_seen == ["Bearer token-1"] * 3
+
+    # Inside the refresh margin: the next request exchanges the key again
+    client._token_expires_at = watsonx_client.time.time() + watsonx_client.TOKEN_REFRESH_MARGIN / 2
+    client.post(GENERATION_PATH, json={})
+    assert stub.token_requests == 2
+    assert stub.tokens_seen[-1] == "Bearer token-2"
+
+
+def test_401_refreshes_the_token_once(stub):
+    client = make_client(stub)
+    stub.script = [(401, {})]
+    assert client.post(GENERATION_PATH, json={}).status_code == 200
+    assert stub.tokens_seen == ["Bearer token-1", "Bearer token-2"]
+    assert client.stats()["token_refreshes"] == 2
+
+
+def test_connections_are_reused(stub):
+    client = make_client(stub)
+    for _ in range(5):
+        client.post(GENERATION_PATH, json={})
+    stats = client.stats()
+    # The IAM exchange and every generation request share one keep-alive connection
+    assert stats["connections_opened"] == 1
+    assert stats["requests"] == 5
+    assert stats["connection_reuse"] > 0.8
+
+
+def test_retries_429_and_5xx_with_jittered_backoff(stub, monkeypatch):
+    bounds = []
+
+    def uniform(low, high):
+        bounds.append((low, high))
+        return 0.0
+
+    monkeypatch.setattr(watsonx_client.random, "uniform", uniform)
+    client = make_client(stub, max_retries=3)
+    stub.script = [(429, {}), (503, {}), (500, {})]
+    assert client.post(GENERATION_PATH, json={}).status_code == 200
+    assert client.stats()["retries"] == 3
+    # Full jitter over an exponentially growing window
+    assert bounds == [(0, 0.01), (0, 0.02), (0, 0.04)]
+
+
+def test_retry_after_is_honoured_and_retries_are_bounded(stub, monkeypatch):
+    monkeypatch.setattr(watsonx_client.random, "uniform", lambda low, high: pytest.fail("jitter used despite Retry-After"))
+    client = make_client(stub, max_retries=2)
+    stub.script = [(429, {"Retry-After": "0"})] * 3
+    response = client.post(GENERATION_PATH, json={})
+    # Retries exhausted: the last error response is returned to the caller
+    assert response.status_code == 429
+    assert client.stats()["retries"] == 2
+    assert client.stats()["requests"] == 3
+
+
+def test_non_retryable_status_is_returned_immediately(stub):
+    client = make_client(stub)
+    stub.script = [(400, {})]
+    assert client.post(GENERATION_PATH, json={}).status_code == 400
+    assert client.stats()["retries"] == 0
+
+
+def test_sse_parsing():
+    lines = [
+        ": comment",
+        'data: {"results": [{"generated_text": "Hel"}]}',
+        "",
+        "event: message",
+        'data: {"results": ',
+        'data: [{"generated_text": "lo"}]}',
+        "",
+        "",
+        "data: [DONE]",
+        "",
+        'data: {"results": [{"generated_text": "!"}]}',
+    ]
+    texts = [event["results"][0]["generated_text"] for event in iter_sse_events(iter(lines))]
+    assert texts == ["Hel", "lo", "!"]
+
+
+def test_streaming_llm_reads_tokens_from_the_stub(stub):
+    stub.stream_events = [{"results": [{"generated_text": token}]} for token in ("Steel ", "", "beams")]
+    llm = WatsonxLLMWrapper(
+        api_key="stream-key", url=stub.url, iam_url=f"{stub.url}/identity/token",
+        project_id="project", model_id="model",
+    )
+    assert [chunk.text for chunk in llm._stream("question")] == ["Steel ", "beams"]
+    assert llm.invoke("question") == "Steel beams"
+
+    stub.script = [(400, {})]
+    with pytest.raises(WatsonxError) as error:
+        llm.invoke("question")
+    assert error.value.status_code == 400
@@ -0,0 +1,225 @@
+"""
+Request tracing
+---------------
+Lightweight spans around the stages of a request (loading PDFs, building the
+index, retrieval, the LLM call, saving history), so a slow answer can be
+attributed to a stage. Each span records wall time plus whatever counters the
+stage knows (tokens in/out, bytes sent/received, chunks...).
+
+    with tracing.trace("question", query=prompt):
+        with tracing.span("retrieve") as attrs:
+            ...
+            attrs["chunks"] = len(docs)
+
+Spans nest through a context variable; a span opened outside a trace starts
+its own one-span trace. LangChain retriever and LLM runs are traced by
+passing `callback_handlers.TracingCallbackHandler()` in the chain's callbacks.
+This module itself imports nothing heavy, so it is safe to use at startup.
+
+Finished traces are kept in memory (the last MAX_TRACES) and every stage's
+duration feeds a rolling window for p50/p95/p99. Traces export as JSONL or in
+the Chrome trace event format (load in chrome://tracing or ui.perfetto.dev).
+"""
+
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Optional
+
+TRACING_ENABLED = os.getenv("TRACING", "1") != "0"
+MAX_TRACES = 200
+STAGE_WINDOW = 500
+
+
+class Trace:
+    """One request: a name, its wall-clock start and a flat list of finished spans."""
+
+    _ids = iter(range(1, 1 << 62))
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.id = next(Trace._ids)
+        self.name = name
+        self.attrs = attrs
+        self.started_at = time.time()
+        self.t0 = time.perf_counter()
+        self.spans: List[Dict[str, Any]] = []
+        self.duration_ms = 0.0
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "started_at": self.started_at,
+            "duration_ms": round(self.duration_ms, 2),
+            "attrs": self.attrs,
+            "spans": self.spans,
+        }
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+_current_span: ContextVar[Optional[Dict[str, Any]]] = ContextVar("current_span", default=None)
+
+_lock = threading.Lock()
+_traces: deque = deque(maxlen=MAX_TRACES)
+_stage_durations: Dict[str, deque] = {}
+
+
+def percentile(values: List[float], pct: float) -> float:
+    """Return the `pct` percentile (0-100) of `values` by nearest rank."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def _record_stage(name: str, duration_ms: float):
+    with _lock:
+        _stage_durations.setdefault(name, deque(maxlen=STAGE_WINDOW)).append(duration_ms)
+
+
+@contextmanager
+def trace(name: str, **attrs) -> Iterator[Dict[str, Any]]:
+    """Start a trace for one request; yields its (mutable) attributes."""
+    if not TRACING_ENABLED or _current_trace.get() is not None:
+        # Already inside a trace: behave like a span
+        with span(name, **attrs) as span_attrs:
+            yield span_attrs
+        return
+    current = Trace(name, attrs)
+    token = _current_trace.set(current)
+    try:
+        yield current.attrs
+    finally:
+        _current_trace.reset(token)
+        current.duration_ms = (time.perf_counter() - current.t0) * 1000
+        _record_stage(name, current.duration_ms)
+        with _lock:
+            _traces.append(current)
+
+
+@contextmanager
+def span(name: str, **attrs) -> Iterator[Dict[str, Any]]:
+    """Time one stage of the current trace; yields its (mutable) attributes."""
+    if not TRACING_ENABLED:
+        yield attrs
+        return
+    if _current_trace.get() is None:
+        with trace(name, **attrs) as trace_attrs:
+            yield trace_attrs
+        return
+    handle = open_span(name, **attrs)
+    try:
+        yield handle["attrs"]
+    finally:
+        close_span(handle)
+
+
+def open_span(name: str, **attrs) -> Optional[Dict[str, Any]]:
+    """Start a span that is closed later with `close_span` (for callback-style hooks)."""
+    current = _current_trace.get()
+    if not TRACING_ENABLED or current is None:
+        return None
+    parent = _current_span.get()
+    handle = {"trace": current, "name": name, "attrs": attrs, "depth": parent["depth"] + 1 if parent else 0}
+    handle["token"] = _current_span.set(handle)
+    handle["start"] = time.perf_counter()
+    return handle
+
+
+def close_span(handle: Optional[Dict[str, Any]]):
+    if handle is None:
+        return
+    end = time.perf_counter()
+    try:
+        _current_span.reset(handle["token"])
+    except ValueError:
+        # Closed from another context (e.g. a callback on a worker thread)
+        pass
+    current: Trace = handle["trace"]
+    duration_ms = (end - handle["start"]) * 1000
+    current.spans.append({
+        "name": handle["name"],
+        "start_ms": round((handle["start"] - current.t0) * 1000, 2),
+        "duration_ms": round(duration_ms, 2),
+        "depth": handle["depth"],
+        "attrs": handle["attrs"],
+    })
+    _record_stage(handle["name"], duration_ms)
+
+
+def set_attrs(**attrs):
+    """Add attributes to the innermost open span (or the trace) from code without a handle."""
+    handle = _current_span.get()
+    if handle is not None:
+        handle["attrs"].update(attrs)
+        return
+    current = _current_trace.get()
+    if current is not None:
+        current.attrs.update(attrs)
+
+
+def traced(name: str):
+    """Decorator: run the function inside `span(name)`."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def reset():
+    """Forget finished traces and stage durations (e.g. between load-test runs)."""
+    with _lock:
+        _traces.clear()
+        _stage_durations.clear()
+
+
+def recent_traces(limit: int = MAX_TRACES) -> List[Dict[str, Any]]:
+    """Return the most recent finished traces, newest first."""
+    with _lock:
+        traces = list(_traces)[-limit:]
+    return [t.as_dict() for t in reversed(traces)]
+
+
+def stage_percentiles() -> Dict[str, Dict[str, float]]:
+    """Rolling p50/p95/p99 (ms) per stage over the last STAGE_WINDOW occurrences."""
+    with _lock:
+        windows = {name: list(values) for name, values in _stage_durations.items()}
+    return {
+        name: {
+            "count": len(values),
+            "p50_ms": round(percentile(values, 50), 1),
+            "p95_ms": round(percentile(values, 95), 1),
+            "p99_ms": round(percentile(values, 99), 1),
+        }
+        for name, values in sorted(windows.items())
+    }
+
+
+def export_jsonl(traces: List[Dict[str, Any]]) -> str:
+    return "".join(json.dumps(t, default=str) + "\n" for t in traces)
+
+
+def export_chrome_trace(traces: List[Dict[str, Any]]) -> str:
+    """Chrome trace event format: one complete ("X") event per span, one row per trace."""
+    events = []
+    for t in traces:
+        base_us = t["started_at"] * 1e6
+        events.append({
+            "name": t["name"], "ph": "X", "pid": 1, "tid": t["id"],
+            "ts": base_us, "dur": t["duration_ms"] * 1000, "args": t["attrs"],
+        })
+        for s in t["spans"]:
+            events.append({
+                "name": s["name"], "ph": "X", "pid": 1, "tid": t["id"],
+                "ts": base_us + s["start_ms"] * 1000, "dur": s["duration_ms"] * 1000, "args": s["attrs"],
+            })
+    return json.dumps({"traceEvents": events, "displayTimeUnit": "ms"}, default=str)
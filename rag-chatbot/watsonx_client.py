@@ -0,0 +1,214 @@
+"""
+Pooled HTTP client for IBM watsonx
+----------------------------------
+One keep-alive `requests.Session` per process instead of a fresh TLS
+connection per question, plus:
+
+- IAM token exchange (API key -> access token, as in test_api.py), with the
+  access token cached until shortly before it expires
+- retries with jittered exponential backoff on 429 and 5xx responses and on
+  connection errors, honouring `Retry-After`
+- counters for requests, retries, token refreshes and connection reuse
+
+`iam_url` and `url` can point at a local stub server for testing.
+"""
+
+import os
+import random
+import socket
+import threading
+import time
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_IAM_URL = "https://iam.cloud.ibm.com/identity/token"
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Refresh the access token this many seconds before it expires
+TOKEN_REFRESH_MARGIN = 60
+
+
+class WatsonxClient:
+    """Thread-safe watsonx HTTP client with connection pooling and token caching."""
+
+    def __init__(
+        self,
+        api_key: str,
+        url: str,
+        iam_url: str = DEFAULT_IAM_URL,
+        pool_size: int = 10,
+        connect_timeout: float = 5.0,
+        read_timeout: float = 60.0,
+        max_retries: int = 3,
+        backoff_base: float = 0.5,
+        backoff_cap: float = 8.0,
+    ):
+        self.api_key = api_key
+        self.url = url.rstrip("/")
+        self.iam_url = iam_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self._token: Optional[str] = None
+        self._token_expires_at = 0.0
+        self._token_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self.requests_sent = 0
+        self.retries = 0
+        self.token_refreshes = 0
+
+    # -- IAM token -----------------------------------------------------------
+
+    def _fetch_token(self):
+        response = self.session.post(
+            self.iam_url,
+            headers={"Content-Type": "application/x-www-form-urlencoded"},
+            data={"grant_type": "urn:ibm:params:oauth:grant-type:apikey", "apikey": self.api_key},
+            timeout=self.timeout,
+        )
+        if response.status_code != 200:
+            raise RuntimeError(f"IAM token error: {response.status_code} - {response.text}")
+        data = response.json()
+        now = time.time()
+        self._token = data["access_token"]
+        # IAM returns both an absolute `expiration` and a relative `expires_in`
+        if "expiration" in data:
+            self._token_expires_at = float(data["expiration"])
+        else:
+            self._token_expires_at = now + float(data.get("expires_in", 3600))
+        with self._stats_lock:
+            self.token_refreshes += 1
+
+    def access_token(self, force_refresh: bool = False) -> str:
+        """Return a cached IAM access token, refreshing it near expiry."""
+        with self._token_lock:
+            if force_refresh or not self._token or time.time() >= self._token_expires_at - TOKEN_REFRESH_MARGIN:
+                self._fetch_token()
+            return self._token
+
+    # -- requests ------------------------------------------------------------
+
+    def _backoff(self, attempt: int, response: Optional[requests.Response]) -> float:
+        if response is not None:
+            retry_after = response.headers.get("Retry-After")
+            if retry_after:
+                try:
+                    return min(float(retry_after), self.backoff_cap)
+                except ValueError:
+                    pass
+        # Full jitter: uniform in [0, min(cap, base * 2^attempt)]
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+
+    def post(self, path: str, json: dict, stream: bool = False) -> requests.Response:
+        """POST to the watsonx API, retrying 429/5xx and connection errors.
+
+        Returns the final response (which may still be an error status once
+        retries are exhausted); raises the last connection error otherwise.
+        """
+        refreshed_after_401 = False
+        attempt = 0
+        while True:
+            headers = {
+                "Authorization": f"Bearer {self.access_token()}",
+                "Content-Type": "application/json",
+            }
+            if stream:
+                headers["Accept"] = "text/event-stream"
+            response = None
+            try:
+                with self._stats_lock:
+                    self.requests_sent += 1
+                response = self.session.post(
+                    f"{self.url}{path}", headers=headers, json=json, stream=stream, timeout=self.timeout
+                )
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt >= self.max_retries:
+                    raise
+            else:
+                if response.status_code == 401 and not refreshed_after_401:
+                    # The cached token may have been revoked; refresh once
+                    response.close()
+                    refreshed_after_401 = True
+                    self.access_token(force_refresh=True)
+                    continue
+                if response.status_code not in RETRY_STATUSES or attempt >= self.max_retries:
+                    return response
+                response.close()
+
+            time.sleep(self._backoff(attempt, response))
+            attempt += 1
+            with self._stats_lock:
+                self.retries += 1
+
+    # -- metrics -------------------------------------------------------------
+
+    def connection_stats(self) -> Dict[str, int]:
+        """Return connections opened vs requests served by the urllib3 pools."""
+        opened = served = 0
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is not None:
+                    opened += pool.num_connections
+                    served += pool.num_requests
+        return {"connections_opened": opened, "pool_requests": served}
+
+    def stats(self) -> Dict[str, float]:
+        conn = self.connection_stats()
+        reuse = 1 - conn["connections_opened"] / conn["pool_requests"] if conn["pool_requests"] else 0.0
+        with self._stats_lock:
+            return {
+                "requests": self.requests_sent,
+                "retries": self.retries,
+                "token_refreshes": self.token_refreshes,
+                "connections_opened": conn["connections_opened"],
+                "connection_reuse": round(reuse, 3),
+            }
+
+
+def abort_response(response: requests.Response):
+    """Unblock a thread reading a streamed `response` and drop its connection.
+
+    `response.close()` does not wake a read blocked in another thread; shutting
+    the socket down does, and urllib3 then discards the broken connection
+    instead of returning it to the pool.
+    """
+    raw = response.raw
+    sock = getattr(getattr(raw, "connection", None), "sock", None)
+    if sock is None:
+        # http.client hands the socket to the response when the connection won't be reused
+        sock = getattr(getattr(getattr(getattr(raw, "_fp", None), "fp", None), "raw", None), "_sock", None)
+    if sock is not None:
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+
+_clients: Dict[tuple, WatsonxClient] = {}
+_clients_lock = threading.Lock()
+
+
+def get_watsonx_client(api_key: str, url: str, iam_url: Optional[str] = None) -> WatsonxClient:
+    """Return the process-wide client for these credentials."""
+    iam_url = iam_url or os.getenv("WATSONX_IAM_URL", DEFAULT_IAM_URL)
+    key = (api_key, url, iam_url)
+    with _clients_lock:
+        if key not in _clients:
+            _clients[key] = WatsonxClient(
+                api_key,
+                url,
+                iam_url=iam_url,
+                read_timeout=float(os.getenv("WATSONX_TIMEOUT", "60")),
+                max_retries=int(os.getenv("WATSONX_MAX_RETRIES", "3")),
+            )
+        return _clients[key]
@@ -0,0 +1,141 @@
+"""
+IBM watsonx LLM wrapper
+-----------------------
+Simple HTTP-based IBM watsonx integration for LangChain. Requests go through
+the pooled, token-caching client in watsonx_client.py.
+
+With `streaming=True` (the default) the answer is read from the
+`/ml/v1/text/generation_stream` server-sent events endpoint and every token is
+forwarded to the callback manager as it arrives, so the chat UI can render
+tokens immediately instead of waiting for the full answer.
+
+HTTP errors raise `WatsonxError` (connection errors propagate from
+`requests`) rather than being returned as the answer text, so callers and the
+LLM router can tell a failure from an answer. The router can also abort a
+stream it has cancelled (see `on_abort` in `_stream`).
+"""
+
+import json
+import os
+from typing import Any, Callable, ClassVar, Iterator, List, Optional
+
+from langchain_core.callbacks import CallbackManagerForLLMRun
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+from langchain_core.pydantic_v1 import Field
+
+from watsonx_client import DEFAULT_IAM_URL, WatsonxClient, abort_response, get_watsonx_client
+
+API_VERSION = "2024-11-20"
+
+
+class WatsonxError(RuntimeError):
+    """A non-200 response from the watsonx text generation API."""
+
+    def __init__(self, status_code: int, text: str):
+        super().__init__(f"Error: {status_code} - {text}")
+        self.status_code = status_code
+
+
+def iter_sse_events(lines: Iterator[str]) -> Iterator[dict]:
+    """Parse a server-sent events stream into the JSON payloads of its `data:` lines."""
+    data_lines: List[str] = []
+    for line in lines:
+        if line is None:
+            continue
+        if line == "":
+            # A blank line ends the event
+            if data_lines:
+                payload = "\n".join(data_lines)
+                data_lines = []
+                if payload.strip() and payload.strip() != "[DONE]":
+                    yield json.loads(payload)
+            continue
+        if line.startswith("data:"):
+            data_lines.append(line[5:].lstrip())
+    if data_lines:
+        payload = "\n".join(data_lines)
+        if payload.strip() and payload.strip() != "[DONE]":
+            yield json.loads(payload)
+
+
+class WatsonxLLMWrapper(LLM):
+    api_key: str = Field(default_factory=lambda: os.getenv("WATSONX_API_KEY", ""))
+    url: str = Field(default_factory=lambda: os.getenv("WATSONX_URL", ""))
+    project_id: str = Field(default_factory=lambda: os.getenv("WATSONX_PROJECT_ID", ""))
+    model_id: str = Field(default_factory=lambda: os.getenv("WATSONX_MODEL_ID", ""))
+    iam_url: str = Field(default_factory=lambda: os.getenv("WATSONX_IAM_URL", DEFAULT_IAM_URL))
+    streaming: bool = True
+    # `_stream` takes the router's `on_abort` hook (see llm_router.py)
+    supports_abort: ClassVar[bool] = True
+
+    @property
+    def _llm_type(self) -> str:
+        return "watsonx"
+
+    @property
+    def client(self) -> WatsonxClient:
+        # The API key is exchanged for a cached IAM access token by the client
+        return get_watsonx_client(self.api_key, self.url, self.iam_url)
+
+    def _payload(self, prompt: str, stop: Optional[List[str]] = None) -> dict:
+        parameters = {
+            "temperature": 0.1,
+            "max_new_tokens": 1024
+        }
+        if stop:
+            parameters["stop_sequences"] = stop
+        return {
+            "model_id": self.model_id,
+            "input": prompt,
+            "parameters": parameters,
+            "project_id": self.project_id
+        }
+
+    def _stream(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        on_abort: Optional[Callable[[Callable[[], None]], None]] = None,
+        **kwargs: Any,
+    ) -> Iterator[GenerationChunk]:
+        """Stream tokens; `on_abort`, if given, receives a callback that tears the stream down."""
+        response = self.client.post(
+            f"/ml/v1/text/generation_stream?version={API_VERSION}",
+            json=self._payload(prompt, stop),
+            stream=True
+        )
+        if on_abort is not None:
+            on_abort(lambda: abort_response(response))
+        with response:
+            if response.status_code != 200:
+                raise WatsonxError(response.status_code, response.text)
+            for event in iter_sse_events(response.iter_lines(decode_unicode=True)):
+                text = event.get("results", [{}])[0].get("generated_text", "")
+                if not text:
+                    continue
+                chunk = GenerationChunk(text=text)
+                if run_manager:
+                    run_manager.on_llm_new_token(text, chunk=chunk)
+                yield chunk
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        if self.streaming:
+            return "".join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs))
+
+        # Try the correct IBM watsonx endpoint
+        response = self.client.post(
+            f"/ml/v1/text/generation?version={API_VERSION}",
+            json=self._payload(prompt, stop)
+        )
+        if response.status_code != 200:
+            raise WatsonxError(response.status_code, response.text)
+        result = response.json()
+        return result.get("results", [{}])[0].get("generated_text", "No response generated")